@@ -0,0 +1,186 @@
+"""
+API de admin (/admin), ligada só com ADMIN_TOKEN (cabeçalho `Authorization: Bearer <token>`).
+- GET  /admin/ledger?tenant=&outcome=&hours=|since=&until=&limit=&cursor=&full=1
+       mensagens tratadas, da mais recente para a mais antiga, paginadas por chave (`next_cursor`).
+- GET  /admin/message?tenant=&id=<Message-ID>
+       todas as passagens da mensagem pelo watcher (decisão, confiança, tokens, tempo por etapa),
+       se está marcada como processada e a falha em aberto, se houver.
+- GET  /admin/queue
+       por caixa: fila do LLM, ritmo, pedidos de reprocessamento e mensagens em backoff; e a fila durável.
+- POST /admin/replay  {"tenant", "outcome": "escalado"|"ignorado", "hours"|"since"/"until" ou "message_ids",
+                       "limit", "wait": s, "dry_run"}
+       devolve as mensagens à INBOX para passarem de novo pelo pipeline (triagem, pool do LLM, ritmo da caixa)
+       e responde em NDJSON: uma linha por mensagem reenfileirada e, com `wait`, uma linha por resultado novo
+       no ledger assim que ele é gravado, e por fim o resumo.
+Flask só é importado por quem monta o blueprint (create_http_app).
+"""
+import hmac
+import json
+import time
+from collections import Counter
+
+from state_store import LEDGER_COLUMNS
+
+REPLAY_OUTCOMES = ("escalado", "ignorado")  # "respondido" de novo mandaria outra resposta ao aluno
+LIST_COLUMNS = tuple(c for c in LEDGER_COLUMNS if c not in ("question", "reply"))
+RESULT_COLUMNS = ("message_id", "outcome", "action", "confidence", "route", "route_reason", "error",
+                  "llm_ms", "total_ms", "created_at")
+MAX_WAIT = 900
+
+
+class _BadRequest(ValueError):
+    pass
+
+
+def _period(get, now=None):
+    """(since, until) a partir de `hours` ou `since`/`until` (epoch)."""
+    now = time.time() if now is None else now
+    try:
+        hours, since, until = (None if get(k) in (None, "") else float(get(k)) for k in ("hours", "since", "until"))
+    except (TypeError, ValueError):
+        raise _BadRequest("hours/since/until devem ser números")
+    if hours is not None:
+        since = now - hours * 3600
+    return since, until
+
+
+def _cursor(raw):
+    if not raw:
+        return None
+    try:
+        created, _, rowid = raw.rpartition(":")
+        return float(created), int(rowid)
+    except ValueError:
+        raise _BadRequest("cursor inválido")
+
+
+def create_admin_blueprint(token, tenants, replay, queue_stats, replay_max=200, poll=1.0):
+    """
+    `tenants()` -> caixas abertas; `replay(caixa, desfecho, message_ids)` -> {message_id: uid|None}
+    (request_replay do app); `queue_stats(caixa)` -> dict para o /admin/queue.
+    """
+    from flask import Blueprint, Response, jsonify, request
+
+    bp = Blueprint("admin", __name__, url_prefix="/admin")
+    expected = f"Bearer {token}".encode()
+
+    @bp.before_request
+    def authorize():
+        if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), expected):
+            return jsonify({"error": "não autorizado"}), 401
+
+    @bp.errorhandler(_BadRequest)
+    def bad_request(e):
+        return jsonify({"error": str(e)}), 400
+
+    def tenant_arg(name):
+        boxes = tenants()
+        if not boxes or any(t.store is None for t in boxes):
+            raise _BadRequest("caixas ainda subindo (ver /status)")
+        if not name and len(boxes) == 1:
+            return boxes[0]
+        for t in boxes:
+            if t.name == name:
+                return t
+        raise _BadRequest(f"informe tenant: {', '.join(t.name for t in boxes)}")
+
+    @bp.get("/ledger")
+    def ledger():
+        args = request.args
+        tenant = tenant_arg(args.get("tenant"))
+        since, until = _period(args.get)
+        limit = max(1, min(500, args.get("limit", 50, type=int)))
+        rows, nxt = tenant.store.ledger_page(
+            outcome=args.get("outcome") or None, since=since, until=until, cursor=_cursor(args.get("cursor")),
+            limit=limit, columns=LEDGER_COLUMNS if args.get("full") == "1" else LIST_COLUMNS)
+        return jsonify({"tenant": tenant.name, "items": rows,
+                        "next_cursor": f"{nxt[0]!r}:{nxt[1]}" if nxt else None})
+
+    @bp.get("/message")
+    def message():
+        tenant = tenant_arg(request.args.get("tenant"))
+        msgid = request.args.get("id") or ""
+        rows = tenant.store.ledger_for(msgid)
+        if not rows:
+            return jsonify({"error": "mensagem não está no ledger", "message_id": msgid}), 404
+        failed = tenant.store.failure(msgid)
+        return jsonify({"tenant": tenant.name, "message_id": msgid,
+                        "processed": tenant.store.already_processed(msgid),
+                        "failure": {"attempts": failed[0], "failed_at": failed[1]} if failed else None,
+                        "passes": rows})
+
+    @bp.get("/queue")
+    def queue():
+        return jsonify({"tenants": [dict(queue_stats(t), name=t.name, replays_waiting=t.replays.qsize(),
+                                         failures=t.store.failures() if t.store else [])
+                                    for t in tenants()]})
+
+    @bp.post("/replay")
+    def replay_messages():
+        body = request.get_json(silent=True) or {}
+        tenant = tenant_arg(body.get("tenant"))
+        outcome = body.get("outcome", "escalado")
+        if outcome not in REPLAY_OUTCOMES:
+            raise _BadRequest(f"outcome deve ser um de: {', '.join(REPLAY_OUTCOMES)}")
+        try:
+            limit = max(1, min(replay_max, int(body.get("limit", replay_max))))
+            wait = max(0.0, min(MAX_WAIT, float(body.get("wait", 0))))
+        except (TypeError, ValueError):
+            raise _BadRequest("limit/wait devem ser números")
+        explicit = body.get("message_ids")
+        if explicit is not None and (not isinstance(explicit, list) or not all(isinstance(m, str) for m in explicit)):
+            raise _BadRequest("message_ids deve ser uma lista de Message-IDs")
+        since, until = _period(body.get)
+        if explicit is None and since is None:
+            raise _BadRequest("informe message_ids ou o período (hours/since)")
+        return Response(_replay_stream(tenant, outcome, explicit, since, until, limit, wait,
+                                       bool(body.get("dry_run"))),
+                        mimetype="application/x-ndjson")
+
+    def _replay_stream(tenant, outcome, explicit, since, until, limit, wait, dry_run):
+        line = lambda d: json.dumps(dict(d, tenant=tenant.name), ensure_ascii=False) + "\n"
+        counts = Counter()
+        if explicit is None:
+            ids = tenant.store.replay_candidates(outcome, since, until, limit)
+        else:
+            latest, ids = tenant.store.latest_outcomes(explicit[:limit]), []
+            for m in dict.fromkeys(explicit[:limit]):
+                if latest.get(m) != outcome:
+                    status = "skipped" if m in latest else "unknown"
+                    counts[status] += 1
+                    yield line({"message_id": m, "status": status, "outcome": latest.get(m)})
+                else:
+                    ids.append(m)
+        if dry_run or not ids:
+            for m in ids:
+                counts["candidate"] += 1
+                yield line({"message_id": m, "status": "candidate"})
+            yield line({"summary": dict(counts)})
+            return
+
+        after = tenant.store.last_ledger_id()
+        try:
+            result = replay(tenant, outcome, ids)
+        except Exception as e:
+            yield line({"status": "error", "error": str(e), "message_ids": ids})
+            return
+        waiting = set()
+        for m, uid in result.items():
+            status = "requeued" if uid else "not_found"
+            counts[status] += 1
+            if uid:
+                waiting.add(m)
+            yield line({"message_id": m, "status": status, "uid": uid})
+
+        deadline = time.monotonic() + wait
+        while waiting and time.monotonic() < deadline:
+            time.sleep(min(poll, max(0, deadline - time.monotonic())))
+            for row in tenant.store.ledger_after(after, columns=RESULT_COLUMNS):
+                after = row.pop("id")
+                if row["message_id"] in waiting:
+                    waiting.discard(row["message_id"])
+                    counts["done"] += 1
+                    yield line(dict(row, status="done"))
+        yield line({"summary": dict(counts, pending=len(waiting))})
+
+    return bp
@@ -1,20 +1,33 @@
-import os, ssl, time, json, sqlite3, smtplib, email, re, base64
+import os, time, json, email, re, socket, signal, queue
 import imaplib
 from email import policy
 from email.parser import BytesParser
-from email.message import EmailMessage
-from markdown import markdown
 from dotenv import load_dotenv
 from pathlib import Path
-from prompts import SYSTEM_PROMPT, USER_TEMPLATE
+from prompts import SYSTEM_PROMPT, USER_TEMPLATE, EXAMPLES_TEMPLATE, EXAMPLE_TEMPLATE
+from logutil import log
+from imap_session import ImapSession, SessionClosed
+from sent_archiver import SentArchiver
+from reply_renderer import ReplyRenderer
+from response_cache import ResponseCache, fingerprint, code_fingerprint
+from ticket_index import TicketIndex
+from state_store import StateStore
+from tenants import TENANT_KEYS, load_tenants
+from llm_pool import FairPool
+from pacing import Pacer
+from work_queue import SqliteWorkQueue
+from cobol_context import build_context
+from triage import classify
+from threads import group_threads, merge_messages
+from mime_fetch import (CODE_EXTENSIONS, parse_fetch_response, body_parts, plan_parts,
+                        fetch_item, parse_partial, html_to_text, assemble)
+import metrics
 
-# Gmail OAuth
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
+# Gmail OAuth (google-auth só é importado na primeira leitura do token)
+from gmail_sender import GmailSender, SendUncertain
 
-# Web server (Render Free)
-from flask import Flask, jsonify
-from threading import Thread
+from threading import Thread, Event, Lock
+from concurrent.futures import as_completed
 
 # ========= Carrega .env =========
 load_dotenv(dotenv_path=Path(__file__).with_name(".env"))
@@ -22,6 +35,7 @@ load_dotenv(dotenv_path=Path(__file__).with_name(".env"))
 # -------- IMAP (leitura) no HostGator --------
 IMAP_HOST = os.getenv("IMAP_HOST")
 IMAP_PORT = int(os.getenv("IMAP_PORT", "993"))
+IMAP_SSL = os.getenv("IMAP_SSL", "true").lower() == "true"  # false só para servidores locais (bench)
 MAIL_USER = os.getenv("MAIL_USER")   # suporte@aprendacobol.com.br
 MAIL_PASS = os.getenv("MAIL_PASS")   # senha do HostGator
 
@@ -31,21 +45,53 @@ GMAIL_EMAIL = os.getenv("GMAIL_EMAIL")             # seu gmail (remetente técni
 GOOGLE_CLIENT_SECRET_FILE = os.getenv("GOOGLE_CLIENT_SECRET_FILE", "credentials.json")
 GOOGLE_TOKEN_FILE = os.getenv("GOOGLE_TOKEN_FILE", "token.json")
 SMTP_DEBUG_ON = os.getenv("SMTP_DEBUG","0") == "1"
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
 
 # -------- LLM local --------
 LLM_BACKEND = os.getenv("LLM_BACKEND","ollama")
 OLLAMA_HOST = os.getenv("OLLAMA_HOST","http://127.0.0.1:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL","llama3.1:8b")
-if LLM_BACKEND == "ollama":
-    from ollama_client import OllamaClient
+# chamadas simultâneas ao LLM; alinhe com o OLLAMA_NUM_PARALLEL do servidor
+LLM_WORKERS = int(os.getenv("LLM_WORKERS") or os.getenv("OLLAMA_NUM_PARALLEL") or "2")
+# cache de respostas por conteúdo (mesma dúvida/código -> mesmo veredicto, sem chamar o modelo)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "true").lower() == "true"
+LLM_CACHE_TTL = int(float(os.getenv("LLM_CACHE_TTL_HOURS", "168")) * 3600)
+LLM_CACHE_MAX = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "true").lower() == "true"  # para de gerar quando o JSON fecha
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # tempo que o modelo fica carregado após a última chamada
+OLLAMA_NUM_CTX = os.getenv("OLLAMA_NUM_CTX")        # vazio = padrão do modelo
+OLLAMA_NUM_PREDICT = os.getenv("OLLAMA_NUM_PREDICT")
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "true").lower() == "true"
+# orçamento do prompt (tokens estimados): texto do e-mail e trechos de código escolhidos pelo cobol_context
+PROMPT_TEXT_TOKENS = int(os.getenv("PROMPT_TEXT_TOKENS", "1000"))
+PROMPT_CODE_TOKENS = int(os.getenv("PROMPT_CODE_TOKENS", "2000"))
+# casos já respondidos (ledger) injetados como exemplos; 0 desliga
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "2"))
+from ollama_client import OllamaClient, GenerationCancelled
 
 # -------- Comportamento --------
-CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL_SECONDS", "60"))
+CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL_SECONDS", "60"))  # teto de espera no IDLE antes de ressincronizar
+IMAP_NOOP_INTERVAL = int(os.getenv("IMAP_NOOP_INTERVAL_SECONDS", "10"))  # só se o servidor não tiver IDLE
+IMAP_BACKOFF_MAX = int(os.getenv("IMAP_BACKOFF_MAX_SECONDS", "300"))
 FOLDER_PROCESSED = os.getenv("FOLDER_PROCESSED", "Respondidos")
 FOLDER_ESCALATE = os.getenv("FOLDER_ESCALATE", "Escalar")
 CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.65"))
 EXPUNGE_AFTER_COPY = os.getenv("EXPUNGE_AFTER_COPY","false").lower() == "true"
-LOG_LEVEL = os.getenv("LOG_LEVEL","info").lower()
+IMAP_FETCH_BATCH = int(os.getenv("IMAP_FETCH_BATCH", "50"))  # UIDs por UID FETCH de corpo
+# quanto de cada mensagem é baixado/decodificado (bytes): texto e anexos de código, separadamente
+MAIL_TEXT_BUDGET = int(os.getenv("MAIL_TEXT_BUDGET_BYTES", "16000"))
+MAIL_CODE_BUDGET = int(os.getenv("MAIL_CODE_BUDGET_BYTES", "65536"))  # o prompt leva só os trechos relevantes
+TRIAGE_ENABLED = os.getenv("TRIAGE", "true").lower() == "true"  # regras antes do LLM (auto-reply, bounce, fora de COBOL…)
+THREAD_GROUPING = os.getenv("THREAD_GROUPING", "true").lower() == "true"  # uma resposta por conversa
+THREAD_DEBOUNCE = float(os.getenv("THREAD_DEBOUNCE_SECONDS", "5"))  # respostas esperam por mais mensagens da mesma conversa
+THREAD_MAX_WAIT = float(os.getenv("THREAD_MAX_WAIT_SECONDS", "300"))  # teto de espera para uma conversa que não para
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "0")) or 4 * LLM_WORKERS  # mensagens em voo por caixa
+CYCLE_TARGET = float(os.getenv("CYCLE_TARGET_SECONDS", "60"))  # duração alvo de um lote na vazão medida do LLM
+MESSAGE_MAX_ATTEMPTS = int(os.getenv("MESSAGE_MAX_ATTEMPTS", "3"))  # falhas de uma mensagem antes de ir para Escalar
+MESSAGE_RETRY_BACKOFF = float(os.getenv("MESSAGE_RETRY_BACKOFF_SECONDS", "60"))  # dobra a cada falha
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "20"))  # SIGTERM: tempo para terminar o lote em andamento
 SENT_FOLDER = os.getenv("SENT_FOLDER", "Sent")  # o código descobre INBOX.Sent/Enviados
 
 # -------- Assinatura --------
@@ -53,59 +99,153 @@ SIGNATURE_NAME = os.getenv("SIGNATURE_NAME", "Equipe Aprenda COBOL — Suporte")
 SIGNATURE_FOOTER = os.getenv("SIGNATURE_FOOTER", "Se precisar, responda este e-mail com mais detalhes ou anexe seu arquivo .COB/.CBL.\nHorário de atendimento: 9h–18h (ET), seg–sex.")
 SIGNATURE_LINKS = os.getenv("SIGNATURE_LINKS", "")
 
-DB_PATH = "state.db"
+DB_PATH = os.getenv("STATE_DB", "state.db")
 
-# ========= Utils =========
-def log(level, *args):
-    levels = {"debug":0,"info":1,"warn":2,"error":3}
-    if levels[level] >= levels.get(LOG_LEVEL,1):
-        print(f"[{level.upper()}]", *args)
+# -------- Várias caixas (tenants.py) --------
+TENANTS_FILE = os.getenv("TENANTS_FILE")  # JSON com as caixas; vazio = uma caixa só com as variáveis acima
+LLM_MAX_PARALLEL = int(os.getenv("LLM_MAX_PARALLEL_PER_TENANT", "0"))  # 0 = até LLM_WORKERS
+LLM_QUOTA_PER_HOUR = int(os.getenv("LLM_QUOTA_PER_HOUR", "0"))          # por caixa; 0 = sem cota
+# -------- Vários nós (work_queue.py) --------
+ROLE = os.getenv("ROLE", "all").lower()      # all | fetcher (só IMAP/SMTP) | worker (só LLM)
+WORK_QUEUE_DB = os.getenv("WORK_QUEUE_DB")   # SQLite compartilhado entre os nós; vazio = um nó, pool local
+NODE_ID = os.getenv("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+WORK_VISIBILITY = int(os.getenv("WORK_VISIBILITY_SECONDS", "900"))  # lease de uma tarefa antes de voltar à fila
+WORK_MAX_ATTEMPTS = int(os.getenv("WORK_MAX_ATTEMPTS", "3"))
+WORK_POLL = float(os.getenv("WORK_POLL_SECONDS", "2"))
+LEADER_TTL = int(os.getenv("LEADER_TTL_SECONDS", "120"))  # validade da trava de fetcher (renovada a cada ciclo)
+# -------- API de admin (admin_api.py) --------
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # vazio = /admin desligado
+REPLAY_MAX = int(os.getenv("REPLAY_MAX_MESSAGES", "200"))  # mensagens por pedido de reprocessamento
+REPLAY_TIMEOUT = float(os.getenv("REPLAY_TIMEOUT_SECONDS", "60"))  # espera pelo watcher da caixa atender o pedido
+# o que o TENANTS_FILE não disser vem daqui
+TENANT_DEFAULTS = dict(zip(TENANT_KEYS, (
+    IMAP_HOST, IMAP_PORT, IMAP_SSL, MAIL_USER, MAIL_PASS,
+    GMAIL_EMAIL, GOOGLE_TOKEN_FILE, SENT_FOLDER,
+    FOLDER_PROCESSED, FOLDER_ESCALATE, CONFIDENCE_THRESHOLD,
+    SIGNATURE_NAME, SIGNATURE_FOOTER, SIGNATURE_LINKS,
+    DB_PATH, LLM_MAX_PARALLEL, LLM_QUOTA_PER_HOUR,
+)))
 
-def require_env():
+# ========= Utils =========
+def require_env(tenants):
+    if ROLE not in ("all", "fetcher", "worker"):
+        raise SystemExit(f"ROLE inválido: {ROLE} (use all, fetcher ou worker)")
+    if ROLE != "all" and not WORK_QUEUE_DB:
+        raise SystemExit(f"ROLE={ROLE} precisa de WORK_QUEUE_DB (fila compartilhada entre os nós)")
+    if ROLE == "worker":
+        return  # só chama o LLM: não precisa de IMAP nem de Gmail
     missing = []
-    for k in ["IMAP_HOST","MAIL_USER","MAIL_PASS"]:
-        if not globals().get(k): missing.append(k)
     if SMTP_MODE != "gmail_oauth":
         missing.append("SMTP_MODE deve ser gmail_oauth")
-    if not GMAIL_EMAIL: missing.append("GMAIL_EMAIL")
     if not Path(GOOGLE_CLIENT_SECRET_FILE).exists(): missing.append("credentials.json")
-    if not Path(GOOGLE_TOKEN_FILE).exists(): missing.append("token.json")
+    for t in tenants:
+        prefix = f"{t.name}: " if len(tenants) > 1 else ""
+        for k in ("imap_host", "mail_user", "mail_pass", "gmail_email"):
+            if not getattr(t, k): missing.append(prefix + k.upper())
+        if not Path(t.google_token_file or "").exists(): missing.append(prefix + (t.google_token_file or "token.json"))
     if missing:
         raise SystemExit("Faltam variáveis/arquivos: " + ", ".join(missing))
 
-def db_init():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("CREATE TABLE IF NOT EXISTS processed (message_id TEXT PRIMARY KEY)")
-    con.commit(); con.close()
-
-def already_processed(msgid:str)->bool:
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("SELECT 1 FROM processed WHERE message_id=?", (msgid,))
-    row = cur.fetchone(); con.close()
-    return row is not None
-
-def mark_processed(msgid:str):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("INSERT OR IGNORE INTO processed(message_id) VALUES (?)", (msgid,))
-    con.commit(); con.close()
+_tenants = []  # caixas em execução, abertas no start_runtime
+_pool = None    # FairPool do LLM, compartilhado entre as caixas
+_work_queue = None  # SqliteWorkQueue quando WORK_QUEUE_DB está definido
+_threads = []  # watchers e workers da fila, esperados no drain()
 
 # ========= IMAP =========
-def connect_imap():
-    ctx = ssl.create_default_context()
-    imap = imaplib.IMAP4_SSL(IMAP_HOST, IMAP_PORT, ssl_context=ctx)
-    imap.login(MAIL_USER, MAIL_PASS)
-    return imap
-
-def select_inbox(imap):
-    typ, _ = imap.select("INBOX")
-    if typ != "OK": raise RuntimeError("Não foi possível selecionar INBOX")
+_FETCH_UID_RE = re.compile(rb'UID\s+(\d+)')
 
 def fetch_unseen(imap):
-    typ, data = imap.search(None, 'UNSEEN')
-    if typ != "OK": return []
+    typ, data = imap.uid('SEARCH', None, 'UNSEEN')
+    if typ != "OK" or not data or not data[0]: return []
     return data[0].split()
 
+def uid_set(uids):
+    """[b'3', b'4', b'5', b'9'] -> '3:5,9' (conjunto compacto para UID FETCH/COPY/STORE)."""
+    nums = sorted({int(u) for u in uids})
+    ranges = []
+    for n in nums:
+        if ranges and n == ranges[-1][1] + 1:
+            ranges[-1][1] = n
+        else:
+            ranges.append([n, n])
+    return ",".join(f"{a}:{b}" if a != b else str(a) for a, b in ranges)
+
+def _fetch_by_uid(data):
+    """Agrupa a resposta de UID FETCH em {uid(bytes): literal}."""
+    out = {}
+    for item in data or []:
+        if isinstance(item, tuple):
+            m = _FETCH_UID_RE.search(item[0])
+            if m: out[m.group(1)] = item[1]
+    return out
+
+def fetch_headers(imap, uids):
+    """
+    Um único UID FETCH com a data de chegada e os cabeçalhos de conversa de todas as mensagens
+    (sem marcar \\Seen). Devolve {uid: (cabeçalhos, chegada_epoch|None)}.
+    """
+    if not uids: return {}
+    typ, data = imap.uid('FETCH', uid_set(uids),
+                         '(UID INTERNALDATE BODY.PEEK[HEADER.FIELDS (MESSAGE-ID FROM SUBJECT IN-REPLY-TO REFERENCES)])')
+    if typ != "OK": return {}
+    out = {}
+    for item in parse_fetch_response(data):
+        raw = next((v for k, v in item.items() if k.startswith("BODY[HEADER.FIELDS")), None)
+        if not item.get("UID") or not isinstance(raw, bytes): continue
+        when = item.get("INTERNALDATE")
+        when = imaplib.Internaldate2tuple(f'INTERNALDATE "{when}"'.encode()) if when else None
+        out[item["UID"].encode()] = (BytesParser(policy=policy.default).parsebytes(raw, headersonly=True),
+                                     time.mktime(when) if when else None)
+    return out
+
+def fetch_bodies(imap, uids):
+    """Corpo completo via UID FETCH em lotes (BODY.PEEK[]); só para quem não tem BODYSTRUCTURE utilizável."""
+    out = {}
+    for i in range(0, len(uids), IMAP_FETCH_BATCH):
+        typ, data = imap.uid('FETCH', uid_set(uids[i:i + IMAP_FETCH_BATCH]), '(UID BODY.PEEK[])')
+        if typ == "OK": out.update(_fetch_by_uid(data))
+    return out
+
+def fetch_messages(imap, uids):
+    """
+    Busca só o que vai para o prompt, sem marcar \\Seen:
+    1) UID FETCH em lote de BODYSTRUCTURE + cabeçalho;
+    2) BODY.PEEK[n]<0.N> apenas das partes de texto/código, cortadas no orçamento
+       (mensagens com as mesmas seções vão no mesmo UID FETCH).
+    Devolve {uid: (cabeçalho, plano, seções)} ou {uid: bytes} (fallback com o corpo inteiro).
+    """
+    plans, groups, out = {}, {}, {}
+    for i in range(0, len(uids), IMAP_FETCH_BATCH):
+        typ, data = imap.uid('FETCH', uid_set(uids[i:i + IMAP_FETCH_BATCH]),
+                             '(UID BODYSTRUCTURE BODY.PEEK[HEADER])')
+        if typ != "OK": continue
+        for item in parse_fetch_response(data):
+            uid, structure, header = item.get("UID"), item.get("BODYSTRUCTURE"), item.get("BODY[HEADER]")
+            if not uid or not isinstance(structure, list) or not isinstance(header, bytes): continue
+            try: plan = plan_parts(body_parts(structure), MAIL_TEXT_BUDGET, MAIL_CODE_BUDGET)
+            except (IndexError, TypeError, ValueError) as e:
+                log("warn", f"BODYSTRUCTURE inesperado (UID {uid}):", e)
+                continue
+            plans[uid.encode()] = (header, plan)
+            groups.setdefault(tuple(fetch_item(p) for p in plan), []).append(uid.encode())
+
+    sections = {}
+    for items, group in groups.items():
+        if not items: continue
+        for i in range(0, len(group), IMAP_FETCH_BATCH):
+            typ, data = imap.uid('FETCH', uid_set(group[i:i + IMAP_FETCH_BATCH]), f"(UID {' '.join(items)})")
+            if typ != "OK": continue
+            for item in parse_fetch_response(data):
+                if item.get("UID"): sections[item["UID"].encode()] = item
+    for uid, (header, plan) in plans.items():
+        out[uid] = (header, plan, sections.get(uid, {}))
+
+    missing = [u for u in uids if u not in out]
+    if missing:
+        log("debug", f"Sem BODYSTRUCTURE utilizável, baixando inteiro: {missing}")
+        out.update(fetch_bodies(imap, missing))
+    return out
+
 def parse_message(raw_bytes):
     msg = BytesParser(policy=policy.default).parsebytes(raw_bytes)
     msgid = msg.get("Message-ID") or msg.get("Message-Id") or ""
@@ -121,214 +261,208 @@ def parse_message(raw_bytes):
             payload = m.get_payload(decode=True) or b""
             try: text = payload.decode(m.get_content_charset() or "utf-8", errors="ignore")
             except: text = ""
-            if filename and filename.lower().endswith((".cob",".cbl",".txt")):
+            if filename and filename.lower().endswith(CODE_EXTENSIONS):
                 code_chunks.append(f"--- {filename} ---\n{text}")
             elif ctype == "text/plain":
                 plain_parts.append(text)
             elif ctype == "text/html" and not plain_parts:
-                import re as _re
-                plain_parts.append(_re.sub("<[^<]+?>", "", text))
+                plain_parts.append(html_to_text(text))
     walk(msg)
-    plain_text = "\n".join(plain_parts).strip()
-    code_block = ""
-    if code_chunks:
-        code_block = "```\n" + "\n\n".join(code_chunks) + "\n```"
-    elif "IDENTIFICATION DIVISION" in plain_text.upper():
-        code_block = "```cobol\n" + plain_text + "\n```"
+    plain_text, code_block = assemble(plain_parts, code_chunks)
     return msg, msgid, from_addr, subject, plain_text, code_block
 
+_NAME_SEP_RE = re.compile(r"[._\-]+")
+
 def guess_first_name(from_addr:str)->str:
     local = from_addr.split("@")[0]
-    local = re.sub(r"[._\-]+", " ", local).strip()
+    local = _NAME_SEP_RE.sub(" ", local).strip()
     parts = local.split()
     name = parts[0].capitalize() if parts else ""
     if name.lower() in {"contato","aluno","suporte","noreply","no"}: return ""
     return name
 
-# ========= Helpers de LIST/parse =========
-def _parse_list_line(line: str):
-    """
-    Parseia uma linha de LIST IMAP:
-      (<flags>) "<delim>" <name>
-    Retorna (flags, delim, name) ou (None,None,None) se falhar.
-    """
-    m = re.search(r'\((?P<flags>.*?)\)\s+"(?P<delim>[^"]+)"\s+(?P<name>.*)$', line.strip())
-    if not m:
-        return None, None, None
-    flags = m.group("flags").strip()
-    delim = m.group("delim")
-    name  = m.group("name").strip()
-    if name.startswith('"') and name.endswith('"'):
-        name = name[1:-1]
-    return flags, delim, name
-
-_listed_boxes_printed = False  # flag global simples
-
-def _list_mailboxes_once(imap):
-    global _listed_boxes_printed
-    boxes = {}
-    if _listed_boxes_printed:
-        return boxes
-    try:
-        typ, data = imap.list()
-        if typ == "OK":
-            print("[DEBUG] LIST mailboxes:")
-            for raw in (data or []):
-                line = raw.decode(errors="ignore")
-                print("   ", line)
-                flags, delim, name = _parse_list_line(line)
-                if name:
-                    boxes[name] = {"flags": flags, "delim": delim}
-        else:
-            print("[WARN] LIST não retornou OK:", data)
-    except Exception as e:
-        print("[WARN] Falha ao listar mailboxes:", e)
-    _listed_boxes_printed = True
-    return boxes
-
-# ========= Mover robusto (COPY e UID COPY) =========
-def move_message(imap, num, dest_folder):
-    """
-    Move a mensagem para dest_folder:
-    1) tenta COPY com sequence number
-    2) se falhar, tenta UID COPY (buscando UID primeiro)
-    3) marca como \\Deleted e deixa o EXPUNGE pro final do ciclo
-    """
-    existing = _list_mailboxes_once(imap)  # dict: name -> {flags,delim}
-    # monte candidatos
-    candidates = [dest_folder]
-    for sep in ("/", "."):
-        if not dest_folder.upper().startswith("INBOX"):
-            candidates.append(f"INBOX{sep}{dest_folder}")
-
-    # prioriza nomes que existem *exatamente* no servidor
-    existing_names = list(existing.keys())
-    exact = [n for n in existing_names if n.lower() == dest_folder.lower()]
-    ends  = [n for n in existing_names if n.lower().endswith(dest_folder.lower())]
-    ordered = []
-    ordered += [n for n in exact if n not in ordered]
-    ordered += [n for n in ends if n not in ordered]
-    ordered += [c for c in candidates if c not in ordered]
-
+# ========= Mover em lote (UID MOVE / UID COPY) =========
+def move_uids(session, uids, dest_folder):
+    """
+    Move um lote de UIDs para dest_folder com um comando por pasta:
+    - UID MOVE (RFC 6851) se o servidor suporta e EXPUNGE_AFTER_COPY=true;
+    - senão UID COPY + UID STORE \\Deleted (o EXPUNGE fica pro final do ciclo).
+    Os nomes reais das pastas vêm do cache de LIST da sessão.
+    """
+    imap = session.ensure()
+    uset = uid_set(uids)
+    existing = session.list_mailboxes()
+    use_move = EXPUNGE_AFTER_COPY and "MOVE" in session.capabilities
     last_err = None
-
-    # 1) COPY com sequence number
-    for mb in ordered:
-        try: imap.create(mb)
-        except Exception: pass
-        log("info", f"Tentando copiar para: {mb}")
-        typ, resp = imap.copy(num, mb)
-        log("debug", f"IMAP COPY -> typ={typ} resp={resp}")
-        if typ == "OK":
-            typ2, resp2 = imap.store(num, '+FLAGS', '\\Deleted')
-            log("debug", f"IMAP STORE Deleted -> typ={typ2} resp={resp2}")
-            if typ2 == "OK":
-                return True
-            last_err = (typ2, resp2)
-        else:
+    for mb in session.folder_candidates(dest_folder):
+        if mb not in existing:
+            try: imap.create(mb)
+            except imaplib.IMAP4.abort: raise
+            except Exception: pass
+        log("info", f"{'UID MOVE' if use_move else 'UID COPY'} de {len(uids)} msg(s) para: {mb}")
+        try:
+            typ, resp = imap.uid('MOVE' if use_move else 'COPY', uset, mb)
+        except imaplib.IMAP4.abort:
+            raise
+        except Exception as e:
+            last_err = e
+            continue
+        log("debug", f"IMAP UID {'MOVE' if use_move else 'COPY'} -> typ={typ} resp={resp}")
+        if typ != "OK":
             last_err = (typ, resp)
-
-    # 2) UID COPY — pegar UID
-    try:
-        typ_uid, data_uid = imap.fetch(num, '(UID)')
-        uid = None
-        if typ_uid == "OK" and data_uid and data_uid[0]:
-            m = re.search(rb'UID\s+(\d+)', data_uid[0])
-            if m:
-                uid = m.group(1).decode()
-        if not uid:
-            log("warn", "Não consegui obter UID para fallback UID COPY.")
-        else:
-            for mb in ordered:
-                log("info", f"Tentando UID COPY para: {mb} (uid={uid})")
-                typ, resp = imap.uid('COPY', uid, mb)
-                log("debug", f"IMAP UID COPY -> typ={typ} resp={resp}")
-                if typ == "OK":
-                    typ2, resp2 = imap.uid('STORE', uid, '+FLAGS', '(\\Deleted)')
-                    log("debug", f"IMAP UID STORE Deleted -> typ={typ2} resp={resp2}")
-                    if typ2 == "OK":
-                        return True
-                    last_err = (typ2, resp2)
-                else:
-                    last_err = (typ, resp)
-    except Exception as e:
-        log("warn", f"Falha no fallback UID COPY: {e}")
+            continue
+        session.remember_folder(dest_folder, mb)
+        if use_move:
+            return True
+        typ2, resp2 = imap.uid('STORE', uset, '+FLAGS.SILENT', '(\\Deleted)')
+        log("debug", f"IMAP UID STORE Deleted -> typ={typ2} resp={resp2}")
+        if typ2 == "OK":
+            return True
+        # já copiou: não tenta outra pasta para não duplicar
+        last_err = (typ2, resp2)
+        break
 
     log("warn", f"Falha ao mover para {dest_folder}. Último erro: {last_err}")
     return False
 
-# ========= Gmail OAuth (XOAUTH2) =========
-SCOPES = ["https://mail.google.com/"]
-
-def get_gmail_credentials():
-    creds = None
-    if Path(GOOGLE_TOKEN_FILE).exists():
-        creds = Credentials.from_authorized_user_file(GOOGLE_TOKEN_FILE, SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-            with open(GOOGLE_TOKEN_FILE, "w", encoding="utf-8") as f:
-                f.write(creds.to_json())
-        else:
-            raise RuntimeError("token.json ausente/inválido. Rode: python oauth_setup.py")
-    return creds
-
-def smtp_send_via_gmail_oauth(message: EmailMessage):
-    creds = get_gmail_credentials()
-    access_token = creds.token
-    auth_string = base64.b64encode(
-        f"user={GMAIL_EMAIL}\1auth=Bearer {access_token}\1\1".encode("utf-8")
-    ).decode("utf-8")
-    with smtplib.SMTP("smtp.gmail.com", 587) as smtp:
-        if SMTP_DEBUG_ON: smtp.set_debuglevel(1)
-        smtp.ehlo()
-        smtp.starttls(context=ssl.create_default_context())
-        smtp.ehlo()
-        code, resp = smtp.docmd("AUTH", "XOAUTH2 " + auth_string)
-        if code != 235:
-            raise RuntimeError(f"XOAUTH2 falhou: {code} {resp}")
-        smtp.send_message(message)
-
-# ========= Append em Enviados (Roundcube) robusto =========
-def append_to_sent(imap_host, imap_port, user, pwd, sent_folder_name, msg):
+def flush_moves(tenant, moves):
+    """
+    Aplica as movimentações acumuladas no ciclo ({pasta: [uids]}).
+    Se o lote da pasta de respondidos falhar, cai para a de escalados como antes.
+    """
+    for folder, uids in moves.items():
+        if not uids: continue
+        ok = move_uids(tenant.session, uids, folder)
+        if not ok and folder == tenant.folder_processed:
+            log("warn", f"Não consegui mover para {tenant.folder_processed}. Fallback: {tenant.folder_escalate}")
+            move_uids(tenant.session, uids, tenant.folder_escalate)
+    moves.clear()
+
+# ========= Reprocessamento (API de admin) =========
+# pastas de onde cada desfecho volta para a INBOX; "respondido" fica de fora (mandaria outra resposta)
+def replay_folder(tenant, outcome):
+    return {"escalado": tenant.folder_escalate, "ignorado": "INBOX"}.get(outcome)
+
+def search_message_id(imap, msgid):
+    """UID da mensagem com esse Message-ID na pasta selecionada (ignora cópias já marcadas \\Deleted) ou None."""
+    if not msgid.isascii() or any(c in msgid for c in '\r\n"\\'):
+        return None
+    typ, data = imap.uid('SEARCH', None, 'UNDELETED', 'HEADER', 'Message-ID', f'"{msgid}"')
+    uids = data[0].split() if typ == "OK" and data and data[0] else []
+    # HEADER é busca por substring: confere o cabeçalho inteiro
+    for uid, (hdr, _) in fetch_headers(imap, uids).items():
+        if (hdr.get("Message-ID") or "").strip() == msgid:
+            return uid
+    return None
+
+def requeue_messages(tenant, folder, msgids):
+    """
+    Roda no watcher da caixa (dono da sessão IMAP): esquece as mensagens no state.db e devolve-as
+    à INBOX como UNSEEN — de `folder` com um UID MOVE (ou COPY+STORE) ou, se já estão na INBOX
+    (ignoradas), só tirando o \\Seen. O process_inbox seguinte trata como novas: triagem, conversa,
+    pool do LLM, ritmo e isolamento de falhas como sempre. Devolve {message_id: uid|None}.
+    """
+    session, imap = tenant.session, tenant.session.ensure()
+    wanted = dict.fromkeys(msgids)
+    other = folder.upper() != "INBOX"
+    if other:
+        boxes = session.list_mailboxes()
+        real = next((mb for mb in session.folder_candidates(folder) if mb in boxes), folder)
+        typ, _ = imap.select(real)
+        if typ != "OK":
+            imap.select(session.mailbox)
+            raise RuntimeError(f"Não foi possível selecionar {real}")
     try:
-        ctx = ssl.create_default_context()
-        im = imaplib.IMAP4_SSL(imap_host, imap_port, ssl_context=ctx)
-        im.login(user, pwd)
+        found = {}
+        for msgid in wanted:
+            uid = search_message_id(imap, msgid)
+            if uid:
+                found[msgid] = uid
+        if found:
+            # esquece antes de mover: na INBOX, a mensagem já é vista como nova
+            tenant.store.forget(list(found))
+            if _work_queue is not None:  # a tarefa antiga (confirmada) seguraria a chave por `retention`
+                _work_queue.forget([f"{tenant.name}\0{m}" for m in found])
+            imap.uid('STORE', uid_set(list(found.values())), '-FLAGS.SILENT', '(\\Seen)')
+            if other and not move_uids(session, list(found.values()), session.mailbox):
+                raise RuntimeError(f"Falha ao mover de {folder} para {session.mailbox}")
+            if other and EXPUNGE_AFTER_COPY:
+                imap.expunge()
+        log("info", f"[{tenant.name}] Reprocessamento: {len(found)}/{len(wanted)} mensagem(ns) de {folder} de volta à INBOX.")
+        return {m: (found[m].decode() if m in found else None) for m in msgids}
+    finally:
+        if other:
+            imap.select(session.mailbox)
 
-        # lista mailboxes com parser robusto
-        existing = {}
+def serve_replays(tenant):
+    """Atende, no watcher da caixa, os pedidos de reprocessamento enfileirados pela API de admin."""
+    while True:
         try:
-            typ, data = im.list()
-            if typ == "OK":
-                for raw in (data or []):
-                    line = raw.decode(errors="ignore")
-                    _, _, name = _parse_list_line(line)
-                    if name:
-                        existing[name] = True
-        except Exception:
-            pass
-
-        # candidatos na ordem de preferência (sua LIST mostrou INBOX.Sent como \Sent)
-        candidates = []
-        if sent_folder_name:
-            candidates.append(sent_folder_name)
-        for n in ("INBOX.Sent", "INBOX.Enviados", "Sent", "Enviados"):
-            if n not in candidates:
-                candidates.append(n)
-
-        # existentes primeiro
-        ordered = sorted(candidates, key=lambda x: (x not in existing, len(x)))
-        dest = ordered[0]
-
-        try: im.create(dest)
-        except Exception: pass
-
-        im.append(dest, "", imaplib.Time2Internaldate(time.time()), msg.as_bytes())
-        im.logout()
-        log("debug", f"Cópia enviada para pasta de enviados: {dest}")
-    except Exception as e:
-        log("warn", "Falha ao APPEND em Enviados:", e)
+            req = tenant.replays.get_nowait()
+        except queue.Empty:
+            return
+        with req["lock"]:
+            if req["state"] == "cancelled":  # quem pediu já desistiu (timeout): não mexe mais na caixa
+                continue
+            req["state"] = "running"
+        try:
+            req["result"] = requeue_messages(tenant, req["folder"], req["message_ids"])
+        except Exception as e:
+            req["error"] = e
+            raise
+        finally:
+            req["done"].set()
+
+def request_replay(tenant, outcome, msgids, timeout=REPLAY_TIMEOUT):
+    """
+    Chamado da thread do HTTP: entrega o pedido ao watcher da caixa, acorda o IDLE e espera a resposta.
+    Devolve {message_id: uid na INBOX|None se não estava na pasta}.
+    """
+    req = {"folder": replay_folder(tenant, outcome), "message_ids": list(msgids), "done": Event(),
+           "lock": Lock(), "state": "pending"}
+    tenant.replays.put(req)
+    tenant.session.wake()
+    if not req["done"].wait(timeout):
+        with req["lock"]:
+            running = req["state"] == "running"
+            if not running:
+                req["state"] = "cancelled"
+        # se o watcher já começou, as mensagens estão sendo movidas: espera o resultado em vez de mentir
+        if not running or not req["done"].wait(timeout):
+            raise TimeoutError(f"o watcher da caixa {tenant.name} não atendeu em {timeout:.0f}s "
+                               "(IMAP fora do ar ou outro nó é o fetcher)"
+                               + ("; o pedido pode ter sido aplicado em parte" if running else "; pedido cancelado"))
+    if "error" in req:
+        raise req["error"]
+    return req["result"]
+
+# ========= Caixas: IMAP, Gmail OAuth (XOAUTH2) e Enviados =========
+def start_tenant(tenant):
+    """
+    Abre o que é de cada caixa: state.db/cache/índice, a sessão IMAP do watcher,
+    o remetente Gmail (sessão SMTP reaproveitada entre respostas) e a fila de Enviados
+    (sessão IMAP própria, sem SELECT, com APPEND em segundo plano).
+    """
+    tenant.store = StateStore(tenant.state_db)
+    # worker não grava ledger: cache e exemplos few-shot são do fetcher e chegam prontos na tarefa
+    if LLM_CACHE_ENABLED and ROLE != "worker":
+        tenant.response_cache = ResponseCache(tenant.store, ttl_seconds=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX)
+    if RETRIEVAL_TOP_K > 0 and ROLE != "worker":
+        tenant.ticket_index = TicketIndex(tenant.store, top_k=RETRIEVAL_TOP_K)
+    tenant.session = ImapSession(tenant.imap_host, tenant.imap_port, tenant.mail_user, tenant.mail_pass,
+                                 use_ssl=tenant.imap_ssl, noop_interval=IMAP_NOOP_INTERVAL,
+                                 # com fila, a reconexão não pode segurar a thread além da validade da trava
+                                 backoff_max=min(IMAP_BACKOFF_MAX, LEADER_TTL / 3) if WORK_QUEUE_DB else IMAP_BACKOFF_MAX)
+    tenant.sender = GmailSender(tenant.gmail_email, tenant.google_token_file, host=SMTP_HOST, port=SMTP_PORT,
+                                starttls=SMTP_STARTTLS, debug=SMTP_DEBUG_ON)
+    tenant.archiver = SentArchiver(
+        ImapSession(tenant.imap_host, tenant.imap_port, tenant.mail_user, tenant.mail_pass, mailbox=None,
+                    backoff_max=IMAP_BACKOFF_MAX, use_ssl=tenant.imap_ssl),
+        tenant.sent_folder,
+    )
+    tenant.archiver.start()
+    tenant.renderer = ReplyRenderer(tenant.signature_name, tenant.signature_footer, tenant.signature_links)
+    tenant.pacer = Pacer(tenant.llm_max_parallel or LLM_WORKERS, MAX_IN_FLIGHT, CYCLE_TARGET)
 
 # ========= Assunto e assinatura =========
 def make_reply_subject(original_subject: str) -> str:
@@ -340,57 +474,161 @@ def make_reply_subject(original_subject: str) -> str:
         return "Re:" + s[4:]
     return f"Re: {s}" if s else "Re:"
 
-def wrap_with_signature(first_name:str, body_markdown:str)->str:
-    saud = f"Olá{', ' + first_name if first_name else ''}!\n\n"
-    sig_lines = ["\n---", f"**{SIGNATURE_NAME}**"]
-    if SIGNATURE_FOOTER: sig_lines.append(SIGNATURE_FOOTER)
-    if SIGNATURE_LINKS: sig_lines.append(SIGNATURE_LINKS)
-    return saud + body_markdown.strip() + "\n" + "\n".join(sig_lines) + "\n"
-
-def send_reply(original_msg, to_addr, reply_subject, body_markdown):
-    body_html = markdown(body_markdown)
-
-    reply = EmailMessage()
+def send_reply(tenant, original_msg, to_addr, first_name, reply_subject, body_markdown):
+    # saudação + corpo + assinatura (pré-renderizada por caixa), texto e HTML
+    reply = tenant.renderer.message(first_name, body_markdown)
     reply["Subject"] = reply_subject
 
     # Entregabilidade: From = Gmail, Reply-To = suporte@
-    reply["From"] = GMAIL_EMAIL
-    reply["Reply-To"] = MAIL_USER
+    reply["From"] = tenant.gmail_email
+    reply["Reply-To"] = tenant.mail_user
     reply["To"] = to_addr
     if original_msg.get("Message-ID"):
         reply["In-Reply-To"] = original_msg["Message-ID"]
-        reply["References"] = original_msg["Message-ID"]
-
-    reply.set_content(body_markdown)
-    reply.add_alternative(body_html, subtype="html")
+        refs = " ".join(str(original_msg.get("References") or "").split())
+        reply["References"] = f"{refs} {original_msg['Message-ID']}".strip()
 
     log("info", f"Enviando resposta (Gmail OAuth) para {to_addr}…")
-    smtp_send_via_gmail_oauth(reply)
+    tenant.sender.send(reply)
     log("info", "Resposta enviada com sucesso (Gmail OAuth).")
 
-    # (Opcional) guarda cópia no lado HostGator (Roundcube)
+    # (Opcional) guarda cópia no lado HostGator (Roundcube) — enfileirada, não bloqueia o ciclo
+    tenant.archiver.submit(reply)
+
+# ========= Métricas (/metrics) =========
+STAGE_SECONDS = metrics.Histogram("cobol_agent_stage_seconds", "Duração de cada etapa por mensagem", ["stage"])
+CYCLE_SECONDS = metrics.Histogram("cobol_agent_cycle_seconds", "Duração de um ciclo completo da INBOX")
+MESSAGES = metrics.Counter("cobol_agent_messages_total", "Mensagens tratadas por desfecho", ["tenant", "outcome"])
+TRIAGE = metrics.Counter("cobol_agent_triage_total", "Decisões da triagem antes do LLM", ["tenant", "route", "reason"])
+LLM_REQUESTS = metrics.Counter("cobol_agent_llm_requests_total", "Chamadas ao LLM por resultado", ["result"])
+LLM_CACHE_LOOKUPS = metrics.Counter("cobol_agent_llm_cache_lookups_total", "Consultas ao cache de veredictos", ["result"])
+LLM_TOKENS = metrics.Counter("cobol_agent_llm_tokens_total", "Tokens processados pelo LLM", ["kind"])
+LLM_TTFT = metrics.Histogram("cobol_agent_llm_ttft_seconds", "Tempo até o primeiro token do LLM")
+LLM_PREFILL = metrics.Histogram("cobol_agent_llm_prefill_seconds", "Avaliação do prompt (sem o prefixo de sistema em cache)")
+RETRIEVAL_SECONDS = metrics.Histogram("cobol_agent_retrieval_seconds", "Busca de tickets parecidos no índice",
+                                      buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+BATCH_SIZE = metrics.Gauge("cobol_agent_batch_size", "Mensagens admitidas no último ciclo (ritmo adaptativo)", ["tenant"])
+BACKLOG = metrics.Gauge("cobol_agent_backlog", "Mensagens UNSEEN deixadas para os próximos ciclos", ["tenant"])
+MESSAGE_FAILURES = metrics.Counter("cobol_agent_message_failures_total", "Falhas isoladas por mensagem",
+                                   ["tenant", "result"])
+LLM_QUEUE = metrics.Gauge("cobol_agent_llm_queue_depth", "Mensagens na fila/em execução no pool do LLM", ["tenant"])
+SENT_QUEUE = metrics.Gauge("cobol_agent_sent_queue_depth", "Cópias aguardando APPEND em Enviados",
+                           fn=lambda: sum(t.archiver.pending() for t in _tenants if t.archiver))
+
+# ========= Prontidão (subida em segundo plano) =========
+# o /health responde assim que o Flask sobe; config, state.db, credenciais, IMAP e warm-up
+# ficam prontos depois, no watcher, e cada etapa aparece aqui (e no /status)
+_BOOT = time.monotonic()
+READINESS = {}  # etapa -> {"state": pending|ok|error, "s": segundos desde a subida, "error"}
+_READINESS_LOCK = Lock()  # as threads de subida escrevem enquanto o /status serializa
+
+def set_stage(stage, state, error=None):
+    entry = {"state": state, "s": round(time.monotonic() - _BOOT, 3)}
+    if error is not None:
+        entry["error"] = str(error)[:300]
+    with _READINESS_LOCK:
+        READINESS[stage] = entry
+
+def readiness():
+    """Cópia das etapas, segura para ler/serializar fora do lock."""
+    with _READINESS_LOCK:
+        return {k: dict(v) for k, v in READINESS.items()}
+
+def is_ready():
+    stages = readiness()
+    return bool(stages) and all(v["state"] == "ok" for v in stages.values())
+
+# ========= LLM / decisão =========
+# modelo e prompts entram na chave: trocar qualquer um invalida o cache
+_CACHE_SALT = f"{OLLAMA_MODEL}\0{SYSTEM_PROMPT}\0{USER_TEMPLATE}\0{PROMPT_TEXT_TOKENS}/{PROMPT_CODE_TOKENS}"
+# cliente único: permite cancelar gerações em andamento no desligamento (criado no start_runtime)
+_llm_options = {k: int(v) for k, v in (("num_ctx", OLLAMA_NUM_CTX), ("num_predict", OLLAMA_NUM_PREDICT)) if v}
+_llm_client = None
+
+def warm_up_llm():
+    """Deixa o modelo residente antes do primeiro e-mail (roda como primeira tarefa do pool)."""
     try:
-        append_to_sent(IMAP_HOST, IMAP_PORT, MAIL_USER, MAIL_PASS, SENT_FOLDER, reply)
+        secs = _llm_client.warm_up(SYSTEM_PROMPT)
+        log("info", f"Modelo {OLLAMA_MODEL} carregado em {secs:.1f}s (keep_alive={OLLAMA_KEEP_ALIVE}).")
+        set_stage("llm", "ok")
     except Exception as e:
-        log("warn", "Não foi possível salvar cópia em Enviados:", e)
+        log("warn", "Warm-up do Ollama falhou:", e)
+        set_stage("llm", "error", e)
 
-# ========= LLM / decisão =========
-def call_agent_local(from_addr, subject, plain_text, code_block):
+def _clip(text, limit):
+    text = (text or "").strip()
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + " […]"
+
+def similar_cases(tenant, plain_text, code_block):
+    """Bloco EXAMPLES_TEMPLATE com os tickets respondidos mais parecidos da caixa (ou "")."""
+    if tenant.ticket_index is None:
+        return ""
+    t0 = time.perf_counter()
+    cases = tenant.ticket_index.search(plain_text, code_fingerprint(code_block))
+    RETRIEVAL_SECONDS.observe(time.perf_counter() - t0)
+    if not cases:
+        return ""
+    examples = "\n\n".join(EXAMPLE_TEMPLATE.format(n=n, question=_clip(q, 400), reply=_clip(r, 700))
+                            for n, (q, r) in enumerate(cases, 1))
+    return EXAMPLES_TEMPLATE.format(examples=examples)
+
+def cached_verdict(tenant, plain_text, code_block):
+    """Veredicto já dado a uma dúvida igual nesta caixa (marcado com "_cache") ou None."""
+    if tenant.response_cache is None or LLM_BACKEND != "ollama":
+        return None
+    cached = tenant.response_cache.get(fingerprint(plain_text, code_block, salt=_CACHE_SALT))
+    LLM_CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+    if cached is not None:
+        log("info", "Veredicto vindo do cache (dúvida repetida).")
+        cached["_cache"] = True
+    return cached
+
+def remember_verdict(tenant, plain_text, code_block, data):
+    # só guarda respostas que o modelo de fato produziu (sem fallback de JSON inválido nem erro)
+    if tenant.response_cache is not None and "_debug" not in data and "_error" not in data:
+        tenant.response_cache.put(fingerprint(plain_text, code_block, salt=_CACHE_SALT), data)
+
+def call_agent_local(tenant, from_addr, subject, plain_text, code_block, examples=None):
+    """
+    Chama o LLM. `examples=None`: exemplos few-shot do índice da caixa neste nó; com a fila durável o worker
+    recebe os exemplos prontos do fetcher, que é quem tem o ledger (ROLE=worker não abre índice nem cache).
+    """
+    text_ctx, code_ctx, ctx_stats = build_context(plain_text, code_block, PROMPT_TEXT_TOKENS, PROMPT_CODE_TOKENS)
+    if ctx_stats["code_lines"]:
+        log("debug", f"Contexto COBOL: {ctx_stats['code_lines_sent']}/{ctx_stats['code_lines']} linhas "
+                     f"(~{ctx_stats['prompt_tokens_est']} tokens)")
     user_prompt = USER_TEMPLATE.format(
         from_addr=from_addr, subject=subject,
-        plain_text=plain_text[:8000], code_block=code_block[:8000]
+        plain_text=text_ctx, code_block=code_ctx
     )
     if LLM_BACKEND == "ollama":
+        cached = cached_verdict(tenant, plain_text, code_block)
+        if cached is not None:
+            return cached
         try:
-            client = OllamaClient(OLLAMA_HOST, OLLAMA_MODEL)
-            data = client.generate_json(SYSTEM_PROMPT, user_prompt)
+            user_prompt = (similar_cases(tenant, plain_text, code_block) if examples is None else examples) + user_prompt
+            data = _llm_client.generate_json(SYSTEM_PROMPT, user_prompt)
+            stats = _llm_client.last_stats
+            log("debug", f"LLM stats: {stats}")
+            LLM_REQUESTS.inc(result="invalid_json" if "_debug" in data else "ok")
+            LLM_TOKENS.inc(stats.get("prompt_tokens") or 0, kind="prompt")
+            LLM_TOKENS.inc(stats.get("tokens") or 0, kind="completion")
+            if stats.get("ttft_s") is not None:
+                LLM_TTFT.observe(stats["ttft_s"])
+            if stats.get("prefill_s") is not None:
+                LLM_PREFILL.observe(stats["prefill_s"])
+            remember_verdict(tenant, plain_text, code_block, data)
+        except GenerationCancelled:
+            raise
         except Exception as e:
             log("warn", "Falha no Ollama:", e)
+            LLM_REQUESTS.inc(result="error")
             data = {
                 "assunto": f"Re: {subject[:200]}",
                 "corpo_markdown": "(Tive um problema para interpretar sua mensagem automaticamente. Pode reenviar o código/anexo?)",
                 "nivel_confianca": 0.0,
-                "acao": "escalar"
+                "acao": "escalar",
+                "_error": str(e)
             }
     else:
         body = ("- Entendi sua dúvida de COBOL e vou te ajudar com passos objetivos.\n"
@@ -402,57 +640,627 @@ def call_agent_local(from_addr, subject, plain_text, code_block):
     return data
 
 # ========= Loop principal =========
-def main_loop():
-    require_env()
-    print("Watcher IMAP — envio via Gmail OAuth (XOAUTH2)")
-    db_init()
-    while True:
-        try:
-            imap = connect_imap()
-            select_inbox(imap)
-            ids = fetch_unseen(imap)
-            log("debug", f"UNSEEN: {ids}")
-            for num in ids:
-                typ, data = imap.fetch(num, '(RFC822)')
-                if typ != "OK": continue
-                raw = data[0][1]
-                msg, msgid, from_addr, subject, plain_text, code_block = parse_message(raw)
-                if not msgid: msgid = f"no-id-{num.decode()}-{int(time.time())}"
-                if already_processed(msgid): continue
-
-                ai = call_agent_local(from_addr, subject, plain_text, code_block)
-                action = ai.get("acao","escalar")
-                confidence = float(ai.get("nivel_confianca",0.0))
-                log("info", f"Ação={action} conf={confidence}")
-
-                if action == "responder" and confidence >= CONFIDENCE_THRESHOLD:
-                    first = guess_first_name(from_addr)
-                    full_body = wrap_with_signature(first, ai["corpo_markdown"])
-                    reply_subject = make_reply_subject(subject)
-                    log("info", f"Assunto final (reply): {reply_subject}")
-                    send_reply(msg, from_addr, reply_subject, full_body)
-
-                    log("info", f"Chamando move_message -> {FOLDER_PROCESSED}")
-                    ok = move_message(imap, num, FOLDER_PROCESSED)
-                    if not ok:
-                        log("warn", f"Não consegui mover para {FOLDER_PROCESSED}. Fallback: {FOLDER_ESCALATE}")
-                        move_message(imap, num, FOLDER_ESCALATE)
+SHUTDOWN = Event()
+
+def stop_watcher():
+    """Pede para o watcher parar e cancela gerações do LLM em andamento."""
+    SHUTDOWN.set()
+    if _llm_client is not None:
+        _llm_client.cancel_all()
+
+def run_agent(tenant, job, plain_text, code_block, examples=None):
+    """Roda no pool: chama o LLM e anota no job o tempo de fila, de inferência e as métricas do modelo."""
+    started = time.monotonic()
+    job["t"]["queue"] = started - job["submitted"]
+    try:
+        ai = call_agent_local(tenant, job["from_addr"], job["subject"], plain_text, code_block, examples)
+    finally:
+        job["t"]["llm"] = time.monotonic() - started
+        LLM_QUEUE.dec(tenant=tenant.name)
+    job["cache_hit"] = bool(ai.pop("_cache", False))
+    failed = ai.pop("_error", None)
+    job["error"] = failed or ai.get("_debug")
+    if _llm_client is not None and not job["cache_hit"] and not failed:
+        job["llm_stats"] = dict(_llm_client.last_stats)
+    return ai
+
+def job_uids(job):
+    """UIDs que a decisão do job cobre: a mensagem principal e as da mesma conversa agrupadas com ela."""
+    return [job["uid"]] + [m["uid"] for m in job.get("coalesced", ())]
+
+def mark_job_processed(tenant, job):
+    for m in job.get("coalesced", ()):
+        tenant.store.mark_processed(m["msgid"])
+    tenant.store.mark_processed(job["msgid"])
+    uids = set(job_uids(job))
+    tenant.claimed = tuple(u for u in tenant.claimed if u not in uids)
+
+def new_job(tenant, uid, fetched, fetch_share):
+    """Parseia uma mensagem e passa pela triagem. Devolve (job, texto, código)."""
+    t0 = time.monotonic()
+    msg, msgid, from_addr, subject, plain_text, code_block = (
+        parse_message(fetched) if isinstance(fetched, bytes) else parse_partial(*fetched))
+    if not msgid: msgid = f"no-id-{uid.decode()}"
+    job = {"uid": uid, "msg": msg, "msgid": msgid, "from_addr": from_addr, "subject": subject,
+           "question": plain_text[:2000], "code_fp": code_fingerprint(code_block),
+           "started": t0 - fetch_share, "t": {"fetch": fetch_share, "parse": time.monotonic() - t0}}
+    job["route"], job["route_reason"] = (
+        classify(msg, from_addr, subject, plain_text, code_block, own_addresses=tenant.own_addresses())
+        if TRIAGE_ENABLED else ("llm", ""))
+    TRIAGE.inc(tenant=tenant.name, route=job["route"], reason=job["route_reason"])
+    return job, plain_text, code_block
+
+def merge_jobs(parsed):
+    """
+    Junta as mensagens de uma conversa [(job, texto, código)] num job só.
+    A principal é a mais recente (resposta para o último remetente, In-Reply-To da última mensagem);
+    o assunto é o da primeira.
+    """
+    if len(parsed) == 1:
+        return parsed[0]
+    plain_text, code_block = merge_messages([(j["subject"], text, code) for j, text, code in parsed])
+    job = dict(parsed[-1][0])
+    job.update(subject=parsed[0][0]["subject"], question=plain_text[:2000], code_fp=code_fingerprint(code_block),
+               route="llm", route_reason=f"conversa ({len(parsed)} mensagens)",
+               coalesced=[j for j, _, _ in parsed[:-1]],
+               started=min(j["started"] for j, _, _ in parsed))
+    log("info", f"Conversa agrupada: {len(parsed)} mensagens — {job['subject'][:80]}")
+    return job, plain_text, code_block
+
+def stub_job(uid, hdr, fetch_share):
+    """Job só com os cabeçalhos, para registrar uma mensagem que nem chegou a ser parseada."""
+    hdr = hdr if hdr is not None else {}
+    return {"uid": uid, "msg": hdr, "msgid": hdr.get("Message-ID") or f"no-id-{uid.decode()}",
+            "from_addr": str(hdr.get("From") or ""), "subject": str(hdr.get("Subject") or ""),
+            "started": time.monotonic() - fetch_share, "t": {"fetch": fetch_share}}
+
+def retry_wait(tenant, msgid, now):
+    """Segundos até uma mensagem que falhou poder ser tentada de novo (0 = pode agora)."""
+    failed = tenant.store.failure(msgid)
+    if not failed:
+        return 0
+    attempts, failed_at = failed
+    return max(0, failed_at + MESSAGE_RETRY_BACKOFF * 2 ** (attempts - 1) - now)
+
+def fail_job(tenant, moves, job, error, retry, done):
+    """
+    Isola a falha de uma mensagem (ou conversa) sem derrubar o lote: conta a tentativa no state.db e
+    põe os UIDs em `retry` (voltam a UNSEEN e são retentados depois do backoff). Na MESSAGE_MAX_ATTEMPTS-ésima
+    falha desiste: vai para Escalar com o erro no ledger. Envio incerto (SendUncertain) desiste na hora:
+    a resposta pode ter saído. Devolve True quando desistiu.
+    """
+    msgids = [job["msgid"]] + [m["msgid"] for m in job.get("coalesced", ())]
+    attempts = max(tenant.store.record_failure(m, repr(error)) for m in msgids)
+    uncertain = isinstance(error, SendUncertain)
+    if attempts < MESSAGE_MAX_ATTEMPTS and not uncertain:
+        log("warn", f"[{tenant.name}] Falha em {job['msgid']} (tentativa {attempts}/{MESSAGE_MAX_ATTEMPTS}):", error)
+        MESSAGE_FAILURES.inc(tenant=tenant.name, result="retry")
+        if retry is not None:
+            retry.extend(job_uids(job))
+        return False
+    why = "envio incerto" if uncertain else f"falhou {attempts} vezes"
+    log("error", f"[{tenant.name}] {job['msgid']} {why}; vai para {tenant.folder_escalate}:", error)
+    MESSAGE_FAILURES.inc(tenant=tenant.name, result="escalado")
+    job.update(action="escalar", outcome="escalado", error=f"{attempts} falha(s): {error!r}"[:500])
+    moves.setdefault(tenant.folder_escalate, []).extend(job_uids(job))
+    mark_job_processed(tenant, job)
+    done.append(job)
+    return True
+
+def apply_decision(tenant, moves, job, ai):
+    """
+    Envia a resposta (se for o caso) e agenda a movimentação em `moves`.
+    As movimentações são aplicadas em lote no fim do ciclo (flush_moves).
+    """
+    action = ai.get("acao","escalar")
+    confidence = float(ai.get("nivel_confianca",0.0))
+    log("info", f"Ação={action} conf={confidence}")
+    job["action"], job["confidence"] = action, confidence
+
+    if action == "responder" and confidence >= tenant.confidence_threshold:
+        first = guess_first_name(job["from_addr"])
+        reply_subject = make_reply_subject(job["subject"])
+        log("info", f"Assunto final (reply): {reply_subject}")
+        t0 = time.monotonic()
+        send_reply(tenant, job["msg"], job["from_addr"], first, reply_subject, ai["corpo_markdown"])
+        job["t"]["smtp"] = time.monotonic() - t0
+
+        job["outcome"] = "respondido"
+        job["reply"] = ai["corpo_markdown"]
+        moves.setdefault(tenant.folder_processed, []).extend(job_uids(job))
+    else:
+        log("info", f"Agendando move -> {tenant.folder_escalate} (ação={action}, conf={confidence})")
+        job["outcome"] = "escalado"
+        moves.setdefault(tenant.folder_escalate, []).extend(job_uids(job))
+
+def apply_route(tenant, moves, job):
+    """Mensagens que a triagem resolve sem o LLM: 'escalar' vai para a pasta, 'ignorar' fica lida na INBOX."""
+    job["action"] = job["route"]
+    if job["route"] == "escalar":
+        job["outcome"] = "escalado"
+        moves.setdefault(tenant.folder_escalate, []).extend(job_uids(job))
+    else:
+        job["outcome"] = "ignorado"
+    log("info", f"Triagem: {job['route']} ({job['route_reason']}) — {job['subject'][:80]}")
+
+def record_job(tenant, job):
+    """
+    Fecha as métricas da mensagem: histograma por etapa, contadores e linha no ledger.
+    Conversa agrupada: uma linha por mensagem; tempos, tokens e resposta ficam só na linha da principal.
+    """
+    t = job["t"]
+    t["total"] = time.monotonic() - job["started"]
+    for stage, secs in t.items():
+        STAGE_SECONDS.observe(secs, stage=stage)
+    stats = job.get("llm_stats") or {}
+    entry = {
+        "message_id": job["msgid"], "uid": job["uid"].decode(), "from_addr": job["from_addr"],
+        "subject": job["subject"], "action": job.get("action"), "outcome": job.get("outcome"),
+        "confidence": job.get("confidence"), "model": OLLAMA_MODEL if LLM_BACKEND == "ollama" else LLM_BACKEND,
+        "prompt_tokens": stats.get("prompt_tokens"), "completion_tokens": stats.get("tokens"),
+        "prefill_ms": round(stats["prefill_s"] * 1000, 1) if stats.get("prefill_s") is not None else None,
+        "cache_hit": int(job.get("cache_hit", False)), "error": job.get("error"),
+        "question": job.get("question"), "code_fp": job.get("code_fp"), "reply": job.get("reply"),
+        "route": job.get("route"), "route_reason": job.get("route_reason"), "thread_id": job.get("thread_id"),
+    }
+    for stage, secs in t.items():
+        entry[f"{stage}_ms"] = round(secs * 1000, 1)
+    for m in job.get("coalesced", ()):
+        MESSAGES.inc(tenant=tenant.name, outcome=job.get("outcome", "erro"))
+        tenant.store.record({"message_id": m["msgid"], "uid": m["uid"].decode(), "from_addr": m["from_addr"],
+                       "subject": m["subject"], "action": entry["action"], "outcome": entry["outcome"],
+                       "confidence": entry["confidence"], "model": entry["model"], "cache_hit": entry["cache_hit"],
+                       "question": m["question"], "code_fp": m["code_fp"], "route": m["route"],
+                       "route_reason": m["route_reason"], "thread_id": job.get("thread_id")})
+    MESSAGES.inc(tenant=tenant.name, outcome=job.get("outcome", "erro"))
+    tenant.store.record(entry)
+
+def process_inbox(tenant, pool):
+    """
+    Busca/parseia na thread do watcher e enfileira as chamadas ao LLM no pool.
+    IMAP, SMTP e state.db continuam só nesta thread (imaplib não é thread-safe);
+    os resultados são aplicados conforme ficam prontos.
+
+    Tudo por UID: UID SEARCH -> um UID FETCH só de cabeçalhos -> descarta o que já
+    está no state.db -> BODYSTRUCTURE e leitura parcial só das partes úteis das mensagens novas.
+    Mensagens da mesma conversa (References/In-Reply-To ou remetente + assunto) esperam o
+    debounce e viram uma chamada ao LLM e uma resposta só.
+    A triagem resolve sem o LLM o que é automático, agradecimento ou fora de COBOL.
+    No fim, um UID MOVE (ou COPY+STORE) por pasta de destino.
+    Cada mensagem vira uma linha no ledger com o tempo gasto em cada etapa.
+    Com WORK_QUEUE_DB, as chamadas ao LLM vão para a fila durável e os resultados prontos
+    (de qualquer worker) são aplicados aqui no ciclo seguinte.
+    O lote é limitado pelo ritmo da caixa (tenant.pacer: vazão medida do LLM e teto de mensagens em voo);
+    o excedente fica UNSEEN para o próximo ciclo. Uma mensagem que falha não derruba o lote (fail_job).
+    Devolve em quantos segundos vale rodar de novo: 0 se sobrou lote, senão quando uma conversa em espera
+    ou uma retentativa fica pronta (None se não houver).
+    """
+    cycle_start = time.monotonic()
+    imap = tenant.session.ensure()
+    check_fetcher(tenant)  # a reconexão pode ter levado mais que a trava
+    tenant.session.begin_sync()
+    uids = fetch_unseen(imap)
+    log("debug", f"UNSEEN (UIDs): {uids}")
+    headers = fetch_headers(imap, uids)
+    now = time.time()
+    fresh, queued, stale, retry_due = {}, set(), [], None
+    for uid in uids:
+        hdr, arrived = headers.get(uid, (None, None))
+        msgid = (hdr.get("Message-ID") or "") if hdr is not None else ""
+        if msgid and (msgid in queued or tenant.store.already_processed(msgid)):
+            stale.append(uid)
+            continue
+        if msgid: queued.add(msgid)
+        wait = retry_wait(tenant, msgid or f"no-id-{uid.decode()}", now)
+        if wait:  # falhou há pouco: espera o backoff
+            retry_due = wait if retry_due is None else min(retry_due, wait)
+            continue
+        fresh[uid] = (hdr, arrived)
+    if stale:
+        # cópia repetida no lote ou mensagem já tratada: marca como lida para o SEARCH UNSEEN não trazê-la de novo
+        log("debug", f"[{tenant.name}] {len(stale)} mensagem(ns) repetida(s) ou já tratada(s) marcadas como lidas.")
+        imap.uid('STORE', uid_set(stale), '+FLAGS.SILENT', '(\\Seen)')
+
+    # conversa com mensagem recente espera o debounce (continua UNSEEN) para sair numa resposta só
+    groups, due = (group_threads(fresh, THREAD_DEBOUNCE, THREAD_MAX_WAIT, time.time())
+                   if THREAD_GROUPING else ([[uid] for uid in fresh], None))
+    if due is not None:
+        log("debug", f"{len(fresh) - sum(map(len, groups))} mensagem(ns) aguardando a conversa assentar ({due:.0f}s).")
+    # lote do ciclo: o que o LLM dá conta em CYCLE_TARGET s, sem passar de MAX_IN_FLIGHT em voo
+    room = 0 if SHUTDOWN.is_set() else tenant.pacer.batch(
+        _work_queue.outstanding(tenant.name) if _work_queue is not None else 0)
+    admitted, cut = 0, 0
+    for group in groups:
+        if admitted >= room: break
+        admitted, cut = admitted + len(group), cut + 1
+    groups, backlog = groups[:cut], sum(map(len, groups[cut:]))
+    BATCH_SIZE.set(admitted, tenant=tenant.name)
+    BACKLOG.set(backlog, tenant=tenant.name)
+    if backlog:
+        log("info", f"[{tenant.name}] {backlog} mensagem(ns) ficam para o próximo lote (lote de {room}).")
+    bodies = fetch_messages(imap, [uid for group in groups for uid in group])
+    if bodies:  # os fetches usam PEEK: marca como lidas num STORE só (como o BODY[] fazia)
+        imap.uid('STORE', uid_set(list(bodies)), '+FLAGS.SILENT', '(\\Seen)')
+        tenant.claimed = tuple(bodies)
+    # o custo de busca do ciclo é rateado entre as mensagens novas
+    fetch_share = (time.monotonic() - cycle_start) / max(1, len(bodies))
+
+    futures, moves, cancelled, retry, done = {}, {}, [], [], []
+    first_submit = None
+    for group in groups:
+        parsed = []
+        for uid in group:
+            if uid not in bodies: continue
+            try:
+                job, plain_text, code_block = new_job(tenant, uid, bodies[uid], fetch_share)
+            except Exception as e:
+                fail_job(tenant, moves, stub_job(uid, fresh[uid][0], fetch_share), e, retry, done)
+                continue
+            if tenant.store.already_processed(job["msgid"]): continue
+            job["thread_id"] = parsed[0][0]["msgid"] if parsed else job["msgid"]
+            parsed.append((job, plain_text, code_block))
+        # automáticas e agradecimentos saem da conversa; se uma mensagem precisa do LLM, as demais vão junto
+        needs_llm = any(job["route"] == "llm" for job, _, _ in parsed)
+        for job, _, _ in parsed:
+            if job["route"] == "ignorar" or not needs_llm:
+                apply_route(tenant, moves, job)
+                mark_job_processed(tenant, job)
+                done.append(job)
+        parsed = [p for p in parsed if needs_llm and p[0]["route"] != "ignorar"]
+        if not parsed: continue
+        job, plain_text, code_block = merge_jobs(parsed)
+        if not tenant.take_llm_quota():
+            job["route"], job["route_reason"] = "escalar", "cota do LLM"
+            TRIAGE.inc(tenant=tenant.name, route="escalar", reason="cota do LLM")
+            apply_route(tenant, moves, job)
+            mark_job_processed(tenant, job)
+            done.append(job)
+            continue
+        if _work_queue is not None:
+            # vários nós: cache e exemplos ficam aqui (o ledger é do fetcher); o worker recebe os exemplos prontos
+            cached = cached_verdict(tenant, plain_text, code_block)
+            if cached is not None:
+                job["cache_hit"] = bool(cached.pop("_cache"))
+                try:
+                    apply_decision(tenant, moves, job, cached)
+                except Exception as e:
+                    fail_job(tenant, moves, job, e, retry, done)
+                    continue
+                mark_job_processed(tenant, job)
+                done.append(job)
+                continue
+            # a chamada ao LLM vai para a fila durável; o resultado volta num próximo ciclo
+            key = f"{tenant.name}\0{job['msgid']}"
+            if not _work_queue.put(key, tenant.name,
+                                   {"job": job_to_task(job), "plain_text": plain_text, "code_block": code_block,
+                                    "examples": similar_cases(tenant, plain_text, code_block)}):
+                # chave já existe: em andamento, o resultado chega pela fila; já confirmada, não some calada
+                if _work_queue.state(key) == "acked":
+                    log("warn", f"[{tenant.name}] {job['msgid']} já tem tarefa confirmada na fila; volta a UNSEEN.")
+                    retry.extend(job_uids(job))
+            continue
+        job["submitted"] = time.monotonic()
+        first_submit = first_submit or job["submitted"]
+        LLM_QUEUE.inc(tenant=tenant.name)
+        futures[pool.submit(tenant.name, run_agent, tenant, job, plain_text, code_block)] = job
+
+    if futures:
+        log("info", f"[{tenant.name}] {len(futures)} mensagem(ns) na fila do LLM ({LLM_WORKERS} worker(s) compartilhados).")
+    acked = []
+    try:
+        for task_id, payload in (_work_queue.orphans(tenant.name) if _work_queue is not None else ()):
+            # o fetcher anterior caiu entre o envio e o ack: a resposta pode ter saído; não reenvia
+            job = task_to_job(payload["job"])
+            log("warn", f"[{tenant.name}] {job['msgid']}: aplicação interrompida em outro fetcher; vai para "
+                        f"{tenant.folder_escalate} sem reenviar.")
+            job.update(action="escalar", outcome="escalado", error="aplicação interrompida (envio incerto)")
+            moves.setdefault(tenant.folder_escalate, []).extend(job_uids(job))
+            acked.append(task_id)
+            mark_job_processed(tenant, job)
+            done.append(job)
+        for task_id, payload, result in (_work_queue.results(tenant.name) if _work_queue is not None else ()):
+            check_fetcher(tenant)  # antes de cada envio: outro nó não pode ter assumido a caixa
+            job = task_to_job(payload["job"])
+            if tenant.store.already_processed(job["msgid"]):
+                acked.append(task_id)  # resultado já aplicado antes de uma queda, só faltou o ack
+                continue
+            if retry_wait(tenant, job["msgid"], now):
+                continue
+            # registrado na fila compartilhada antes do SMTP: quem assumir a caixa não reenvia
+            if not _work_queue.begin_apply(task_id, NODE_ID):
+                continue
+            job.update(result["job"])
+            job["t"].update(result["t"])
+            try:
+                apply_decision(tenant, moves, job, result["ai"])
+            except Exception as e:
+                # o resultado volta para a fila (sem ack) até dar certo ou desistir
+                if fail_job(tenant, moves, job, e, None, done):
+                    acked.append(task_id)
                 else:
-                    log("info", f"Chamando move_message -> {FOLDER_ESCALATE} (ação={action}, conf={confidence})")
-                    move_message(imap, num, FOLDER_ESCALATE)
+                    _work_queue.unapply(task_id, NODE_ID)
+                continue
+            acked.append(task_id)
+            mark_job_processed(tenant, job)
+            done.append(job)
+            if not job.get("error") and not job.get("cache_hit"):  # veredicto de um worker de outro nó
+                remember_verdict(tenant, payload["plain_text"], payload["code_block"], result["ai"])
+        for fut in as_completed(futures):
+            job = futures[fut]
+            try:
+                apply_decision(tenant, moves, job, fut.result())
+            except GenerationCancelled:
+                cancelled.extend(job_uids(job))
+                continue
+            except Exception as e:
+                fail_job(tenant, moves, job, e, retry, done)
+                continue
+            mark_job_processed(tenant, job)
+            done.append(job)
+        if futures and not cancelled:
+            tenant.pacer.observe(len(futures), time.monotonic() - first_submit)
+    finally:
+        # o que já foi respondido é movido (e gravado no state.db) mesmo se outra mensagem do lote falhar
+        try:
+            t0 = time.monotonic()
+            flush_moves(tenant, moves)
+            move_share = (time.monotonic() - t0) / max(1, len(done))
+            for job in done:
+                job["t"]["move"] = move_share
+                record_job(tenant, job)
+        finally:
+            tenant.store.flush()
+            if _work_queue is not None:
+                _work_queue.ack(acked)
+            if cancelled:
+                log("info", f"{len(cancelled)} geração(ões) cancelada(s); mensagens voltam a UNSEEN.")
+            if cancelled or retry:
+                # desligando ou falha isolada: devolve como não lidas para o próximo ciclo (ou processo) pegar
+                imap.uid('STORE', uid_set(cancelled + retry), '-FLAGS.SILENT', '(\\Seen)')
+            tenant.claimed = ()
 
-                mark_processed(msgid)
+    if EXPUNGE_AFTER_COPY and done:
+        log("debug", "Executando EXPUNGE…")
+        imap.expunge()
+    CYCLE_SECONDS.observe(time.monotonic() - cycle_start)
+    if retry_due is not None:
+        due = retry_due if due is None else min(due, retry_due)
+    if _work_queue is not None and _work_queue.outstanding(tenant.name):
+        due = WORK_POLL if due is None else min(due, WORK_POLL)  # volta logo para aplicar os resultados
+    elif backlog and not SHUTDOWN.is_set():
+        due = 0  # sobrou mensagem além do lote: o próximo lote sai já
+    return due
 
-            if EXPUNGE_AFTER_COPY:
-                log("debug", "Executando EXPUNGE…")
-                imap.expunge()
-            imap.logout()
+# ========= Vários nós: fila durável e líder do IMAP =========
+def job_to_task(job):
+    """Job -> dict JSON para a fila: UIDs em str, da mensagem só os cabeçalhos da resposta, início em relógio de parede."""
+    def conv(j):
+        out = {k: v for k, v in j.items() if k not in ("uid", "msg", "started", "submitted", "coalesced")}
+        out["uid"] = j["uid"].decode()
+        out["msg"] = {h: str(j["msg"].get(h) or "") for h in ("Message-ID", "References")}
+        out["started_at"] = time.time() - (time.monotonic() - j["started"])
+        return out
+    task = conv(job)
+    task["coalesced"] = [conv(m) for m in job.get("coalesced", ())]
+    return task
+
+def task_to_job(task):
+    def conv(d):
+        j = dict(d, uid=d["uid"].encode())
+        j["started"] = time.monotonic() - (time.time() - j.pop("started_at"))
+        return j
+    job = conv(task)
+    job["coalesced"] = [conv(m) for m in task.get("coalesced", ())]
+    return job
+
+class NotFetcher(RuntimeError):
+    """Outro nó assumiu a trava de fetcher da caixa no meio do ciclo."""
+
+def check_fetcher(tenant):
+    """Com fila durável, renova a trava "fetcher:<caixa>"; NotFetcher se ela já é de outro nó."""
+    if _work_queue is not None and not _work_queue.acquire(f"fetcher:{tenant.name}", NODE_ID, LEADER_TTL):
+        raise NotFetcher(f"outro nó assumiu a caixa {tenant.name}")
+
+def work_loop(owner):
+    """Worker (ROLE=worker/all com fila): pega tarefas da fila durável, chama o LLM e grava o veredicto."""
+    tenants = {t.name: t for t in _tenants}
+    while not SHUTDOWN.is_set():
+        try:
+            task = _work_queue.lease(owner, WORK_VISIBILITY)
         except Exception as e:
-            log("error", "Erro no loop:", e)
-        time.sleep(CHECK_INTERVAL)
+            log("error", "Falha ao ler a fila de trabalho:", e)
+            task = None
+        if task is None:
+            SHUTDOWN.wait(WORK_POLL)
+            continue
+        task_id, name, payload, attempts, enqueued_at = task
+        tenant = tenants.get(name)
+        if tenant is None:
+            log("warn", f"Tarefa {task_id} é da caixa {name}, que este nó não conhece; devolvida à fila.")
+            _work_queue.release(task_id, owner)
+            SHUTDOWN.wait(WORK_POLL)
+            continue
+        job = task_to_job(payload["job"])
+        job["submitted"] = time.monotonic() - (time.time() - enqueued_at)
+        if attempts > WORK_MAX_ATTEMPTS:
+            # derrubou workers demais: escala sem tentar de novo
+            job["t"]["queue"] = time.time() - enqueued_at
+            job["error"] = f"{attempts - 1} tentativa(s) sem resultado"
+            ai = {"acao": "escalar", "nivel_confianca": 0.0}
+        else:
+            LLM_QUEUE.inc(tenant=name)
+            try:
+                ai = run_agent(tenant, job, payload["plain_text"], payload["code_block"], payload.get("examples", ""))
+            except GenerationCancelled:
+                _work_queue.release(task_id, owner)
+                continue
+            except Exception as e:
+                # o lease vence e a tarefa volta à fila; WORK_MAX_ATTEMPTS segura a mensagem venenosa
+                log("error", f"Tarefa {task_id} ({name}) falhou (tentativa {attempts}):", e)
+                continue
+        result = {"ai": ai, "job": {k: job.get(k) for k in ("cache_hit", "error", "llm_stats")},
+                  "t": {k: v for k, v in job["t"].items() if k in ("queue", "llm")}}
+        if not _work_queue.complete(task_id, owner, result):
+            log("warn", f"Lease da tarefa {task_id} venceu antes do fim; o resultado fica com outro worker.")
+
+def start_workers(n):
+    """Sobe `n` threads de worker da fila durável neste nó."""
+    workers = [Thread(target=work_loop, args=(f"{NODE_ID}/{i}",), name=f"work-{i}", daemon=True) for i in range(n)]
+    for w in workers: w.start()
+    return workers
+
+def start_runtime(tenants=None):
+    """
+    Abre cada caixa (start_tenant), o pool do LLM compartilhado entre elas e, com WORK_QUEUE_DB, a fila durável.
+    Sem `tenants`, lê TENANTS_FILE (ou usa só as variáveis de ambiente). Devolve (caixas, pool).
+    """
+    global _tenants, _pool, _work_queue, _llm_client
+    tenants = tenants or load_tenants(TENANTS_FILE, TENANT_DEFAULTS)
+    set_stage("state_db", "pending")
+    if WORK_QUEUE_DB:
+        _work_queue = SqliteWorkQueue(WORK_QUEUE_DB)
+    if _llm_client is None and LLM_BACKEND == "ollama" and ROLE != "fetcher":
+        _llm_client = OllamaClient(OLLAMA_HOST, OLLAMA_MODEL, stream=OLLAMA_STREAM, keep_alive=OLLAMA_KEEP_ALIVE,
+                                   options=_llm_options, pool_size=LLM_WORKERS)
+    pool = FairPool(LLM_WORKERS, thread_name_prefix="llm")
+    for tenant in tenants:
+        start_tenant(tenant)
+        pool.set_limit(tenant.name, tenant.llm_max_parallel)
+    _tenants, _pool = tenants, pool
+    set_stage("state_db", "ok")
+    if _llm_client is not None and OLLAMA_WARMUP:
+        set_stage("llm", "pending")
+        pool.submit("", warm_up_llm)
+    return tenants, pool
+
+def watch_tenant(tenant, pool):
+    """
+    Loop de uma caixa, na própria thread: processa a INBOX e espera mensagem nova na própria sessão.
+    Com fila durável, só o nó que detém a trava "fetcher:<caixa>" lê o IMAP (e envia as respostas).
+    """
+    lock, leader = f"fetcher:{tenant.name}", False
+    try:  # token do Gmail lido já na subida (e não no primeiro envio); falha aqui não para a caixa
+        tenant.sender.load()
+        set_stage(f"credentials:{tenant.name}", "ok")
+    except Exception as e:
+        log("error", f"[{tenant.name}] Credenciais do Gmail:", e)
+        set_stage(f"credentials:{tenant.name}", "error", e)
+    while not SHUTDOWN.is_set():
+        try:
+            if _work_queue is not None and not _work_queue.acquire(lock, NODE_ID, LEADER_TTL):
+                if leader:
+                    log("warn", f"[{tenant.name}] Outro nó assumiu o IMAP desta caixa.")
+                    leader = False
+                    tenant.session.close()
+                SHUTDOWN.wait(LEADER_TTL / 3)
+                continue
+            if _work_queue is not None and not leader:
+                log("info", f"[{tenant.name}] Este nó ({NODE_ID}) é o fetcher da caixa.")
+                leader = True
+            if readiness().get(f"imap:{tenant.name}", {}).get("state") != "ok":
+                tenant.session.ensure()
+                set_stage(f"imap:{tenant.name}", "ok")
+            serve_replays(tenant)
+            due = process_inbox(tenant, pool)
+            if due == 0:
+                continue  # sobrou lote: sem esperar o servidor
+            # bloqueia até o servidor avisar mensagem nova (IDLE/NOOP), CHECK_INTERVAL expirar
+            # ou uma conversa em espera completar o debounce; com fila, acorda a tempo de renovar a trava
+            wait = CHECK_INTERVAL if due is None else min(CHECK_INTERVAL, max(1, due))
+            if _work_queue is not None:
+                wait = min(wait, LEADER_TTL / 3)
+            if tenant.session.wait_for_mail(wait):
+                log("debug", f"[{tenant.name}] Servidor sinalizou mensagem nova.")
+        except SessionClosed:
+            break
+        except NotFetcher:
+            # resultados não aplicados continuam na fila (sem ack) para o novo fetcher
+            log("warn", f"[{tenant.name}] Outro nó assumiu o IMAP desta caixa no meio do ciclo.")
+            leader = False
+            tenant.session.close()
+        except Exception as e:
+            log("error", f"[{tenant.name}] Erro no loop:", e)
+            set_stage(f"imap:{tenant.name}", "error", e)
+            tenant.session.reset()
+    if leader:
+        _work_queue.release_lock(lock, NODE_ID)
+
+def release_claimed(tenant):
+    """
+    O watcher não voltou nem depois do cancelamento: tira o \\Seen, por uma conexão própria (a dele
+    pode estar travada), das mensagens que ele marcou e não chegou a tratar — o próximo processo pega.
+    """
+    uids = list(tenant.claimed)
+    session = ImapSession(tenant.imap_host, tenant.imap_port, tenant.mail_user, tenant.mail_pass,
+                          use_ssl=tenant.imap_ssl)
+    try:
+        session.connect_once().uid('STORE', uid_set(uids), '-FLAGS.SILENT', '(\\Seen)')
+        log("info", f"[{tenant.name}] {len(uids)} mensagem(ns) do lote abandonado voltam a UNSEEN.")
+    except Exception as e:
+        log("warn", f"[{tenant.name}] Não foi possível devolver {len(uids)} mensagem(ns) como não lidas:", e)
+    finally:
+        session.close()
+
+def drain(timeout=DRAIN_TIMEOUT):
+    """
+    Desligamento limpo (SIGTERM no redeploy): para de buscar mensagens, deixa o lote em andamento
+    terminar por até `timeout` s (respostas enviadas, movidas e gravadas) e só então cancela o que
+    sobrou no LLM — essas mensagens voltam a UNSEEN (ou à fila durável) para o próximo processo.
+    """
+    log("info", f"Desligando: até {timeout:.0f}s para terminar o lote em andamento…")
+    SHUTDOWN.set()
+    for tenant in _tenants:
+        # acorda IDLE/NOOP e o backoff de reconexão: IMAP fora do ar não segura o desligamento
+        if tenant.session is not None:
+            tenant.session.stop()
+        if tenant.archiver is not None:
+            tenant.archiver.session.stop()
+    deadline = time.monotonic() + timeout
+    for th in _threads:
+        th.join(max(0, deadline - time.monotonic()))
+    if any(th.is_alive() for th in _threads):
+        log("warn", "O lote não terminou a tempo; cancelando as gerações em andamento.")
+        stop_watcher()
+        for th in _threads:
+            th.join(5)
+        for tenant in _tenants:
+            if tenant.claimed:  # watcher abandonado no meio do lote
+                release_claimed(tenant)
+    for tenant in _tenants:
+        if tenant.archiver is not None:
+            tenant.archiver.flush(timeout=5)
+        if tenant.store is not None:
+            tenant.store.flush()
+    log("info", "Desligamento concluído.")
+
+def main_loop():
+    set_stage("config", "pending")
+    try:
+        tenants = load_tenants(TENANTS_FILE, TENANT_DEFAULTS)
+        require_env(tenants)
+    except (Exception, SystemExit) as e:
+        log("error", "Configuração inválida:", e)
+        set_stage("config", "error", e)
+        raise
+    set_stage("config", "ok")
+    if ROLE != "worker":
+        for t in tenants:
+            set_stage(f"credentials:{t.name}", "pending")
+            set_stage(f"imap:{t.name}", "pending")
+    print(f"Watcher IMAP — {len(tenants)} caixa(s), papel {ROLE}, envio via Gmail OAuth (XOAUTH2)")
+    tenants, pool = start_runtime(tenants)
+    threads = _threads
+    if ROLE != "worker":
+        # uma thread por caixa (cada uma bloqueia no IDLE da sua sessão); o pool do LLM é um só
+        threads += [Thread(target=watch_tenant, args=(t, pool), name=f"watch-{t.name}", daemon=True) for t in tenants]
+        for th in threads: th.start()
+    if _work_queue is not None and ROLE != "fetcher":
+        threads += start_workers(LLM_WORKERS)
+    for th in threads: th.join()
 
 # ========= HTTP (Render Free) =========
 def create_http_app():
+    from flask import Flask, jsonify, Response  # só quem serve HTTP paga o import
     app = Flask(__name__)
 
     @app.get("/")
@@ -463,18 +1271,52 @@ def create_http_app():
     def health():
         return jsonify({"status": "ok"}), 200
 
+    @app.get("/metrics")
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
     @app.get("/status")
     def status():
         return jsonify({
-            "imap_host": IMAP_HOST,
             "model": OLLAMA_MODEL,
             "backend": LLM_BACKEND,
-            "processed_folder": FOLDER_PROCESSED,
-            "escalate_folder": FOLDER_ESCALATE
+            "llm_workers": LLM_WORKERS,
+            "role": ROLE,
+            "node": NODE_ID,
+            "ready": is_ready(),
+            "startup": readiness(),
+            "work_queue": _work_queue.stats() if _work_queue else None,
+            "tenants": [{
+                "name": t.name,
+                "imap_host": t.imap_host,
+                "mail_user": t.mail_user,
+                "processed_folder": t.folder_processed,
+                "escalate_folder": t.folder_escalate,
+                "llm_queued": _pool.queued().get(t.name, 0) if _pool else None,
+                "batch_size": t.pacer.size() if t.pacer else None,
+                "llm_rate_per_min": round(t.pacer.rate * 60, 2) if t.pacer and t.pacer.rate else None,
+                "llm_cache": t.response_cache.stats() if t.response_cache else None,
+                "tickets_indexed": t.ticket_index.count() if t.ticket_index else None,
+            } for t in _tenants],
         }), 200
 
+    if ADMIN_TOKEN:
+        from admin_api import create_admin_blueprint
+        app.register_blueprint(create_admin_blueprint(
+            ADMIN_TOKEN, lambda: _tenants if ROLE != "worker" else [], request_replay, queue_stats,
+            replay_max=REPLAY_MAX))
+
     return app
 
+def queue_stats(tenant):
+    """O que está em andamento numa caixa (para o /admin/queue)."""
+    return {
+        "llm_queued": _pool.queued().get(tenant.name, 0) if _pool else None,
+        "work_queue_outstanding": _work_queue.outstanding(tenant.name) if _work_queue else None,
+        "batch_size": tenant.pacer.size() if tenant.pacer else None,
+        "sent_queue": tenant.archiver.pending() if tenant.archiver else None,
+    }
+
 def run_watcher():
     try:
         main_loop()
@@ -482,11 +1324,20 @@ def run_watcher():
         log("error", "Watcher encerrou com erro:", e)
 
 if __name__ == "__main__":
-    # inicia watcher em background
+    # inicia watcher em background (config, state.db, credenciais e warm-up ficam prontos lá; ver /status)
     t = Thread(target=run_watcher, daemon=True)
     t.start()
 
+    def on_sigterm(signum, frame):
+        # Render manda SIGTERM no redeploy: termina o lote antes de sair
+        drain()
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, on_sigterm)
+
     # servidor HTTP para o Render
     port = int(os.getenv("PORT", "10000"))
     app = create_http_app()
-    app.run(host="0.0.0.0", port=port)
+    try:
+        app.run(host="0.0.0.0", port=port)
+    finally:
+        stop_watcher()
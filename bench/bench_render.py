@@ -0,0 +1,94 @@
+"""
+Microbenchmark da montagem das respostas: custo por resposta (p50/p99) do caminho antigo
+(`markdown()` no corpo inteiro com a assinatura concatenada a cada envio) contra o ReplyRenderer
+(conversor reaproveitado por thread, assinatura pré-renderizada), em uma ou várias threads.
+
+Uso:
+    python bench/bench_render.py --replies 5000 --threads 4
+"""
+import sys
+import time
+import argparse
+import threading
+from pathlib import Path
+from email.message import EmailMessage
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from markdown import markdown  # noqa: E402
+from reply_renderer import ReplyRenderer  # noqa: E402
+from run_bench import percentile  # noqa: E402
+
+NAME = "Equipe Aprenda COBOL — Suporte"
+FOOTER = ("Se precisar, responda este e-mail com mais detalhes ou anexe seu arquivo .COB/.CBL.\n"
+          "Horário de atendimento: 9h–18h (ET), seg–sex.")
+LINKS = "https://aprendacobol.com.br/curso | https://aprendacobol.com.br/faq"
+BODY = """O erro acontece porque o campo **WS-TOTAL** não foi declarado.
+
+- Declare `01 WS-TOTAL PIC 9(7)V99 VALUE ZEROS.` na WORKING-STORAGE SECTION.
+- Confira o PIC do campo de edição (`PIC ZZZ.ZZ9,99`).
+- Feche o arquivo com `CLOSE ARQ-CLIENTES` antes do `STOP RUN`.
+
+Exemplo:
+
+    PROCEDURE DIVISION.
+        PERFORM UNTIL WS-FIM = 'S'
+            READ ARQ-CLIENTES AT END MOVE 'S' TO WS-FIM
+            END-READ
+        END-PERFORM.
+
+Se o erro continuar, mande a listagem completa da compilação."""
+
+
+def old_message(first_name, body_markdown):
+    # como send_reply/wrap_with_signature faziam antes do ReplyRenderer
+    saud = f"Olá{', ' + first_name if first_name else ''}!\n\n"
+    sig_lines = ["\n---", f"**{NAME}**", FOOTER, LINKS]
+    full = saud + body_markdown.strip() + "\n" + "\n".join(sig_lines) + "\n"
+    msg = EmailMessage()
+    msg.set_content(full)
+    msg.add_alternative(markdown(full), subtype="html")
+    return msg
+
+
+def run(label, fn, replies, threads):
+    per_thread = max(1, replies // threads)
+    samples = [[] for _ in range(threads)]
+
+    def worker(out):
+        for i in range(per_thread):
+            t0 = time.perf_counter()
+            fn(f"Aluno{i % 50}", BODY)
+            out.append(time.perf_counter() - t0)
+
+    ts = [threading.Thread(target=worker, args=(samples[i],)) for i in range(threads)]
+    t0 = time.perf_counter()
+    for t in ts: t.start()
+    for t in ts: t.join()
+    elapsed = time.perf_counter() - t0
+    us = [s * 1e6 for out in samples for s in out]
+    print(f"{label:14} p50={percentile(us, 50):8.1f} µs  p99={percentile(us, 99):8.1f} µs  "
+          f"{len(us) / elapsed:8.0f} respostas/s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--replies", type=int, default=5000)
+    ap.add_argument("--threads", type=int, default=1)
+    ap.add_argument("--html-only", action="store_true", help="mede só a conversão para HTML, sem o EmailMessage")
+    args = ap.parse_args()
+
+    renderer = ReplyRenderer(NAME, FOOTER, LINKS)
+    if args.html_only:
+        def old(first, body):
+            return markdown(f"Olá, {first}!\n\n{body}\n\n---\n**{NAME}**\n{FOOTER}\n{LINKS}\n")
+        new = renderer.render
+    else:
+        old, new = old_message, renderer.message
+    run("markdown()", old, args.replies, args.threads)
+    run("ReplyRenderer", new, args.replies, args.threads)
+
+
+if __name__ == "__main__":
+    main()
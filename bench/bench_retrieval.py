@@ -0,0 +1,80 @@
+"""
+Microbenchmark do TicketIndex: popula um state.db temporário com N tickets respondidos
+sintéticos e mede o tempo de busca (p50/p99) e o custo da primeira carga do índice.
+
+Uso:
+    python bench/bench_retrieval.py --tickets 30000 --queries 2000
+"""
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from state_store import StateStore  # noqa: E402
+from ticket_index import TicketIndex  # noqa: E402
+from run_bench import percentile  # noqa: E402
+
+TOPICS = [
+    ("PIC S9 com sinal some no DISPLAY", "Use PIC -9(7),99 ou SIGN LEADING SEPARATE na edição."),
+    ("erro IGYPS2121-S WS-TOTAL não definido", "Declare WS-TOTAL na WORKING-STORAGE SECTION antes de usar."),
+    ("READ AT END nunca termina o PERFORM UNTIL", "Mova 'S' para a flag no AT END e teste antes do próximo READ."),
+    ("file status 35 ao abrir ARQ-CLIENTES", "Status 35 = arquivo não encontrado; confira o ASSIGN e o caminho."),
+    ("COMPUTE com ROUNDED dá resultado diferente", "ROUNDED arredonda na última casa do receptor; veja as casas decimais do PIC."),
+    ("REDEFINES de data com PIC X(8)", "Use um 01 com 05 ANO, MES, DIA redefinindo o campo PIC X(8)."),
+    ("OCCURS DEPENDING ON estoura o índice", "Valide o contador antes do acesso e ajuste o limite máximo do OCCURS."),
+    ("STRING DELIMITED BY SIZE corta o nome", "Use DELIMITED BY SPACE ou FUNCTION TRIM no campo de origem."),
+]
+WORDS = "saldo cliente arquivo registro campo programa compilar executar tabela indice relatorio total".split()
+# cada aluno tem seus próprios nomes de campo; são eles que diferenciam um ticket do outro
+SUFFIXES = ("SALDO", "NOME", "DATA", "COD", "TOTAL", "FLAG")
+NAMES = [f"WS-{SUFFIXES[i % len(SUFFIXES)]}-{i}" for i in range(6000)]
+
+
+def synthetic_ticket(rng):
+    q, r = rng.choice(TOPICS)
+    noise = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 25)))
+    names = " ".join(rng.choice(NAMES) for _ in range(rng.randint(1, 3)))
+    return f"{q}. {noise} {names}", f"{r} {names}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--tickets", type=int, default=30000)
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--top-k", type=int, default=2)
+    args = ap.parse_args()
+
+    rng = random.Random(7)
+    store = StateStore(str(Path(tempfile.mkdtemp(prefix="cobol-retrieval-")) / "state.db"))
+    for i in range(args.tickets):
+        q, r = synthetic_ticket(rng)
+        store.record({"message_id": f"<t{i}@bench>", "outcome": "respondido", "question": q, "reply": r,
+                      "code_fp": f"{rng.randint(0, args.tickets // 4):016x}", "cache_hit": 0})
+    store.flush()
+
+    index = TicketIndex(store, top_k=args.top_k)
+    t0 = time.perf_counter()
+    index.search("aquecimento")
+    load_s = time.perf_counter() - t0
+
+    timings = []
+    for _ in range(args.queries):
+        q, _ = synthetic_ticket(rng)
+        t0 = time.perf_counter()
+        index.search(q, f"{rng.randint(0, args.tickets):016x}")
+        timings.append((time.perf_counter() - t0) * 1e6)
+
+    print(f"{'tickets':24} {index.count()}")
+    print(f"{'primeira carga (s)':24} {load_s:.3f}")
+    print(f"{'busca p50 (µs)':24} {percentile(timings, 50):.0f}")
+    print(f"{'busca p99 (µs)':24} {percentile(timings, 99):.0f}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Custo de subida do app, para pegar regressão (import pesado que voltou para o topo do app.py).
+- `python -X importtime -c "import app"` em processo novo (melhor de --runs): tempo cumulativo do
+  import do app e os módulos mais caros que ele puxa.
+- Falha (código 1) se passar de --budget-ms ou se algum módulo pesado que deve ser adiado
+  (google-auth, requests, markdown, flask) aparecer no import.
+- --serve sobe `python app.py` de verdade e mede quanto tempo até o /health responder 200
+  (sem credenciais: o watcher falha em segundo plano e aparece no /status, o HTTP não).
+
+Uso:
+    python bench/bench_startup.py --budget-ms 150
+    python bench/bench_startup.py --serve
+"""
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import argparse
+import subprocess
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFERRED = ("google.auth", "google.oauth2", "requests", "markdown", "flask")
+
+
+def import_profile(module="app"):
+    """[(profundidade, módulo, próprio_us, cumulativo_us)] de um `import module` em processo novo."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        head, cum, name = line.split("|")
+        own = int(head.split(":")[1])
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((depth, name.strip(), own, int(cum)))
+    return rows
+
+
+def within(rows, module):
+    """Só o que foi importado por `module` (o -X importtime lista os filhos antes do pai)."""
+    for i, (depth, name, _, _) in enumerate(rows):
+        if depth == 0 and name == module:
+            start = i
+            while start > 0 and rows[start - 1][0] > 0:
+                start -= 1
+            return rows[start:i + 1]
+    raise SystemExit(f"{module} não apareceu no -X importtime")
+
+
+def time_to_health(timeout=30):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, PORT=str(port), LOG_LEVEL="error")
+    t0 = time.monotonic()
+    proc = subprocess.Popen([sys.executable, "app.py"], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.monotonic() - t0 < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as r:
+                    if r.status == 200:
+                        health_ms = (time.monotonic() - t0) * 1000
+                        break
+            except OSError:
+                time.sleep(0.01)
+        else:
+            raise SystemExit(f"/health não respondeu em {timeout}s")
+        time.sleep(0.5)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/status", timeout=5) as r:
+            status = json.load(r)
+        return health_ms, status
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try: proc.wait(timeout=10)
+        except subprocess.TimeoutExpired: proc.kill()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--budget-ms", type=float, default=150, help="teto para o import do app (melhor das rodadas)")
+    ap.add_argument("--top", type=int, default=8)
+    ap.add_argument("--serve", action="store_true", help="mede também o tempo até o /health responder")
+    args = ap.parse_args()
+
+    best = None
+    for _ in range(args.runs):
+        rows = within(import_profile("app"), "app")
+        if best is None or rows[-1][3] < best[-1][3]:
+            best = rows
+    total_ms = best[-1][3] / 1000
+    print(f"import app: {total_ms:.1f} ms (melhor de {args.runs})")
+    for _, name, _, cum in sorted((r for r in best if r[0] == 1), key=lambda r: -r[3])[:args.top]:
+        print(f"  {cum / 1000:7.1f} ms  {name}")
+
+    failed = False
+    eager = sorted({d for _, name, _, _ in best for d in DEFERRED if name == d or name.startswith(d + ".")})
+    if eager:
+        print("importados na subida (deveriam ser adiados):", ", ".join(eager))
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"acima do orçamento de {args.budget_ms:.0f} ms")
+        failed = True
+
+    if args.serve:
+        health_ms, status = time_to_health()
+        print(f"/health 200 em {health_ms:.0f} ms desde o exec")
+        print("etapas:", json.dumps(status.get("startup"), ensure_ascii=False))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Microbenchmark da normalização do texto de entrada (text_clean) contra o caminho antigo
+(regex `<[^<]+?>` no HTML e texto repassado como veio), em e-mails de tamanho real gerados aqui:
+- newsletter HTML grande (CSS/script no <head>, tabelas, &nbsp;, histórico em div.gmail_quote);
+- resposta com cadeia longa de citações ("Em … escreveu:" + linhas ">") e assinatura;
+- listagem COBOL de mainframe (sequência, colunas 73–80 preenchidas, linhas completadas até 80).
+Para cada um: µs por mensagem e MB/s em tamanhos 1×..N× (vazão constante = linear) e tokens
+estimados (CHARS_PER_TOKEN) antes/depois. No fim, o mesmo para o corpus .eml do bench.
+
+Uso:
+    python bench/bench_text_clean.py --scale 8 --repeat 20
+"""
+import re
+import sys
+import time
+import argparse
+from pathlib import Path
+from email import policy
+from email.parser import BytesParser
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from text_clean import html_to_text, clean_body, cobol_source  # noqa: E402
+from cobol_context import CHARS_PER_TOKEN  # noqa: E402
+from run_bench import percentile  # noqa: E402
+
+_OLD_TAG_RE = re.compile(r"<[^<]+?>")
+_OLD_TAG_TAIL_RE = re.compile(r"<[^>]*$")
+
+
+def old_html_to_text(html):
+    # como mime_fetch fazia antes do text_clean
+    return _OLD_TAG_RE.sub("", _OLD_TAG_TAIL_RE.sub("", html))
+
+
+def tokens(text):
+    return int(len(text) / CHARS_PER_TOKEN)
+
+
+def newsletter(n):
+    head = ("<html><head><style>" + "".join(f".c{i}{{margin:0;padding:{i}px;font-family:Arial}}" for i in range(200))
+            + "</style><script>var t=[" + ",".join(str(i) for i in range(500)) + "];</script></head><body>")
+    row = ("<tr><td class='c1'>&nbsp;</td><td><p>Novidade do curso de <b>COBOL</b> &amp; mainframe, "
+           "turma {i} com desconto.</p><a href='https://aprendacobol.com.br/x?utm={i}'>Saiba mais</a></td></tr>\n")
+    body = "<table>" + "".join(row.format(i=i) for i in range(60 * n)) + "</table>"
+    quote = "<div class='gmail_quote'>" + "<div>histórico antigo</div>" * 50 * n + "</div>"
+    return head + body + quote + "</body></html>"
+
+
+def reply_chain(n):
+    text = ["Bom dia, o programa abaixo dá S0C7 na linha 120 quando o arquivo está vazio.", "",
+            "       READ ARQ-ENTRADA AT END MOVE 'S' TO WS-FIM.", "", "--", "Fulano de Tal", "Aluno turma 12",
+            "Enviado do meu iPhone", ""]
+    for depth in range(1, 8 * n + 1):
+        q = ">" * depth + " "
+        text.append(f"{q[:-1]}Em seg., {depth} de jun. de 2024 às 10:{depth % 60:02d}, Suporte <suporte@x.com>")
+        text.append(f"{q[:-1]}escreveu:")
+        text += [q + f"linha {i} da resposta anterior sobre FILE STATUS e o READ do arquivo." for i in range(12)]
+        text.append(q)
+    return "\r\n".join(text)
+
+
+def listing(n):
+    lines = [f"{(i + 1) * 100:06d}       MOVE WS-CAMPO-{i:04d} TO WS-SAIDA-{i:04d}.".ljust(72) + "PROG0001"
+             for i in range(400 * n)]
+    return "\n".join(l.replace("       MOVE", "\xa0" * 7 + "MOVE") if i % 3 == 0 else l.ljust(80)
+                     for i, l in enumerate(lines))
+
+
+CASES = (
+    ("newsletter", newsletter, old_html_to_text, lambda s: clean_body(html_to_text(s))),
+    ("citações", reply_chain, lambda s: s.strip(), clean_body),
+    ("listagem", listing, lambda s: s, lambda s: "\n".join(cobol_source(s.splitlines()))),
+)
+
+
+def timed(fn, arg, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(arg)
+        samples.append(time.perf_counter() - t0)
+    return out, percentile(samples, 50)
+
+
+def corpus_tokens(corpus_dir):
+    before = after = 0
+    for f in sorted(Path(corpus_dir).glob("*.eml")):
+        msg = BytesParser(policy=policy.default).parsebytes(f.read_bytes())
+        for part in msg.walk():
+            if part.get_content_maintype() != "text" or part.get_filename():
+                continue
+            raw = part.get_content()
+            if part.get_content_subtype() == "html":
+                before += tokens(old_html_to_text(raw))
+                after += tokens(clean_body(html_to_text(raw)))
+            else:
+                before += tokens(raw.strip())
+                after += tokens(clean_body(raw))
+    return before, after
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scale", type=int, default=8, help="maior multiplicador de tamanho (1, 2, 4, … até ele)")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--corpus", default=str(HERE / "corpus"))
+    args = ap.parse_args()
+
+    scales = [1]
+    while scales[-1] * 2 <= args.scale:
+        scales.append(scales[-1] * 2)
+    for label, make, old, new in CASES:
+        print(label)
+        for k in scales:
+            src = make(k)
+            mb = len(src.encode()) / 1e6
+            old_out, old_s = timed(old, src, args.repeat)
+            new_out, new_s = timed(new, src, args.repeat)
+            print(f"  {k:2d}× {len(src) / 1024:7.0f} KB  antigo {old_s * 1e6:8.0f} µs ({mb / old_s:6.1f} MB/s, "
+                  f"{tokens(old_out):6d} tok)  novo {new_s * 1e6:8.0f} µs ({mb / new_s:6.1f} MB/s, "
+                  f"{tokens(new_out):6d} tok)")
+    before, after = corpus_tokens(args.corpus)
+    print(f"corpus: {before} → {after} tokens de texto ({(1 - after / max(1, before)) * 100:.0f}% a menos)")
+
+
+if __name__ == "__main__":
+    main()
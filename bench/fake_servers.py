@@ -0,0 +1,554 @@
+"""
+Stand-ins locais (sem rede externa) para medir o pipeline do watcher:
+- FakeImapServer: IMAP4rev1 em texto puro, em memória, contando comandos;
+- FakeSmtpServer: sink SMTP que aceita qualquer AUTH e guarda as mensagens;
+- FakeOllamaServer: /api/chat e /api/generate com latência configurável, prefill por token
+  (com cache do prefixo de sistema, como o Ollama) e taxa de JSON malformado.
+Cobrem só o subconjunto de protocolo que o app usa.
+"""
+import re
+import sys
+import select
+import json
+import time
+import random
+import imaplib
+import socketserver
+import threading
+from collections import Counter
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _parsed(m):
+    # compat32 mantém o corpo de cada parte exatamente como veio (base64/QP intactos)
+    if "parsed" not in m:
+        m["parsed"] = BytesParser(policy=policy.compat32).parsebytes(m["raw"])
+    return m["parsed"]
+
+
+class _QuietErrors:
+    def handle_error(self, request, client_address):
+        # cliente que desiste no meio (cancelamento, fim do bench) não é erro do fake
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Server(_QuietErrors, socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _HttpServer(_QuietErrors, ThreadingHTTPServer):
+    daemon_threads = True
+
+
+# ================= IMAP =================
+class _Mailbox:
+    def __init__(self):
+        self.messages = []  # dicts: uid, flags(set), raw(bytes), internaldate
+        self.uidnext = 1
+
+    def add(self, raw, flags=()):
+        msg = {"uid": self.uidnext, "flags": set(flags), "raw": raw, "internaldate": time.time()}
+        self.uidnext += 1
+        self.messages.append(msg)
+        return msg
+
+
+def _uid_set_match(spec, uid, max_uid):
+    for part in spec.split(","):
+        if ":" in part:
+            a, b = part.split(":")
+            a = max_uid if a == "*" else int(a)
+            b = max_uid if b == "*" else int(b)
+            if min(a, b) <= uid <= max(a, b):
+                return True
+        elif (max_uid if part == "*" else int(part)) == uid:
+            return True
+    return False
+
+
+def _split_header_body(raw):
+    for sep in (b"\r\n\r\n", b"\n\n"):
+        i = raw.find(sep)
+        if i >= 0:
+            return raw[:i + len(sep)], raw[i + len(sep):]
+    return raw, b""
+
+
+def _header_fields(raw, names):
+    header, _ = _split_header_body(raw)
+    wanted = {n.upper() for n in names}
+    out, keep = [], False
+    for line in header.splitlines(keepends=True):
+        if line[:1] in (b" ", b"\t"):
+            if keep: out.append(line)
+            continue
+        name = line.split(b":", 1)[0].strip().decode(errors="ignore").upper()
+        keep = name in wanted
+        if keep: out.append(line)
+    return b"".join(out) + b"\r\n"
+
+
+def _q(v):
+    if v is None:
+        return "NIL"
+    return '"' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _encoded_body(part):
+    """Corpo da parte como está no fio (ainda em base64/QP)."""
+    if part.get_content_type() == "message/rfc822":
+        return part.get_payload(0).as_bytes()
+    # _payload guarda o corpo cru (bytes não-ASCII como surrogates); get_payload() decodificaria o charset
+    return part._payload.encode("ascii", "surrogateescape")
+
+
+def _bodystructure(part):
+    if part.is_multipart() and part.get_content_type() != "message/rfc822":
+        return "(" + "".join(_bodystructure(p) for p in part.get_payload()) + f" {_q(part.get_content_subtype())})"
+    maintype, subtype = part.get_content_maintype(), part.get_content_subtype()
+    params = (part.get_params() or [])[1:]
+    params = "(" + " ".join(f"{_q(k)} {_q(v)}" for k, v in params) + ")" if params else "NIL"
+    body = _encoded_body(part)
+    lines = body.count(b"\n")
+    out = (f"({_q(maintype)} {_q(subtype)} {params} NIL NIL "
+           f"{_q(part.get('Content-Transfer-Encoding', '7bit'))} {len(body)}")
+    if part.get_content_type() == "message/rfc822":
+        out += f" NIL {_bodystructure(part.get_payload(0))} {lines}"
+    elif maintype == "text":
+        out += f" {lines}"
+    disp, filename = part.get("Content-Disposition"), part.get_filename()
+    if disp:
+        out += f" NIL ({_q(disp.split(';')[0].strip())} " + (f'("filename" {_q(filename)})' if filename else "NIL") + ")"
+    return out + ")"
+
+
+def _section_part(msg, section):
+    """Parte correspondente a uma seção IMAP ("1", "2.1"…)."""
+    cur = msg
+    for n in (int(x) for x in section.split(".")):
+        if cur.get_content_type() == "message/rfc822":
+            cur = cur.get_payload(0)
+        if cur.is_multipart():
+            cur = cur.get_payload(n - 1)
+        elif n != 1:
+            raise ValueError(f"seção inexistente: {section}")
+    return cur
+
+
+_FETCH_ITEM_RE = re.compile(r"BODY(?:\.PEEK)?\[[^\]]*\](?:<\d+\.\d+>)?|[A-Z0-9.]+", re.I)
+
+
+class _ImapHandler(socketserver.StreamRequestHandler):
+    def send(self, data):
+        data = data if isinstance(data, bytes) else data.encode()
+        self.server.owner.bytes_out += len(data)
+        self.wfile.write(data)
+
+    def handle(self):
+        srv = self.server.owner
+        self.selected, self.known = None, 0
+        self.send("* OK FakeIMAP pronto\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            text = line.decode(errors="ignore").rstrip("\r\n")
+            literal = re.search(r"\{(\d+)\}$", text)
+            data = None
+            if literal:  # APPEND com literal
+                self.send("+ Ready\r\n")
+                data = self.rfile.read(int(literal.group(1)))
+                self.rfile.readline()
+                text = text[:literal.start()].rstrip()
+            parts = text.split(" ", 2)
+            tag = parts[0]
+            cmd = parts[1].upper() if len(parts) > 1 else ""
+            args = parts[2] if len(parts) > 2 else ""
+            if cmd == "UID":
+                sub, _, args = args.partition(" ")
+                cmd = "UID " + sub.upper()
+            srv.commands[cmd] += 1
+            try:
+                if self.dispatch(srv, tag, cmd, args, data) == "BYE":
+                    return
+            except Exception as e:
+                self.send(f"{tag} BAD {e}\r\n")
+
+    def push_exists(self, srv):
+        """Como servidores reais: avisa (EXISTS não solicitado) o que chegou na pasta selecionada."""
+        with srv.lock:
+            box = srv.mailboxes.get(self.selected)
+            if box is None or box.uidnext <= self.known:
+                return
+            self.known = box.uidnext
+            count = len(box.messages)
+        self.send(f"* {count} EXISTS\r\n")
+
+    def dispatch(self, srv, tag, cmd, args, data):
+        if cmd in ("NOOP", "UID STORE", "UID COPY", "UID MOVE"):
+            self.push_exists(srv)
+        if cmd == "CAPABILITY":
+            self.send(f"* CAPABILITY {' '.join(srv.capabilities)}\r\n{tag} OK CAPABILITY\r\n")
+        elif cmd == "LOGIN":
+            self.send(f"{tag} OK LOGIN\r\n")
+        elif cmd in ("SELECT", "EXAMINE"):
+            name = args.strip('"')
+            with srv.lock:
+                box = srv.mailboxes.setdefault(name, _Mailbox())
+                self.selected, self.known = name, box.uidnext
+                self.send(f"* {len(box.messages)} EXISTS\r\n* OK [UIDNEXT {box.uidnext}]\r\n"
+                          f"* OK [UIDVALIDITY 1]\r\n{tag} OK [READ-WRITE] SELECT\r\n")
+        elif cmd == "NOOP":
+            self.send(f"{tag} OK NOOP\r\n")
+        elif cmd == "IDLE":
+            self.send("+ idling\r\n")
+            while not select.select([self.connection], [], [], 0.05)[0]:
+                self.push_exists(srv)
+            self.rfile.readline()  # DONE
+            self.send(f"{tag} OK IDLE\r\n")
+        elif cmd == "LIST":
+            with srv.lock:
+                for name in srv.mailboxes:
+                    self.send(f'* LIST (\\HasNoChildren) "{srv.delim}" "{name}"\r\n')
+            self.send(f"{tag} OK LIST\r\n")
+        elif cmd == "CREATE":
+            name = args.strip('"')
+            with srv.lock:
+                if name in srv.mailboxes:
+                    self.send(f"{tag} NO ALREADYEXISTS\r\n")
+                else:
+                    srv.mailboxes[name] = _Mailbox()
+                    self.send(f"{tag} OK CREATE\r\n")
+        elif cmd == "APPEND":
+            name = args.split(" ", 1)[0].strip('"')
+            with srv.lock:
+                if name not in srv.mailboxes:
+                    self.send(f"{tag} NO [TRYCREATE]\r\n")
+                else:
+                    srv.mailboxes[name].add(data or b"", flags={"\\Seen"})
+                    self.send(f"{tag} OK APPEND\r\n")
+        elif cmd == "UID SEARCH":
+            with srv.lock:
+                box = srv.mailboxes[self.selected]
+                crit = args.upper()
+                hdr = re.search(r'HEADER MESSAGE-ID "([^"]*)"', args, re.I)
+                uids = [str(m["uid"]) for m in box.messages
+                        if ("UNSEEN" not in crit or "\\Seen" not in m["flags"])
+                        and ("UNDELETED" not in crit or "\\Deleted" not in m["flags"])
+                        and (not hdr or hdr.group(1).encode() in m["raw"])]
+            self.send(f"* SEARCH {' '.join(uids)}\r\n{tag} OK SEARCH\r\n")
+        elif cmd == "UID FETCH":
+            spec, _, items = args.partition(" ")
+            self.fetch(srv, tag, spec, items)
+        elif cmd in ("UID COPY", "UID MOVE"):
+            spec, _, dest = args.partition(" ")
+            dest = dest.strip('"')
+            with srv.lock:
+                if dest not in srv.mailboxes:
+                    self.send(f"{tag} NO [TRYCREATE] sem pasta\r\n")
+                    return
+                box = srv.mailboxes[self.selected]
+                max_uid = box.uidnext - 1
+                picked = [m for m in box.messages if _uid_set_match(spec, m["uid"], max_uid)]
+                for m in picked:
+                    srv.mailboxes[dest].add(m["raw"], flags=m["flags"] - {"\\Deleted"})
+                if cmd == "UID MOVE":
+                    box.messages = [m for m in box.messages if m not in picked]
+            self.send(f"{tag} OK {cmd}\r\n")
+        elif cmd == "UID STORE":
+            spec, _, rest = args.partition(" ")
+            op, _, flags = rest.partition(" ")
+            flags = set(flags.strip("()").split())
+            with srv.lock:
+                box = srv.mailboxes[self.selected]
+                max_uid = box.uidnext - 1
+                for m in box.messages:
+                    if _uid_set_match(spec, m["uid"], max_uid):
+                        if op.upper().startswith("+"): m["flags"] |= flags
+                        elif op.upper().startswith("-"): m["flags"] -= flags
+                        else: m["flags"] = set(flags)
+            self.send(f"{tag} OK STORE\r\n")
+        elif cmd == "EXPUNGE":
+            with srv.lock:
+                box = srv.mailboxes[self.selected]
+                box.messages = [m for m in box.messages if "\\Deleted" not in m["flags"]]
+            self.send(f"{tag} OK EXPUNGE\r\n")
+        elif cmd == "LOGOUT":
+            self.send(f"* BYE\r\n{tag} OK LOGOUT\r\n")
+            return "BYE"
+        else:
+            self.send(f"{tag} BAD comando não suportado: {cmd}\r\n")
+
+    def fetch_item(self, m, item):
+        """Devolve (nome_na_resposta, bytes|str) para um item de FETCH."""
+        up = item.upper()
+        if up == "UID":
+            return "UID", str(m["uid"])
+        if up == "FLAGS":
+            return "FLAGS", "(" + " ".join(sorted(m["flags"])) + ")"
+        if up == "RFC822":
+            m["flags"].add("\\Seen")
+            return "RFC822", m["raw"]
+        if up == "BODYSTRUCTURE":
+            return "BODYSTRUCTURE", _bodystructure(_parsed(m))
+        if up == "INTERNALDATE":
+            return "INTERNALDATE", imaplib.Time2Internaldate(m["internaldate"])
+        sect = re.match(r"BODY(\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?", item, re.I)
+        if sect:
+            peek, section, start, count = sect.groups()
+            if not peek:
+                m["flags"].add("\\Seen")
+            su = section.upper()
+            if su.startswith("HEADER.FIELDS"):
+                names = re.search(r"\(([^)]*)\)", section).group(1).split()
+                payload = _header_fields(m["raw"], names)
+            elif su == "HEADER":
+                payload = _split_header_body(m["raw"])[0]
+            elif su == "TEXT":
+                payload = _split_header_body(m["raw"])[1]
+            elif su:
+                payload = _encoded_body(_section_part(_parsed(m), section))
+            else:
+                payload = m["raw"]
+            name = f"BODY[{section}]"
+            if start is not None:
+                payload = payload[int(start):int(start) + int(count)]
+                name += f"<{start}>"
+            return name, payload
+        raise ValueError(f"item de FETCH não suportado: {item}")
+
+    def fetch(self, srv, tag, spec, items):
+        wanted = _FETCH_ITEM_RE.findall(items.strip()[1:-1] if items.strip().startswith("(") else items)
+        if not any(w.upper() == "UID" for w in wanted):
+            wanted = ["UID"] + wanted
+        with srv.lock:
+            box = srv.mailboxes[self.selected]
+            max_uid = box.uidnext - 1
+            for seq, m in enumerate(box.messages, 1):
+                if not _uid_set_match(spec, m["uid"], max_uid):
+                    continue
+                out = [f"* {seq} FETCH (".encode()]
+                for i, w in enumerate(wanted):
+                    name, val = self.fetch_item(m, w)
+                    sep = b" " if i else b""
+                    if isinstance(val, bytes):
+                        out.append(sep + f"{name} {{{len(val)}}}\r\n".encode() + val)
+                    else:
+                        out.append(sep + f"{name} {val}".encode())
+                out.append(b")\r\n")
+                self.send(b"".join(out))
+        self.send(f"{tag} OK FETCH\r\n")
+
+
+class FakeImapServer:
+    def __init__(self, capabilities=("IMAP4rev1", "IDLE", "MOVE", "UIDPLUS"), delim="."):
+        self.capabilities = list(capabilities)
+        self.delim = delim
+        self.lock = threading.RLock()
+        self.commands = Counter()
+        self.bytes_out = 0
+        self.mailboxes = {"INBOX": _Mailbox(), "INBOX.Sent": _Mailbox()}
+        self._server = _Server(("127.0.0.1", 0), _ImapHandler)
+        self._server.owner = self
+        self.port = self._server.server_address[1]
+
+    def deliver(self, raw: bytes):
+        with self.lock:
+            msg = self.mailboxes["INBOX"].add(raw)
+            _parsed(msg)  # parse do MIME fora do tempo medido
+            return msg
+
+    def count(self, mailbox):
+        with self.lock:
+            return len(self.mailboxes.get(mailbox, _Mailbox()).messages)
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# ================= SMTP =================
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        srv = self.server.owner
+        w = self.wfile.write
+        w(b"220 fake-smtp pronto\r\n")
+        sent = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode(errors="ignore").strip()
+            verb = cmd.split(" ", 1)[0].upper()
+            srv.commands[verb] += 1
+            if verb in ("EHLO", "HELO"):
+                w(b"250-fake-smtp\r\n250-AUTH XOAUTH2\r\n250 8BITMIME\r\n")
+            elif verb == "AUTH":
+                w(b"235 2.7.0 Accepted\r\n")
+            elif verb == "RCPT" and any(r in cmd.lower() for r in srv.reject):
+                w(b"550 5.1.1 destinatario recusado\r\n")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                w(b"250 OK\r\n")
+            elif verb == "DATA":
+                w(b"354 manda\r\n")
+                buf = []
+                while True:
+                    l = self.rfile.readline()
+                    if l in (b".\r\n", b".\n", b""):
+                        break
+                    buf.append(l[1:] if l.startswith(b"..") else l)
+                msg = BytesParser(policy=policy.default).parsebytes(b"".join(buf))
+                with srv.lock:
+                    srv.messages.append(msg)
+                    lost = srv.lose_replies > 0
+                    srv.lose_replies -= lost
+                if lost:  # aceitou, mas a resposta se perde: o cliente não sabe se foi
+                    return
+                w(b"250 OK queued\r\n")
+                sent += 1
+                if srv.per_connection and sent >= srv.per_connection:
+                    return  # servidor encerra a sessão (limite por conexão); o cliente só vê no próximo comando
+            elif verb == "QUIT":
+                w(b"221 tchau\r\n")
+                return
+            else:
+                w(b"502 nao implementado\r\n")
+
+
+class FakeSmtpServer:
+    def __init__(self, reject=(), per_connection=0, lose_replies=0):
+        self.reject = [r.lower() for r in reject]  # RCPT com algum destes trechos leva 550
+        self.per_connection = per_connection  # fecha a conexão depois de tantas mensagens (0 = nunca)
+        self.lose_replies = lose_replies  # as próximas N mensagens aceitas ficam sem resposta ao DATA
+        self.lock = threading.Lock()
+        self.messages = []
+        self.commands = Counter()
+        self._server = _Server(("127.0.0.1", 0), _SmtpHandler)
+        self._server.owner = self
+        self.port = self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# ================= Ollama =================
+VERDICT_OK = {
+    "assunto": "Re: dúvida",
+    "corpo_markdown": "- Confira o PIC do campo.\\n- Feche o arquivo com CLOSE antes do STOP RUN.",
+    "nivel_confianca": 0.9,
+    "acao": "responder",
+}
+
+
+class _OllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _chunk(self, obj):
+        data = json.dumps(obj).encode() + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _json(self, obj):
+        payload = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _prefill(self, srv, prefix, rest):
+        """Simula o cache de KV do Ollama: prefixo já visto não é reavaliado. Devolve (tokens, segundos)."""
+        with srv.lock:
+            cached = srv.prefix_cache and prefix in srv.prefixes
+            srv.prefixes.add(prefix)
+        n = (0 if cached else len(prefix) // 4) + len(rest) // 4
+        secs = srv.prefill_per_token * n
+        time.sleep(secs)
+        return n, secs
+
+    def do_POST(self):
+        srv = self.server.owner
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        chat = self.path == "/api/chat"
+        if chat:
+            messages = body.get("messages") or []
+            prefix = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+            prompt = "".join(m["content"] for m in messages if m["role"] != "system")
+        else:
+            prefix, prompt = "", body.get("prompt") or ""
+        with srv.lock:
+            srv.requests += 1
+            bad = srv.rng.random() < srv.malformed_rate
+        if not prompt:  # warm-up (com /api/chat também avalia a mensagem de sistema)
+            n, secs = self._prefill(srv, prefix, "")
+            self._json(({"message": {"role": "assistant", "content": ""}} if chat else {"response": ""})
+                       | {"done": True, "prompt_eval_count": n, "prompt_eval_duration": int(secs * 1e9)})
+            return
+        text = "Desculpe, não consigo responder isso." if bad else json.dumps(VERDICT_OK, ensure_ascii=False)
+        tokens = [text[i:i + 4] for i in range(0, len(text), 4)]
+        n, secs = self._prefill(srv, prefix, prompt)
+        final = {"done": True, "eval_count": len(tokens), "prompt_eval_count": n,
+                 "prompt_eval_duration": int(secs * 1e9)}
+        piece = (lambda t: {"message": {"role": "assistant", "content": t}}) if chat else (lambda t: {"response": t})
+        time.sleep(srv.ttft)
+        if not body.get("stream", True):
+            time.sleep(srv.per_token * len(tokens))
+            self._json(piece(text) | final)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for tok in tokens:
+                time.sleep(srv.per_token)
+                self._chunk(piece(tok) | {"done": False})
+            self._chunk(piece("") | final)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # cliente parou a geração
+
+
+class FakeOllamaServer:
+    def __init__(self, ttft=0.05, per_token=0.002, malformed_rate=0.0, seed=42,
+                 prefill_per_token=0.0, prefix_cache=True):
+        self.ttft = ttft
+        self.per_token = per_token
+        self.prefill_per_token = prefill_per_token
+        self.prefix_cache = prefix_cache
+        self.prefixes = set()
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self._server = _HttpServer(("127.0.0.1", 0), _OllamaHandler)
+        self._server.owner = self
+        self.port = self._server.server_address[1]
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
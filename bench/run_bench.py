@@ -0,0 +1,230 @@
+"""
+Benchmark offline do pipeline do watcher (process_inbox) contra stand-ins locais:
+IMAP em memória semeado com o corpus .eml, sink SMTP e um /api/generate falso.
+
+Uso:
+    python bench/run_bench.py --messages 200 --workers 4 --ttft 0.2 --per-token 0.005 --malformed 0.1
+
+Relata mensagens/s, latência p50/p95 por mensagem (ledger), comandos IMAP e KB lidos por mensagem.
+Não usa rede externa nem credenciais reais.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import tempfile
+from pathlib import Path
+from collections import Counter
+from email import policy
+from email.parser import BytesParser
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+from fake_servers import FakeImapServer, FakeSmtpServer, FakeOllamaServer  # noqa: E402
+
+
+def load_corpus(corpus_dir):
+    files = sorted(Path(corpus_dir).glob("*.eml"))
+    if not files:
+        raise SystemExit(f"Nenhum .eml em {corpus_dir}")
+    return [f.read_bytes() for f in files]
+
+
+def make_copies(corpus, n, unique=True, attachment_kb=0, per_thread=1, poison=0):
+    """
+    N mensagens a partir do corpus, cada uma com Message-ID próprio (e texto próprio se `unique`).
+    `attachment_kb` anexa a cada uma uma listagem .cbl grande (em base64), para medir o custo de anexos.
+    `per_thread` > 1 entrega rajadas: cada ticket seguido de follow-ups (Re:, In-Reply-To) do mesmo remetente.
+    As primeiras `poison` vêm de um remetente que o SMTP falso recusa (falha isolada por mensagem).
+    """
+    listing = b"".join(b"       %06d     MOVE WS-CAMPO TO WS-SAIDA.\n" % i
+                       for i in range(attachment_kb * 1024 // 45 + 1))[:attachment_kb * 1024]
+    out = []
+    for i in range(n):
+        thread, k = divmod(i, per_thread)
+        msg = BytesParser(policy=policy.default).parsebytes(corpus[thread % len(corpus)])
+        del msg["Message-ID"]
+        msg["Message-ID"] = f"<bench-{i}@bench.local>"
+        if k:
+            msg["In-Reply-To"] = f"<bench-{i - 1}@bench.local>"
+        if i < poison:
+            del msg["From"]
+            msg["From"] = f"Aluno Recusado <poison{i}@bench.local>"
+        if unique:
+            subject = msg["Subject"]
+            del msg["Subject"]
+            msg["Subject"] = f"{'Re: ' if k else ''}{subject} #{thread}"
+            body = msg.get_body(preferencelist=("plain",))
+            if body is not None:
+                body.set_content(body.get_content() + f"\n(ticket {i})\n")
+        if listing:
+            if not msg.is_multipart():
+                msg.make_mixed()
+            msg.add_attachment(listing, maintype="text", subtype="plain", filename="listagem.cbl", cte="base64")
+        out.append(bytes(msg))
+    return out
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def fake_token_file(tmp):
+    path = Path(tmp) / "token.json"
+    path.write_text(json.dumps({
+        "token": "bench-token", "refresh_token": "bench", "client_id": "bench",
+        "client_secret": "bench", "expiry": "2099-01-01T00:00:00Z",
+    }))
+    return str(path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--messages", type=int, default=100)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--ttft", type=float, default=0.05, help="segundos até o primeiro token do LLM falso")
+    ap.add_argument("--per-token", type=float, default=0.002, help="segundos por token gerado")
+    ap.add_argument("--malformed", type=float, default=0.0, help="fração de respostas com JSON inválido")
+    ap.add_argument("--corpus", default=str(HERE / "corpus"))
+    ap.add_argument("--prefill-per-token", type=float, default=0.0002,
+                    help="segundos por token de prompt avaliado (prefill)")
+    ap.add_argument("--no-prefix-cache", action="store_true",
+                    help="LLM falso sem cache do prefixo: reavalia a mensagem de sistema a cada chamada")
+    ap.add_argument("--no-stream", action="store_true", help="usa /api/chat sem streaming")
+    ap.add_argument("--cache", action="store_true", help="liga o cache de veredictos (corpus repetido)")
+    ap.add_argument("--no-move", action="store_true", help="servidor IMAP sem capability MOVE")
+    ap.add_argument("--attachment-kb", type=int, default=0, help="anexa uma listagem .cbl deste tamanho a cada mensagem")
+    ap.add_argument("--per-thread", type=int, default=1,
+                    help="mensagens por conversa (>1 liga o agrupamento por conversa, sem debounce)")
+    ap.add_argument("--tenants", type=int, default=1,
+                    help="caixas num processo só (um IMAP falso cada, TENANTS_FILE); a 1ª recebe metade das mensagens")
+    ap.add_argument("--queue", action="store_true",
+                    help="passa as chamadas ao LLM pela fila durável (WORK_QUEUE_DB) com workers neste processo")
+    ap.add_argument("--poison", type=int, default=0,
+                    help="mensagens cujo remetente o SMTP recusa: testam retentativa e desistência por mensagem")
+    ap.add_argument("--json", action="store_true", help="imprime o resultado em JSON")
+    args = ap.parse_args()
+
+    caps = ["IMAP4rev1", "IDLE", "UIDPLUS"] + ([] if args.no_move else ["MOVE"])
+    imap_srvs = [FakeImapServer(capabilities=caps).start() for _ in range(args.tenants)]
+    smtp_srv = FakeSmtpServer(reject=["poison"]).start()
+    llm_srv = FakeOllamaServer(ttft=args.ttft, per_token=args.per_token, malformed_rate=args.malformed,
+                               prefill_per_token=args.prefill_per_token,
+                               prefix_cache=not args.no_prefix_cache).start()
+    tmp = tempfile.mkdtemp(prefix="cobol-bench-")
+
+    # o app lê a configuração no import: ambiente montado antes
+    os.environ.update({
+        "IMAP_HOST": "127.0.0.1", "IMAP_PORT": str(imap_srvs[0].port), "IMAP_SSL": "false",
+        "MAIL_USER": "suporte@bench.local", "MAIL_PASS": "bench",
+        "GMAIL_EMAIL": "bench@gmail.local", "GOOGLE_TOKEN_FILE": fake_token_file(tmp),
+        "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(smtp_srv.port), "SMTP_STARTTLS": "false",
+        "OLLAMA_HOST": llm_srv.url, "OLLAMA_STREAM": "false" if args.no_stream else "true",
+        "LLM_WORKERS": str(args.workers), "LLM_CACHE": "true" if args.cache else "false",
+        "STATE_DB": str(Path(tmp) / "state.db"), "EXPUNGE_AFTER_COPY": "true",
+        "SENT_FOLDER": "INBOX.Sent", "THREAD_GROUPING": "true" if args.per_thread > 1 else "false",
+        "THREAD_DEBOUNCE_SECONDS": "0", "MESSAGE_RETRY_BACKOFF_SECONDS": "0",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "warn"),
+    })
+    if args.tenants > 1:
+        tenants_file = Path(tmp) / "tenants.json"
+        tenants_file.write_text(json.dumps({"tenants": [
+            {"name": f"t{i}", "imap_port": srv.port, "mail_user": f"suporte@t{i}.bench.local"}
+            for i, srv in enumerate(imap_srvs)]}))
+        os.environ["TENANTS_FILE"] = str(tenants_file)
+    if args.queue:
+        os.environ.update({"WORK_QUEUE_DB": str(Path(tmp) / "queue.db"), "WORK_POLL_SECONDS": "0.02"})
+    import app
+
+    # várias caixas: a primeira recebe metade das mensagens (rajada), as outras dividem o resto
+    copies = make_copies(load_corpus(args.corpus), args.messages, unique=not args.cache,
+                         attachment_kb=args.attachment_kb, per_thread=args.per_thread, poison=args.poison)
+    first = len(copies) // 2 if args.tenants > 1 else len(copies)
+    for i, raw in enumerate(copies):
+        imap_srvs[0 if i < first else 1 + (i - first) % (args.tenants - 1)].deliver(raw)
+    expected = [srv.count("INBOX") for srv in imap_srvs]
+
+    tenants, pool = app.start_runtime()
+    workers = app.start_workers(args.workers) if args.queue else []
+    cycles = Counter()
+
+    def drain(tenant, n):
+        while True:
+            due = app.process_inbox(tenant, pool)
+            cycles[tenant.name] += 1
+            done = tenant.store.con.execute("SELECT COUNT(*) FROM ledger").fetchone()[0]
+            if done >= n or (due is None and cycles[tenant.name] > n + 5):
+                break
+            if due is not None:  # fila durável: dá tempo aos workers
+                time.sleep(due)
+
+    t0 = time.monotonic()
+    watchers = [threading.Thread(target=drain, args=(t, n)) for t, n in zip(tenants, expected)]
+    for w in watchers: w.start()
+    for w in watchers: w.join()
+    elapsed = time.monotonic() - t0
+    app.SHUTDOWN.set()
+    for w in workers: w.join()
+    for tenant in tenants:
+        tenant.archiver.flush(timeout=30)
+        tenant.session.close()
+    pool.shutdown(wait=True)
+
+    rows, llm_rows, per_tenant = [], [], {}
+    for tenant in tenants:
+        mine = tenant.store.con.execute("SELECT total_ms, outcome FROM ledger").fetchall()
+        rows += mine
+        llm_rows += tenant.store.con.execute(
+            "SELECT prompt_tokens, prefill_ms FROM ledger WHERE prefill_ms IS NOT NULL").fetchall()
+        per_tenant[tenant.name] = {"messages": len(mine),
+                                   "latency_ms_p95": round(percentile([r[0] for r in mine if r[0] is not None], 95), 1)}
+    totals = [r[0] for r in rows if r[0] is not None]
+    outcomes = {}
+    for _, o in rows:
+        outcomes[o] = outcomes.get(o, 0) + 1
+    imap_cmds = dict(sum((srv.commands for srv in imap_srvs), Counter()))
+    n = max(1, len(rows))
+    result = {
+        "messages": len(rows),
+        "cycles": sum(cycles.values()),
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_s": round(len(rows) / elapsed, 2) if elapsed else None,
+        "latency_ms_p50": round(percentile(totals, 50), 1),
+        "latency_ms_p95": round(percentile(totals, 95), 1),
+        "outcomes": outcomes,
+        "imap_commands_total": sum(imap_cmds.values()),
+        "imap_commands_per_message": round(sum(imap_cmds.values()) / n, 2),
+        "imap_commands": imap_cmds,
+        "imap_kb_per_message": round(sum(srv.bytes_out for srv in imap_srvs) / 1024 / n, 1),
+        "smtp_messages": len(smtp_srv.messages),
+        "smtp_commands_per_message": round(sum(smtp_srv.commands.values()) / n, 2),
+        "llm_requests": llm_srv.requests,
+        "message_failures": sum(t.store.con.execute("SELECT COUNT(*) FROM ledger WHERE error LIKE '%falha(s)%'")
+                                .fetchone()[0] for t in tenants),
+        "llm_prompt_tokens_avg": round(sum(r[0] for r in llm_rows if r[0]) / max(1, len(llm_rows)), 1),
+        "llm_prefill_ms_p50": round(percentile([r[1] for r in llm_rows], 50), 1),
+        "inbox_left": sum(srv.count("INBOX") for srv in imap_srvs),
+    }
+    if len(tenants) > 1:
+        result["tenants"] = per_tenant
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    else:
+        for k, v in result.items():
+            print(f"{k:28} {v}")
+
+    for srv in (*imap_srvs, smtp_srv, llm_srv):
+        srv.stop()
+
+
+if __name__ == "__main__":
+    main()
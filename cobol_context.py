@@ -0,0 +1,282 @@
+"""
+Contexto do prompt guiado pela estrutura do COBOL.
+Cortar o código nos primeiros N caracteres costuma mandar IDENTIFICATION + WORKING-STORAGE
+e perder a PROCEDURE DIVISION, onde está o erro. Aqui o código é indexado (divisões, seções,
+parágrafos, FD e níveis 01/77), cada trecho é pontuado pela dúvida do aluno (linhas citadas
+em mensagens de erro, nomes mencionados) e o contexto é montado dentro de um orçamento de tokens.
+"""
+import re
+from collections import namedtuple
+
+from text_clean import SEQ_AREA_RE, cobol_source
+
+CHARS_PER_TOKEN = 3.5  # estimativa grosseira; COBOL tem muito hífen e maiúscula
+
+# kind: preamble | division | section | paragraph | fd | item
+Unit = namedtuple("Unit", "file kind name division start end")  # linhas [start, end), base 0
+
+_FENCE_RE = re.compile(r"^```[\w-]*\s*$")
+_FILE_RE = re.compile(r"^--- (.+) ---$")
+_DIVISION_RE = re.compile(r"^\s*(IDENTIFICATION|ID|ENVIRONMENT|DATA|PROCEDURE)\s+DIVISION\b")
+_SECTION_RE = re.compile(r"^\s*([A-Z0-9][A-Z0-9-]*)\s+SECTION\s*\.")
+_FD_RE = re.compile(r"^\s*(?:FD|SD)\s+([A-Z0-9][A-Z0-9-]*)")
+_LEVEL_RE = re.compile(r"^\s*(\d{1,2})\s+([A-Z0-9][A-Z0-9-]*)")
+_PARAGRAPH_RE = re.compile(r"^\s{0,3}([A-Z0-9][A-Z0-9-]*)\s*\.\s*$")
+_NOT_PARAGRAPH = {"EXIT", "GOBACK", "CONTINUE", "ELSE", "STOP", "END"}
+_WORD_RE = re.compile(r"[A-Z0-9][A-Z0-9-]*")
+# "linha 42", "line 42", "prog.cbl:42:", "prog.cob(42)", listagem IBM "   42  IGYPS2121-S"
+_LINE_REF_RES = (
+    re.compile(r"\b(?:linha|line|lin\.?|ln)\s*:?\s*(\d{1,6})\b", re.I),
+    re.compile(r"[\w.-]+\.(?:cob|cbl|cpy)\s*[:(]\s*(\d{1,6})", re.I),
+    re.compile(r"^\s*(\d{1,6})\s+IGY\w+", re.M),
+)
+_ERROR_LINE_RE = re.compile(r"\b(?:erro|error|warning|aviso|IGY\w+|linha\s*\d|line\s*\d)", re.I)
+
+
+def approx_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def split_files(code_block: str):
+    """Bloco de código do parse_message -> [(nome, [linhas])]; código colado no corpo vira um arquivo sem nome."""
+    files, name, lines = [], "", []
+    for line in (code_block or "").splitlines():
+        if _FENCE_RE.match(line):
+            continue
+        m = _FILE_RE.match(line)
+        if m:
+            if lines or name:
+                files.append((name, lines))
+            name, lines = m.group(1), []
+            continue
+        lines.append(line)
+    if lines or name:
+        files.append((name, lines))
+    files = [(name, cobol_source(lines)) for name, lines in files]
+    for _, lines in files:
+        while lines and not lines[-1]:
+            lines.pop()
+    return files
+
+
+def _code_area(line: str):
+    """Área útil da linha (colunas 8–72 no formato fixo) em maiúsculas; None para comentário."""
+    if SEQ_AREA_RE.match(line) or line[:6].isspace():
+        indicator = line[6:7]
+        if indicator in ("*", "/"):
+            return None
+        if indicator in ("", " ", "-", "D", "d"):
+            return line[7:72].upper()
+    stripped = line.strip()
+    if stripped.startswith("*>"):
+        return None
+    return stripped.upper()
+
+
+class CobolIndex:
+    """Índice estrutural de um ou mais fontes: unidades (trechos), nomes de dados e números de sequência."""
+
+    def __init__(self, files):
+        self.files = files
+        self.units = []
+        self.defines = {}     # nome de dado -> índice da unidade que o declara
+        self.words = []       # palavras de cada unidade (para achar referências)
+        self.seq = {}         # (arquivo, "000230") -> linha
+        for fi, (_, lines) in enumerate(files):
+            self._index_file(fi, lines)
+
+    def _index_file(self, fi, lines):
+        division, heads, defs = "", [], []
+        for i, line in enumerate(lines):
+            if SEQ_AREA_RE.match(line):
+                self.seq[(fi, line[:6])] = i
+            area = _code_area(line)
+            if not area:
+                continue
+            m = _DIVISION_RE.match(area)
+            if m:
+                division = "IDENTIFICATION" if m.group(1) == "ID" else m.group(1)
+                heads.append((i, "division", f"{division} DIVISION", division))
+                continue
+            m = _SECTION_RE.match(area)
+            if m:
+                heads.append((i, "section", m.group(1), division))
+                continue
+            if division == "DATA":
+                m = _FD_RE.match(area)
+                if m:
+                    heads.append((i, "fd", m.group(1), division))
+                    continue
+                m = _LEVEL_RE.match(area)
+                if m and m.group(1) in ("01", "1", "77"):
+                    heads.append((i, "item", m.group(2), division))
+                if m:
+                    defs.append((m.group(2), i))
+            elif division == "PROCEDURE":
+                m = _PARAGRAPH_RE.match(area)
+                if m and m.group(1) not in _NOT_PARAGRAPH and not m.group(1).startswith("END-"):
+                    heads.append((i, "paragraph", m.group(1), division))
+        bounds = [(0, "preamble", "", "")] if not heads or heads[0][0] > 0 else []
+        bounds += heads
+        first = len(self.units)
+        for n, (i, kind, name, div) in enumerate(bounds):
+            end = bounds[n + 1][0] if n + 1 < len(bounds) else len(lines)
+            self.units.append(Unit(fi, kind, name, div, i, end))
+            text = "\n".join(_code_area(l) or "" for l in lines[i:end])
+            self.words.append(set(_WORD_RE.findall(text)))
+        for name, line in defs:
+            k = self.unit_at(fi, line, first)
+            if k is not None:
+                self.defines.setdefault(name, k)
+
+    def unit_at(self, fi, line, first=0):
+        for k in range(first, len(self.units)):
+            u = self.units[k]
+            if u.file == fi and u.start <= line < u.end:
+                return k
+        return None
+
+    def text(self, u, start=None, end=None):
+        return "\n".join(self.files[u.file][1][u.start if start is None else start:u.end if end is None else end])
+
+    def outline(self, relevant=(), max_paragraphs=20):
+        """
+        Mapa compacto: divisões, seções e parágrafos com a linha em que começam.
+        Com parágrafos demais, lista só os `relevant` e informa quantos existem.
+        """
+        out = []
+        for fi, (name, _) in enumerate(self.files):
+            paragraphs = [k for k, u in enumerate(self.units) if u.file == fi and u.kind == "paragraph"]
+            show = set(paragraphs) if len(paragraphs) <= max_paragraphs else set(relevant)
+            marks = [f"{u.name}@{u.start + 1}" for k, u in enumerate(self.units)
+                     if u.file == fi and (u.kind in ("division", "section") or k in show)]
+            if len(show) < len(paragraphs):
+                marks.append(f"({len(paragraphs)} parágrafos)")
+            if marks:
+                out.append(f"{name or 'código'}: " + " | ".join(marks))
+        return "\n".join(out)
+
+
+def _line_refs(index, text):
+    """Linhas (arquivo, linha) citadas na dúvida: número de linha ou número de sequência (colunas 1–6)."""
+    refs = set()
+    for rx in _LINE_REF_RES:
+        for m in rx.finditer(text or ""):
+            num = m.group(1)
+            for fi, (_, lines) in enumerate(index.files):
+                if len(num) == 6 and (fi, num) in index.seq:
+                    refs.add((fi, index.seq[(fi, num)]))
+                elif 0 < int(num) <= len(lines):
+                    refs.add((fi, int(num) - 1))
+    return refs
+
+
+def score_units(index, question):
+    """Pontuação de relevância por unidade: linhas citadas > nomes citados > PROCEDURE > dados usados."""
+    scores = [0.0] * len(index.units)
+    refs = _line_refs(index, question)
+    mentioned = set(_WORD_RE.findall((question or "").upper()))
+    for fi, line in refs:
+        k = index.unit_at(fi, line)
+        if k is None:
+            continue
+        scores[k] += 100
+        for near in (k - 1, k + 1):
+            if 0 <= near < len(scores) and index.units[near].file == fi:
+                scores[near] += 20
+    named = {n for n in mentioned if "-" in n or n in index.defines}
+    for k, u in enumerate(index.units):
+        if u.name in mentioned:
+            scores[k] += 40
+        scores[k] += 15 * min(3, len(named & index.words[k]))
+        if u.division == "PROCEDURE":
+            scores[k] += 10
+    for n in named:
+        if n in index.defines:
+            scores[index.defines[n]] += 30
+    # dados usados pela PROCEDURE DIVISION valem mais que declarações soltas
+    proc_words = set().union(*(w for u, w in zip(index.units, index.words) if u.division == "PROCEDURE"))
+    for n in proc_words & index.defines.keys():
+        scores[index.defines[n]] += 3
+    return scores, refs
+
+
+def build_code_context(code_block: str, question: str, max_tokens: int):
+    """
+    Devolve (bloco de código para o prompt, estatísticas).
+    Se o código já cabe no orçamento vai inteiro; senão, mapa + trechos mais relevantes em ordem,
+    com as lacunas marcadas.
+    """
+    if not code_block or approx_tokens(code_block) <= max_tokens:
+        return code_block, {"code_lines": None, "code_lines_sent": None}
+    index = CobolIndex(split_files(code_block))
+    scores, refs = score_units(index, question)
+    top = sorted(range(len(scores)), key=lambda k: -scores[k])[:10]
+    outline = index.outline(relevant=[k for k in top if scores[k] > 10])
+    budget = max_tokens - approx_tokens(outline) - 10
+    if budget < max_tokens // 2:  # mapa enorme: vai só o começo dele
+        outline = outline[:int(max_tokens // 4 * CHARS_PER_TOKEN)]
+        budget = max_tokens - approx_tokens(outline) - 10
+    chosen = {}  # unidade -> (início, fim)
+    for k in sorted(range(len(index.units)), key=lambda k: (-scores[k], index.units[k].start)):
+        u = index.units[k]
+        cost = approx_tokens(index.text(u)) + 2
+        if cost <= budget:
+            chosen[k] = (u.start, u.end)
+            budget -= cost
+        elif budget > 60 and scores[k] > 0:
+            # trecho grande demais: janela em volta da linha citada (ou o começo dele)
+            hits = [l for f, l in refs if f == u.file and u.start <= l < u.end]
+            center = hits[0] if hits else u.start
+            width = max(1, int(budget * CHARS_PER_TOKEN / 72))
+            start = max(u.start, center - width // 3)
+            end = min(u.end, start + width)
+            chosen[k] = (start, end)
+            budget -= approx_tokens(index.text(u, start, end)) + 2
+        if budget <= 60:
+            break
+
+    out, sent = ["```"], 0
+    if outline:
+        out.append(f"*> mapa: {outline}")
+    for fi, (name, lines) in enumerate(index.files):
+        spans = sorted(v for k, v in chosen.items() if index.units[k].file == fi)
+        if not spans:
+            continue
+        if name:
+            out.append(f"--- {name} ---")
+        pos = 0
+        for start, end in spans:
+            if start > pos:
+                out.append(f"*> … linhas {pos + 1}–{start} omitidas")
+            out.extend(lines[start:end])
+            sent += end - start
+            pos = end
+        if pos < len(lines):
+            out.append(f"*> … linhas {pos + 1}–{len(lines)} omitidas")
+    out.append("```")
+    total = sum(len(lines) for _, lines in index.files)
+    return "\n".join(out), {"code_lines": total, "code_lines_sent": sent}
+
+
+def trim_text(plain_text: str, max_tokens: int) -> str:
+    """Texto do e-mail dentro do orçamento: o começo (onde está a pergunta) + linhas de erro do resto."""
+    if approx_tokens(plain_text or "") <= max_tokens:
+        return plain_text
+    limit = int(max_tokens * CHARS_PER_TOKEN)
+    head = plain_text[:int(limit * 0.75)]
+    head = head[:head.rfind("\n")] if "\n" in head else head
+    extra, room = [], limit - len(head)
+    for line in plain_text[len(head):].splitlines():
+        if _ERROR_LINE_RE.search(line) and len(line) + 1 <= room:
+            extra.append(line)
+            room -= len(line) + 1
+    return head + "\n[…]\n" + "\n".join(extra) if extra else head + "\n[…]"
+
+
+def build_context(plain_text: str, code_block: str, text_tokens: int, code_tokens: int):
+    """(texto, código, estatísticas) prontos para o USER_TEMPLATE."""
+    code, stats = build_code_context(code_block, plain_text, code_tokens)
+    text = trim_text(plain_text, text_tokens)
+    stats["prompt_tokens_est"] = approx_tokens(text) + approx_tokens(code)
+    return text, code, stats
@@ -0,0 +1,154 @@
+import os, ssl, base64, smtplib, tempfile, threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from logutil import log
+
+SCOPES = ["https://mail.google.com/"]
+
+
+class SendUncertain(RuntimeError):
+    """A sessão caiu depois do DATA: a mensagem pode ter sido entregue. Não reenviar."""
+
+
+class _Smtp(smtplib.SMTP):
+    data_started = False
+
+    def data(self, msg):
+        self.data_started = True
+        return super().data(msg)
+
+
+class GmailSender:
+    """
+    Envio via Gmail SMTP + XOAUTH2 com sessão reaproveitada.
+    - Credenciais ficam em memória; refresh só perto de expirar (token.json reescrito de forma atômica).
+    - A conexão autenticada é mantida entre respostas; NOOP antes de cada envio, e reconexão só
+      quando nada da mensagem foi aceito (nunca reenvia depois do DATA).
+    """
+
+    def __init__(self, email_addr, token_file, host="smtp.gmail.com", port=587,
+                 starttls=True, debug=False, timeout=30, refresh_margin=300):
+        self.email_addr = email_addr
+        self.token_file = token_file
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.debug = debug
+        self.timeout = timeout
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._creds = None
+        self._smtp = None
+        self._lock = threading.Lock()
+
+    # ---------- credenciais ----------
+    def _save_token(self, creds):
+        path = Path(self.token_file)
+        fd, tmp = tempfile.mkstemp(dir=path.parent or ".", prefix=".token-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(creds.to_json())
+            os.replace(tmp, path)
+        except Exception:
+            try: os.unlink(tmp)
+            except OSError: pass
+            raise
+
+    def _needs_refresh(self, creds):
+        if not creds.token or not creds.expiry:
+            return True
+        # google-auth usa expiry em UTC "naive"
+        return creds.expiry - datetime.utcnow() < self.refresh_margin
+
+    def load(self):
+        """Lê (e renova, se preciso) o token agora, em vez de no primeiro envio."""
+        with self._lock:
+            self.access_token()
+
+    def access_token(self):
+        # google-auth (e requests, por baixo) custa ~180 ms de import: fica para a primeira leitura do token
+        from google.oauth2.credentials import Credentials
+        from google.auth.transport.requests import Request
+        creds = self._creds
+        if creds is None:
+            if not Path(self.token_file).exists():
+                raise RuntimeError("token.json ausente/inválido. Rode: python oauth_setup.py")
+            creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
+        if self._needs_refresh(creds):
+            if not creds.refresh_token:
+                raise RuntimeError("token.json ausente/inválido. Rode: python oauth_setup.py")
+            log("debug", "Renovando access token do Gmail…")
+            creds.refresh(Request())
+            self._save_token(creds)
+        self._creds = creds
+        return creds.token
+
+    # ---------- conexão ----------
+    def _connect(self):
+        auth_string = base64.b64encode(
+            f"user={self.email_addr}\1auth=Bearer {self.access_token()}\1\1".encode("utf-8")
+        ).decode("utf-8")
+        smtp = _Smtp(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.debug: smtp.set_debuglevel(1)
+            smtp.ehlo()
+            if self.starttls:
+                smtp.starttls(context=ssl.create_default_context())
+                smtp.ehlo()
+            code, resp = smtp.docmd("AUTH", "XOAUTH2 " + auth_string)
+            if code != 235:
+                raise RuntimeError(f"XOAUTH2 falhou: {code} {resp}")
+        except Exception:
+            smtp.close()
+            raise
+        log("debug", f"Sessão SMTP aberta em {self.host}:{self.port}")
+        return smtp
+
+    def _drop(self):
+        if self._smtp is not None:
+            try: self._smtp.quit()
+            except Exception:
+                try: self._smtp.close()
+                except Exception: pass
+        self._smtp = None
+
+    def close(self):
+        with self._lock:
+            self._drop()
+
+    def _alive(self):
+        try:
+            return self._smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, message):
+        """
+        Envia pela sessão aberta. A sessão é testada com NOOP antes (caiu ociosa: reconecta) e só se
+        tenta de novo quando o servidor recusou no MAIL/RCPT com 421, antes do DATA. Queda ou timeout
+        depois disso vira SendUncertain: o DATA pode ter sido aceito e a resposta se perdido.
+        """
+        with self._lock:
+            for attempt in (1, 2):
+                if self._smtp is not None and not self._alive():
+                    log("info", "Sessão SMTP ociosa caiu; reconectando.")
+                    self._drop()
+                if self._smtp is None:
+                    self._smtp = self._connect()
+                smtp = self._smtp
+                smtp.data_started = False
+                try:
+                    smtp.send_message(message)
+                    return
+                except (smtplib.SMTPSenderRefused, smtplib.SMTPRecipientsRefused) as e:
+                    codes = [e.smtp_code] if isinstance(e, smtplib.SMTPSenderRefused) else \
+                        [code for code, _ in e.recipients.values()]
+                    if attempt == 2 or 421 not in codes:
+                        raise
+                    log("info", f"SMTP recusou antes do DATA com 421 ({e}); reconectando.")
+                    self._drop()
+                except Exception as e:
+                    self._drop()
+                    if smtp.data_started and not isinstance(e, smtplib.SMTPDataError):
+                        raise SendUncertain(f"sessão SMTP caiu depois do DATA: {e!r}") from e
+                    raise
@@ -0,0 +1,274 @@
+import re, ssl, time, select, socket, imaplib
+
+from logutil import log
+
+
+_LIST_RE = re.compile(r'\((?P<flags>.*?)\)\s+"(?P<delim>[^"]+)"\s+(?P<name>.*)$')
+
+def parse_list_line(line: str):
+    """
+    Parseia uma linha de LIST IMAP:
+      (<flags>) "<delim>" <name>
+    Retorna (flags, delim, name) ou (None,None,None) se falhar.
+    """
+    m = _LIST_RE.search(line.strip())
+    if not m:
+        return None, None, None
+    flags = m.group("flags").strip()
+    delim = m.group("delim")
+    name  = m.group("name").strip()
+    if name.startswith('"') and name.endswith('"'):
+        name = name[1:-1]
+    return flags, delim, name
+
+
+class SessionClosed(RuntimeError):
+    """A sessão foi encerrada com stop() e não há conexão: o desligamento não espera o backoff."""
+
+
+class ImapSession:
+    """
+    Sessão IMAP de longa duração.
+    - Mantém uma única conexão autenticada com a pasta (INBOX) selecionada.
+    - Espera mensagens novas via IDLE (RFC 2177); sem IDLE no servidor, faz NOOP periódico.
+    - Reconecta com backoff exponencial depois de falhas.
+    - Faz LIST uma vez por conexão e lembra qual nome real funcionou para cada pasta lógica.
+    - wake() interrompe de outra thread uma espera em andamento (IDLE, NOOP ou backoff de reconexão);
+      stop() faz o mesmo e, a partir daí, uma reconexão que falha levanta SessionClosed (desligamento).
+    """
+
+    def __init__(self, host, port, user, password, mailbox="INBOX",
+                 noop_interval=10, backoff_max=300, use_ssl=True):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.mailbox = mailbox
+        self.noop_interval = noop_interval
+        self.backoff_max = backoff_max
+        self.use_ssl = use_ssl
+        self.imap = None
+        self.capabilities = set()
+        self.resolved = {}  # pasta lógica -> nome real no servidor (sobrevive a reconexões)
+        self._mailboxes = None
+        self._failures = 0
+        self._stopped = False
+        self._wake_r, self._wake_w = socket.socketpair()
+
+    # ---------- conexão ----------
+    def _connect(self):
+        if self.use_ssl:
+            imap = imaplib.IMAP4_SSL(self.host, self.port, ssl_context=ssl.create_default_context())
+        else:
+            imap = imaplib.IMAP4(self.host, self.port)
+        imap.login(self.user, self.password)
+        if self.mailbox:  # mailbox=None: sessão só para APPEND/LIST, sem SELECT
+            typ, _ = imap.select(self.mailbox)
+            if typ != "OK":
+                raise RuntimeError(f"Não foi possível selecionar {self.mailbox}")
+        # CAPABILITY pode mudar depois do LOGIN; reconsulta
+        typ, data = imap.capability()
+        caps = data[0].decode(errors="ignore").upper().split() if typ == "OK" and data else []
+        self.capabilities = set(caps) or {c.upper() for c in imap.capabilities}
+        return imap
+
+    def ensure(self):
+        """Devolve a conexão pronta, reconectando (com backoff) se necessário."""
+        while self.imap is None:
+            if self._failures:
+                if self._stopped:
+                    raise SessionClosed(f"IMAP {self.host} fora do ar e sessão encerrada")
+                delay = min(self.backoff_max, 2 ** (self._failures - 1))
+                log("info", f"Reconectando IMAP em {delay}s (falhas seguidas: {self._failures})")
+                self._woken(delay)  # wake() antecipa a tentativa; stop() desiste dela
+                if self._stopped:
+                    raise SessionClosed(f"IMAP {self.host} fora do ar e sessão encerrada")
+            try:
+                self.imap = self._connect()
+                log("info", f"Sessão IMAP aberta em {self.host} (IDLE={'IDLE' in self.capabilities})")
+            except Exception as e:
+                self._failures += 1
+                log("warn", "Falha ao conectar IMAP:", e)
+        return self.imap
+
+    def connect_once(self):
+        """Uma tentativa de conexão, sem backoff (levanta o erro): para usos pontuais, como no desligamento."""
+        if self.imap is None:
+            self.imap = self._connect()
+        return self.imap
+
+    def reset(self, failed=True):
+        """Descarta a conexão atual; a próxima chamada a ensure() reconecta."""
+        if failed:
+            self._failures += 1
+        if self.imap is not None:
+            try: self.imap.logout()
+            except Exception: pass
+        self.imap = None
+        self._mailboxes = None
+
+    def close(self):
+        self.reset(failed=False)
+
+    # ---------- pastas ----------
+    def list_mailboxes(self):
+        """LIST cacheado por conexão: {nome: {"flags", "delim"}}."""
+        if self._mailboxes is None:
+            boxes = {}
+            typ, data = self.ensure().list()
+            if typ != "OK":
+                log("warn", "LIST não retornou OK:", data)
+                return boxes
+            for raw in (data or []):
+                flags, delim, name = parse_list_line(raw.decode(errors="ignore"))
+                if name:
+                    boxes[name] = {"flags": flags, "delim": delim}
+            log("debug", "LIST mailboxes:", ", ".join(boxes))
+            self._mailboxes = boxes
+        return self._mailboxes
+
+    def folder_candidates(self, folder):
+        """
+        Nomes reais a tentar para `folder`, em ordem: o que já funcionou antes,
+        os que existem no servidor (exato, depois sufixo) e por fim INBOX<delim>x.
+        """
+        boxes = self.list_mailboxes()
+        existing = list(boxes)
+        candidates = [folder]
+        if not folder.upper().startswith("INBOX"):
+            # delimitador anunciado pelo servidor primeiro
+            delims = [b["delim"] for b in boxes.values() if b.get("delim")] + ["/", "."]
+            candidates += [f"INBOX{d}{folder}" for d in dict.fromkeys(delims)]
+        ordered = [self.resolved[folder]] if folder in self.resolved else []
+        ordered += [n for n in existing if n.lower() == folder.lower()]
+        ordered += [n for n in existing if n.lower().endswith(folder.lower())]
+        ordered += candidates
+        return list(dict.fromkeys(ordered))
+
+    def remember_folder(self, folder, real_name):
+        if self.resolved.get(folder) != real_name:
+            log("info", f"Pasta '{folder}' resolvida para '{real_name}'")
+        self.resolved[folder] = real_name
+        if self._mailboxes is not None:
+            self._mailboxes.setdefault(real_name, {"flags": "", "delim": None})
+
+    # ---------- espera por novidades ----------
+    def stop(self):
+        """Desligamento: acorda a espera em andamento e não deixa mais reconexões esperarem o backoff."""
+        self._stopped = True
+        self.wake()
+
+    def wake(self):
+        """Faz o wait_for_mail em andamento (ou o próximo) voltar na hora, sem novidade."""
+        try: self._wake_w.send(b"\0")
+        except OSError: pass
+
+    def _woken(self, timeout):
+        """Espera até `timeout` s por um wake(); True (e consome o aviso) se veio."""
+        r, _, _ = select.select([self._wake_r], [], [], max(0, timeout))
+        if r:
+            self._wake_r.recv(64)
+        return bool(r)
+
+    def wait_for_mail(self, timeout):
+        """
+        Bloqueia até chegar mensagem nova ou até `timeout` segundos.
+        Retorna True se o servidor avisou mudança na caixa — inclusive na resposta de um comando
+        do ciclo anterior (STORE/MOVE costumam trazer o EXISTS), caso em que volta na hora.
+        """
+        imap = self.ensure()
+        if self._changed(imap):
+            return True
+        if "IDLE" in self.capabilities:
+            changed = self._idle(imap, timeout)
+        else:
+            changed = self._noop_poll(imap, timeout)
+        self._failures = 0
+        return changed
+
+    def begin_sync(self):
+        """
+        Início de um ciclo (antes do UID SEARCH): os EXISTS/RECENT guardados pelo imaplib até aqui
+        ficam cobertos pela busca; só o que chegar depois faz o próximo wait_for_mail voltar na hora.
+        """
+        if self.imap is not None:
+            self.imap.untagged_responses.pop("EXISTS", None)
+            self.imap.untagged_responses.pop("RECENT", None)
+
+    @staticmethod
+    def _changed(imap):
+        return "EXISTS" in imap.untagged_responses or "RECENT" in imap.untagged_responses
+
+    def _noop_poll(self, imap, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            typ, _ = imap.noop()
+            if typ != "OK":
+                raise imaplib.IMAP4.abort(f"NOOP falhou: {typ}")
+            if self._changed(imap):
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._woken(min(self.noop_interval, remaining)):
+                return False
+
+    @staticmethod
+    def _buffered(imap):
+        """
+        Já há bytes para ler sem ir ao socket? O select não enxerga o que está no buffer de
+        `imap.file` (o "* n EXISTS" que veio no mesmo pacote do "+ idling") nem o que o SSL
+        já decifrou; um peek com o socket momentaneamente não bloqueante pega os dois.
+        """
+        sock = imap.sock
+        timeout = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            return bool(imap.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+
+    def _readable(self, imap, timeout):
+        if self._buffered(imap):
+            return True
+        r, _, _ = select.select([imap.sock, self._wake_r], [], [], timeout)
+        if self._wake_r in r:
+            self._wake_r.recv(64)
+            return False  # encerra o IDLE como se o tempo tivesse acabado
+        return bool(r)
+
+    def _idle(self, imap, timeout):
+        tag = imap._new_tag()
+        imap.send(tag + b" IDLE\r\n")
+        line = imap.readline()
+        if not line.startswith(b"+"):
+            raise imaplib.IMAP4.abort(f"IDLE recusado: {line!r}")
+
+        changed = False
+        deadline = time.monotonic() + timeout
+        while not changed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._readable(imap, remaining):
+                break
+            line = imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("conexão encerrada durante IDLE")
+            log("debug", f"IDLE <- {line!r}")
+            if line.startswith(b"* BYE"):
+                raise imaplib.IMAP4.abort(f"servidor encerrou IDLE: {line!r}")
+            if line.rstrip().endswith((b"EXISTS", b"RECENT")):
+                changed = True
+
+        imap.send(b"DONE\r\n")
+        # consome o que sobrou até a resposta tagueada do IDLE
+        while True:
+            line = imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("conexão encerrada ao finalizar IDLE")
+            if line.startswith(tag):
+                break
+            if line.rstrip().endswith((b"EXISTS", b"RECENT")):
+                changed = True
+        return changed
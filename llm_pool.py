@@ -0,0 +1,70 @@
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class FairPool:
+    """
+    Pool do LLM compartilhado entre as caixas de suporte.
+    - Cada caixa tem sua fila; os slots livres vão para as caixas em rodízio (round-robin),
+      então uma rajada numa caixa não trava as outras atrás dela.
+    - `set_limit(caixa, n)` limita quantas gerações da caixa rodam ao mesmo tempo.
+    - submit devolve um Future comum (funciona com as_completed/cancel).
+    """
+
+    def __init__(self, workers, thread_name_prefix="llm"):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=thread_name_prefix)
+        self._queues = OrderedDict()  # caixa -> deque[(future, fn, args)], na ordem do rodízio
+        self._running = Counter()
+        self._limits = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def set_limit(self, tenant, max_parallel):
+        with self._lock:
+            self._limits[tenant] = max_parallel or self.workers
+
+    def submit(self, tenant, fn, *args):
+        fut = Future()
+        with self._lock:
+            self._queues.setdefault(tenant, deque()).append((fut, fn, args))
+            self._dispatch()
+        return fut
+
+    def _dispatch(self):
+        # chamado com o lock: ocupa os slots livres, uma tarefa por caixa a cada volta
+        while sum(self._running.values()) < self.workers:
+            tenant = next((t for t, q in self._queues.items()
+                           if q and self._running[t] < self._limits.get(t, self.workers)), None)
+            if tenant is None:
+                return
+            fut, fn, args = self._queues[tenant].popleft()
+            if not fut.set_running_or_notify_cancel():  # cancelada enquanto esperava: não conta como vez
+                continue
+            self._queues.move_to_end(tenant)
+            self._running[tenant] += 1
+            self._executor.submit(self._run, tenant, fut, fn, args)
+
+    def _run(self, tenant, fut, fn, args):
+        try:
+            fut.set_result(fn(*args))
+        except BaseException as e:
+            fut.set_exception(e)
+        finally:
+            with self._lock:
+                self._running[tenant] -= 1
+                self._dispatch()
+                self._idle.notify_all()
+
+    def queued(self):
+        """{caixa: tarefas esperando slot} (para /status e /metrics)."""
+        with self._lock:
+            return {t: len(q) for t, q in self._queues.items()}
+
+    def shutdown(self, wait=True):
+        """Com `wait`, espera também o que ainda está nas filas (as tarefas são repassadas aos poucos ao executor)."""
+        if wait:
+            with self._idle:
+                self._idle.wait_for(lambda: not sum(self._running.values()) and not any(self._queues.values()))
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,9 @@
+import os
+
+LEVELS = {"debug": 0, "info": 1, "warn": 2, "error": 3}
+
+
+def log(level, *args):
+    # LOG_LEVEL é lido a cada chamada: o .env é carregado pelo app.py depois dos imports
+    if LEVELS[level] >= LEVELS.get(os.getenv("LOG_LEVEL", "info").lower(), 1):
+        print(f"[{level.upper()}]", *args)
@@ -0,0 +1,129 @@
+"""
+Métricas no formato texto do Prometheus, sem dependência externa.
+Uso: cria-se Counter/Gauge/Histogram no nível do módulo e o /metrics chama render().
+"""
+import threading
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _escape(v):
+    # formato texto: barra, aspas e quebra de linha escapadas no valor do label
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _fmt_num(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _items(self):
+        with _lock:
+            return sorted(self._values.items())
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_num(v)}"
+                for k, v in self._items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), fn=None):
+        super().__init__(name, help_text, labelnames)
+        self._fn = fn  # valor lido na hora do scrape (ex.: tamanho de fila)
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self._fn is not None:
+            try:
+                return [f"{self.name} {_fmt_num(self._fn())}"]
+            except Exception:
+                return []
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_num(v)}"
+                for k, v in self._items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            counts, total = self._values.get(key, ((0,) * len(self.buckets), 0.0))
+            counts = tuple(c + (value <= b) for c, b in zip(counts, self.buckets))
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        out = []
+        for k, (counts, total) in self._items():
+            for b, c in zip(self.buckets, counts):
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, k, [('le', _fmt_num(b))])} {c}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, k)} {_fmt_num(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, k)} {counts[-1]}")
+        return out
+
+
+def render() -> str:
+    lines = []
+    with _lock:
+        metrics = list(_registry)
+    for m in metrics:
+        lines += m.header()
+        lines += m.samples()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,216 @@
+"""
+Leitura parcial de mensagens IMAP guiada pelo BODYSTRUCTURE.
+Em vez de baixar o RFC822 inteiro, escolhe só as partes úteis (texto e anexos .cob/.cbl/.txt)
+e quanto buscar de cada uma (BODY.PEEK[n]<0.N>), limitado ao orçamento do prompt.
+Anexo de 20 MB ou .zip de copybooks custa no máximo o orçamento, não o tamanho do arquivo.
+"""
+import re, codecs, binascii, email.utils
+from collections import namedtuple
+from itertools import takewhile
+from email import policy
+from email.header import decode_header, make_header
+from email.parser import BytesParser
+
+from text_clean import html_to_text, clean_body
+
+CODE_EXTENSIONS = (".cob", ".cbl", ".txt")
+
+Part = namedtuple("Part", "section ctype params encoding size filename")
+# kind: plain | html | code; limit = bytes decodificados aproveitados; fetch = bytes pedidos ao servidor
+Planned = namedtuple("Planned", "part kind limit fetch")
+
+_OPEN, _CLOSE = object(), object()
+_MSG_START_RE = re.compile(rb"^\d+ \(")
+_B64_JUNK_RE = re.compile(rb"[^A-Za-z0-9+/=]")
+_QP_TAIL_RE = re.compile(rb"=[0-9A-Fa-f\r]?$")
+
+
+# ---------- resposta do UID FETCH ----------
+def _tokens(buf):
+    """Tokens de uma resposta IMAP: parênteses, átomos (str), "strings" (str), literais (bytes), NIL (None)."""
+    i, n = 0, len(buf)
+    while i < n:
+        c = buf[i]
+        if c in b" \r\n":
+            i += 1
+        elif c == 0x28:  # (
+            yield _OPEN; i += 1
+        elif c == 0x29:  # )
+            yield _CLOSE; i += 1
+        elif c == 0x22:  # "
+            j, out = i + 1, bytearray()
+            while j < n and buf[j] != 0x22:
+                if buf[j] == 0x5C: j += 1  # \
+                out.append(buf[j]); j += 1
+            yield out.decode("utf-8", "replace")
+            i = j + 1
+        elif c == 0x7B:  # {n}\r\n<n bytes>
+            j = buf.index(b"}", i)
+            size, start = int(buf[i + 1:j]), j + 3
+            yield buf[start:start + size]
+            i = start + size
+        else:
+            j, depth = i, 0
+            while j < n and (depth or buf[j] not in b" ()\r\n"):
+                if buf[j] == 0x5B: depth += 1    # [ … ] de BODY[HEADER.FIELDS (A B)]
+                elif buf[j] == 0x5D: depth -= 1
+                j += 1
+            atom = buf[i:j].decode("ascii", "replace")
+            yield None if atom.upper() == "NIL" else atom
+            i = j
+
+
+def _parse(tokens):
+    out = []
+    for tok in tokens:
+        if tok is _OPEN: out.append(_parse(tokens))
+        elif tok is _CLOSE: return out
+        else: out.append(tok)
+    return out
+
+
+def _messages(data):
+    """Remonta a resposta do imaplib (bytes e tuplas (cabeçalho, literal)) em um bloco por mensagem."""
+    current = None
+    for item in data or []:
+        if item is None: continue
+        head = item[0] if isinstance(item, tuple) else item
+        if _MSG_START_RE.match(head):
+            if current is not None: yield bytes(current)
+            current = bytearray()
+        if current is None: continue
+        current += head
+        if isinstance(item, tuple):
+            current += b"\r\n" + item[1]
+    if current is not None: yield bytes(current)
+
+
+def parse_fetch_response(data):
+    """UID FETCH -> [{ITEM: valor}] por mensagem. Literais viram bytes; BODYSTRUCTURE vira lista aninhada."""
+    out = []
+    for block in _messages(data):
+        parsed = _parse(iter(_tokens(block)))
+        items = next((x for x in parsed if isinstance(x, list)), [])
+        out.append({str(items[k]).upper(): items[k + 1] for k in range(0, len(items) - 1, 2)})
+    return out
+
+
+# ---------- BODYSTRUCTURE ----------
+def _s(v):
+    if isinstance(v, bytes): return v.decode("utf-8", "replace")
+    return v
+
+
+def _pairs(v):
+    if not isinstance(v, list): return {}
+    return {str(_s(v[k])).lower(): _s(v[k + 1]) for k in range(0, len(v) - 1, 2)}
+
+
+def body_parts(node, prefix=""):
+    """Lista plana das partes folha com o número de seção IMAP (1, 1.2, 2.1…)."""
+    if node and isinstance(node[0], list):  # multipart: (parte)(parte)… "subtipo" [extensões]
+        out = []
+        for n, child in enumerate(takewhile(lambda c: isinstance(c, list), node), 1):
+            out += body_parts(child, f"{prefix}.{n}" if prefix else str(n))
+        return out
+    section = prefix or "1"
+    ctype = f"{_s(node[0])}/{_s(node[1])}".lower()
+    if ctype == "message/rfc822" and len(node) > 8 and isinstance(node[8], list):
+        inner = node[8]
+        return body_parts(inner, section if inner and isinstance(inner[0], list) else f"{section}.1")
+    params = _pairs(node[2])
+    encoding = (_s(node[5]) or "7bit").lower()
+    try: size = int(node[6] or 0)
+    except (TypeError, ValueError): size = 0
+    ext = node[8:] if ctype.startswith("text/") else node[7:]  # md5, disposição, idioma, local
+    disp = ext[1] if len(ext) > 1 else None
+    filename = _pairs(disp[1]).get("filename") if isinstance(disp, list) and len(disp) > 1 else None
+    filename = filename or params.get("name")
+    if filename and "=?" in filename:
+        filename = str(make_header(decode_header(filename)))
+    return [Part(section, ctype, params, encoding, size, filename)]
+
+
+def _is_code(part):
+    return bool(part.filename) and part.filename.lower().endswith(CODE_EXTENSIONS)
+
+
+def _fetch_size(part, limit):
+    """Bytes codificados necessários para obter `limit` bytes decodificados."""
+    if part.encoding == "base64":
+        n = -(-limit // 3) * 4
+        n += (n // 76 + 1) * 2  # quebras de linha
+    elif part.encoding == "quoted-printable":
+        n = limit * 3
+    else:
+        n = limit
+    return min(n, part.size) if part.size else n
+
+
+def plan_parts(parts, text_budget, code_budget):
+    """Escolhe as partes como o parse_message faria e reparte o orçamento entre elas, em ordem."""
+    plain = [p for p in parts if p.ctype == "text/plain" and not _is_code(p)]
+    html = [p for p in parts if p.ctype == "text/html" and not _is_code(p)]
+    code = [p for p in parts if _is_code(p)]
+    plan = []
+    for kind, chosen, budget in (("plain" if plain else "html", plain or html, text_budget),
+                                 ("code", code, code_budget)):
+        for p in chosen:
+            if budget <= 0: break
+            estimate = p.size * 3 // 4 if p.encoding == "base64" else p.size
+            limit = min(budget, estimate) if p.size else budget
+            plan.append(Planned(p, kind, limit, _fetch_size(p, limit)))
+            budget -= limit
+    return plan
+
+
+def fetch_item(planned):
+    return f"BODY.PEEK[{planned.part.section}]<0.{planned.fetch}>"
+
+
+# ---------- decodificação ----------
+def decode_partial(data, part, limit):
+    """Decodifica um pedaço inicial de uma parte; sequências cortadas no fim são descartadas, não corrompidas."""
+    if part.encoding == "base64":
+        data = _B64_JUNK_RE.sub(b"", data)
+        data = data[:len(data) // 4 * 4]
+        try: payload = binascii.a2b_base64(data)
+        except binascii.Error: payload = b""
+    elif part.encoding == "quoted-printable":
+        payload = binascii.a2b_qp(_QP_TAIL_RE.sub(b"", data))
+    else:
+        payload = data
+    payload = payload[:limit]
+    try: decoder = codecs.getincrementaldecoder(part.params.get("charset") or "utf-8")(errors="ignore")
+    except LookupError: decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    return decoder.decode(payload, final=False)
+
+
+def assemble(plain_parts, code_chunks):
+    """(texto, bloco de código) no formato que o prompt espera."""
+    plain_text = clean_body("\n".join(plain_parts))
+    code_block = ""
+    if code_chunks:
+        code_block = "```\n" + "\n\n".join(code_chunks) + "\n```"
+    elif "IDENTIFICATION DIVISION" in plain_text.upper():
+        code_block = "```cobol\n" + plain_text + "\n```"
+    return plain_text, code_block
+
+
+def parse_partial(header, plan, items):
+    """Mesmo retorno do parse_message, a partir do cabeçalho e das seções buscadas parcialmente."""
+    msg = BytesParser(policy=policy.default).parsebytes(header, headersonly=True)
+    msgid = msg.get("Message-ID") or ""
+    from_addr = email.utils.parseaddr(msg.get("From"))[1]
+    subject = msg.get("Subject", "")
+    plain_parts, code_chunks = [], []
+    for p in plan:
+        data = items.get(f"BODY[{p.part.section}]<0>", items.get(f"BODY[{p.part.section}]"))
+        if not isinstance(data, (bytes, str)): continue
+        text = decode_partial(data.encode() if isinstance(data, str) else data, p.part, p.limit)
+        if p.kind == "code":
+            code_chunks.append(f"--- {p.part.filename} ---\n{text}")
+        else:
+            plain_parts.append(html_to_text(text) if p.kind == "html" else text)
+    plain_text, code_block = assemble(plain_parts, code_chunks)
+    return msg, msgid, from_addr, subject, plain_text, code_block
@@ -1,18 +1,179 @@
 import json
-import requests
+import time
+import socket
+import threading
+import weakref
 import re
 
+_FENCE_RE = re.compile(r"^```[a-zA-Z]*\n?")
+_CONTROL_RE = re.compile(r"[\x00-\x1f\x7f]")
+
+# vai no fim da mensagem de sistema; qualquer mudança aqui invalida o prefixo em cache no Ollama
+JSON_RULES = ("Regras adicionais: responda SOMENTE um objeto JSON válido; "
+              "não use crases, não use markdown, escape quebras de linha como \\n dentro de strings.")
+
+
+class GenerationCancelled(RuntimeError):
+    """Geração interrompida de propósito (desligamento do watcher)."""
+
+
+class _JsonObjectScanner:
+    """
+    Acompanha o texto gerado em streaming e detecta, sem reparsear tudo,
+    quando o objeto JSON de topo fechou ou quando a saída já não tem como ser JSON.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.started = False
+        self.depth = 0
+        self.in_str = False
+        self.esc = False
+        self.fence = False
+        self.done = False
+        self.invalid = False
+
+    def feed(self, chunk: str):
+        for ch in chunk:
+            if not self.started:
+                if self.fence:            # pula a linha ```json
+                    if ch == "\n": self.fence = False
+                    continue
+                if ch.isspace(): continue
+                if ch == "`":
+                    self.fence = True
+                    continue
+                if ch != "{":
+                    self.invalid = True
+                    return
+                self.started = True
+            self.parts.append(ch)
+            if self.in_str:
+                if self.esc: self.esc = False
+                elif ch == "\\": self.esc = True
+                elif ch == '"': self.in_str = False
+            elif ch == '"':
+                self.in_str = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.done = True
+                    return
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def _tracking_adapter(requests, pool_size, conns, lock, cancelled):
+    """
+    HTTPAdapter cujas conexões ficam registradas em `conns` desde antes do connect: assim cancel_all()
+    alcança também a chamada que ainda está conectando, esperando os cabeçalhos (modelo carregando)
+    ou a resposta inteira (stream=False) — casos em que ainda não existe um Response para fechar.
+    """
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    def tracked(pool_cls):
+        class Connection(pool_cls.ConnectionCls):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                with lock:
+                    conns.add(self)
+
+            def connect(self):
+                super().connect()
+                if cancelled.is_set():  # cancelado durante o connect: não chega a mandar o pedido
+                    self.close()
+                    raise GenerationCancelled("cliente encerrado")
+        return type(pool_cls.__name__, (pool_cls,), {"ConnectionCls": Connection})
+
+    class Adapter(requests.adapters.HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {"http": tracked(HTTPConnectionPool),
+                                                       "https": tracked(HTTPSConnectionPool)}
+
+    return Adapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+
 
 class OllamaClient:
-    def __init__(self, host: str, model: str):
+    """
+    Cliente de longa duração para o Ollama.
+    - Uma requests.Session com pool de conexões (keep-alive HTTP) compartilhada pelos workers.
+    - `keep_alive` mantém o modelo carregado entre e-mails esparsos; `warm_up()` carrega antes do primeiro.
+    - `options` extras (num_ctx, num_predict…) vão em todas as chamadas.
+    - /api/chat com a mensagem de sistema sempre idêntica e primeiro: o Ollama reaproveita o KV
+      desse prefixo entre chamadas e o prefill de cada e-mail cobre só a parte do usuário
+      (prefill_tokens/prefill_s em last_stats). `warm_up(system_prompt)` já deixa o prefixo avaliado.
+    """
+
+    def __init__(self, host: str, model: str, stream: bool = True, keep_alive=None,
+                 options: dict = None, pool_size: int = 4, tail_s: float = 2.0):
+        import requests  # ~150 ms de import: só quando o cliente é criado, fora do caminho da subida
         self.host = host.rstrip('/')
         self.model = model
+        self.stream = stream
+        self.tail_s = tail_s  # streaming: quanto esperar pelo chunk final depois que o JSON fecha
+        self.keep_alive = keep_alive
+        self.options = {"temperature": 0.2, **(options or {})}
+        self._local = threading.local()
+        self._cancelled = threading.Event()
+        self._conns = weakref.WeakSet()  # conexões HTTP abertas pelo pool (ver cancel_all)
+        self._conns_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = _tracking_adapter(requests, pool_size, self._conns, self._conns_lock, self._cancelled)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def last_stats(self) -> dict:
+        """Métricas da última geração feita pela thread atual (ttft_s, tokens, tokens_per_s…)."""
+        return getattr(self._local, "stats", {})
+
+    def warm_up(self, system_prompt=None, timeout=300) -> float:
+        """
+        Carrega o modelo na memória e devolve quanto tempo levou. Com `system_prompt`, avalia também
+        a mensagem de sistema (gerando 1 token) para o primeiro e-mail já encontrar o prefixo em cache.
+        """
+        t0 = time.monotonic()
+        if system_prompt is None:
+            payload = {"model": self.model, "prompt": "", "stream": False}
+            url = f"{self.host}/api/generate"
+        else:
+            payload = {"model": self.model, "messages": self._messages(system_prompt, ""), "stream": False,
+                       "options": {**self.options, "num_predict": 1}}
+            url = f"{self.host}/api/chat"
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        r = self.session.post(url, json=payload, timeout=timeout)
+        r.raise_for_status()
+        return time.monotonic() - t0
+
+    def close(self):
+        self.session.close()
+
+    def cancel_all(self):
+        """
+        Interrompe todas as gerações em andamento (e as próximas) — usado no desligamento.
+        Derruba o socket de cada conexão do pool (o recv bloqueado na outra thread volta na hora, em
+        qualquer fase da chamada e nos dois modos); fechar cabe a quem está usando a conexão.
+        """
+        self._cancelled.set()
+        with self._conns_lock:
+            conns = list(self._conns)
+        for conn in conns:
+            sock = getattr(conn, "sock", None)
+            if sock is not None:
+                try: sock.shutdown(socket.SHUT_RDWR)
+                except OSError: pass
 
     def _strip_code_fences(self, text: str) -> str:
         text = text.strip()
         if text.startswith("```"):
             # remove ```json ... ```
-            text = re.sub(r"^```[a-zA-Z]*\n?", "", text)
+            text = _FENCE_RE.sub("", text)
             if text.endswith("```"):
                 text = text[:-3]
         return text.strip()
@@ -20,36 +181,9 @@ class OllamaClient:
     def _sanitize_controls(self, text: str) -> str:
         # remove caracteres de controle proibidos no JSON (0x00-0x1F, exceto \n e \t se estiverem fora de strings)
         # como heurística simples, substitui por espaço
-        return re.sub(r'[\x00-\x1f\x7f]', ' ', text)
-
-    def generate_json(self, system_prompt: str, user_prompt: str, timeout=180):
-        # Instruções mais rígidas
-        full_prompt = (
-            "[SYSTEM]\n"
-            + system_prompt
-            + "\nRegras adicionais: responda SOMENTE um objeto JSON válido; "
-              "não use crases, não use markdown, escape quebras de linha como \\n dentro de strings.\n"
-            "[/SYSTEM]\n[USER]\n"
-            + user_prompt
-            + "\n[/USER]"
-        )
-
-        url = f"{self.host}/api/generate"
-        payload = {
-            "model": self.model,
-            "prompt": full_prompt,
-            "stream": False,
-            # *** ESTE É O PULO DO GATO: força JSON estruturado quando suportado ***
-            "format": "json",
-            "options": {
-                "temperature": 0.2
-            }
-        }
-        r = requests.post(url, json=payload, timeout=timeout)
-        r.raise_for_status()
-        data = r.json()
-        text = data.get("response", "").strip()
+        return _CONTROL_RE.sub(' ', text)
 
+    def _parse_json(self, text: str):
         # Limpezas defensivas
         text = self._strip_code_fences(text)
         try:
@@ -67,3 +201,123 @@ class OllamaClient:
                     "acao": "escalar",
                     "_debug": f"json_error: {e} | raw: {text[:300]}"
                 }
+
+    def _final_stats(self, stats: dict, data: dict):
+        # contadores oficiais do Ollama (presentes no último chunk / na resposta única)
+        if data.get("eval_count"):
+            stats["tokens"] = data["eval_count"]
+            if data.get("eval_duration"):
+                stats["tokens_per_s"] = round(data["eval_count"] / (data["eval_duration"] / 1e9), 2)
+        if data.get("prompt_eval_count"):
+            # só os tokens de fato avaliados: o prefixo reaproveitado do cache não entra na conta
+            stats["prompt_tokens"] = stats["prefill_tokens"] = data["prompt_eval_count"]
+        if data.get("prompt_eval_duration"):
+            stats["prefill_s"] = round(data["prompt_eval_duration"] / 1e9, 3)
+
+    @staticmethod
+    def _messages(system_prompt, user_prompt):
+        return [{"role": "system", "content": f"{system_prompt}\n{JSON_RULES}"},
+                {"role": "user", "content": user_prompt}]
+
+    def generate_json(self, system_prompt: str, user_prompt: str, timeout=180):
+        # tudo que varia por e-mail fica na mensagem do usuário, depois do prefixo fixo
+        url = f"{self.host}/api/chat"
+        payload = {
+            "model": self.model,
+            "messages": self._messages(system_prompt, user_prompt),
+            "stream": self.stream,
+            # *** ESTE É O PULO DO GATO: força JSON estruturado quando suportado ***
+            "format": "json",
+            "options": self.options,
+        }
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        if self._cancelled.is_set():
+            raise GenerationCancelled("cliente encerrado")
+        if self.stream:
+            return self._generate_stream(url, payload, timeout)
+
+        t0 = time.monotonic()
+        try:
+            r = self.session.post(url, json=payload, timeout=timeout)
+            r.raise_for_status()
+            data = r.json()
+        except Exception as e:
+            # cancel_all() derruba a conexão por baixo; o erro de leitura vira cancelamento
+            if self._cancelled.is_set():
+                raise GenerationCancelled("geração cancelada") from e
+            raise
+        stats = {"stream": False, "total_s": round(time.monotonic() - t0, 3)}
+        self._final_stats(stats, data)
+        self._local.stats = stats
+        return self._parse_json((data.get("message") or {}).get("content", "").strip())
+
+    def _generate_stream(self, url, payload, timeout):
+        """
+        Consome /api/chat em streaming e para assim que o objeto JSON fecha
+        (ou que a saída claramente não é JSON). Fechar a conexão faz o Ollama
+        abortar a geração, então não pagamos tokens que seriam descartados.
+        Depois que o objeto fecha, ainda espera até `tail_s` pelo chunk final,
+        que é o único com prompt_eval_count/prompt_eval_duration; se ele não vier,
+        a chamada fica sem esses contadores (não estimamos pelo TTFT).
+        """
+        t0 = time.monotonic()
+        deadline = t0 + timeout
+        stats = {"stream": True, "ttft_s": None, "tokens": 0, "stopped_early": False}
+        self._local.stats = stats
+        scanner = _JsonObjectScanner()
+        raw, tail = [], None
+        try:
+            r = self.session.post(url, json=payload, stream=True, timeout=(10, timeout))
+        except Exception as e:
+            if self._cancelled.is_set():
+                raise GenerationCancelled("geração cancelada") from e
+            raise
+        try:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"geração passou de {timeout}s")
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(f"Ollama: {data['error']}")
+                piece = (data.get("message") or {}).get("content", "")
+                if piece:
+                    if stats["ttft_s"] is None:
+                        stats["ttft_s"] = round(time.monotonic() - t0, 3)
+                    stats["tokens"] += 1
+                    if not scanner.done:
+                        raw.append(piece)
+                        scanner.feed(piece)
+                if data.get("done"):
+                    self._final_stats(stats, data)
+                    break
+                if scanner.invalid:
+                    stats["stopped_early"] = True
+                    break
+                if scanner.done:
+                    # o objeto fechou: lê mais um pouco para pegar o chunk final (prompt_eval_*), sem esperar
+                    # por uma cauda longa de espaços que o format=json às vezes gera
+                    tail = tail or time.monotonic() + self.tail_s
+                    if time.monotonic() > tail:
+                        stats["stopped_early"] = True
+                        break
+        except Exception as e:
+            # cancel_all() derruba a conexão por baixo; o erro de leitura vira cancelamento
+            if self._cancelled.is_set():
+                raise GenerationCancelled("geração cancelada") from e
+            raise
+        finally:
+            r.close()
+        if self._cancelled.is_set():
+            raise GenerationCancelled("geração cancelada")
+
+        stats["total_s"] = round(time.monotonic() - t0, 3)
+        if "tokens_per_s" not in stats and stats["ttft_s"] is not None:
+            gen_s = stats["total_s"] - stats["ttft_s"]
+            stats["tokens_per_s"] = round(stats["tokens"] / gen_s, 2) if gen_s > 0 else None
+        if scanner.invalid:
+            stats["invalid"] = True
+        return self._parse_json(scanner.text if scanner.done else "".join(raw))
@@ -0,0 +1,37 @@
+import threading
+
+
+class Pacer:
+    """
+    Quantas mensagens uma caixa admite por ciclo, a partir da vazão observada do LLM.
+    - observe(n, segundos): o ciclo esperou `segundos` pelas n mensagens que mandou ao LLM;
+      a vazão (mensagens/s) entra numa média móvel exponencial.
+    - batch(em_voo): quantas cabem em `target` segundos nessa vazão, entre `floor` (slots do LLM
+      da caixa, para nunca deixar worker parado) e `ceiling` (teto de mensagens em voo), descontando
+      o que já está em voo. Sem medição ainda, usa o teto.
+    O resto continua UNSEEN no servidor e entra nos próximos ciclos.
+    """
+
+    def __init__(self, floor, ceiling, target, alpha=0.3):
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.target = target
+        self.alpha = alpha
+        self.rate = None
+        self._lock = threading.Lock()
+
+    def observe(self, n, seconds):
+        if n <= 0 or seconds <= 0:
+            return
+        rate = n / seconds
+        with self._lock:
+            self.rate = rate if self.rate is None else self.alpha * rate + (1 - self.alpha) * self.rate
+
+    def size(self):
+        with self._lock:
+            if self.rate is None:
+                return self.ceiling
+            return max(self.floor, min(self.ceiling, int(self.rate * self.target)))
+
+    def batch(self, in_flight=0):
+        return max(0, self.size() - in_flight)
@@ -32,3 +32,12 @@ CÓDIGO/ANEXOS (se houver):
 - "escalar" se dúvida fora de COBOL, código ilegível/incompleto, anexos faltando, ou baixa confiança.
 Retorne apenas o JSON pedido, sem comentários extras.
 """
+
+EXAMPLES_TEMPLATE = """Casos parecidos já respondidos pela equipe (referência de tom e conteúdo; não copie):
+{examples}
+
+"""
+
+EXAMPLE_TEMPLATE = """[Caso {n}]
+Dúvida: {question}
+Resposta: {reply}"""
@@ -0,0 +1,55 @@
+import html
+import threading
+from email.message import EmailMessage
+
+
+class ReplyRenderer:
+    """
+    Monta o corpo das respostas (texto + HTML) de uma caixa.
+    - A assinatura é fixa por caixa: o Markdown e o HTML dela são gerados uma vez, no construtor.
+    - O conversor Markdown é criado uma vez por thread (a instância não é thread-safe) e só
+      `reset()` entre as mensagens, em vez de refazer a configuração das extensões a cada resposta.
+    - Por resposta, só o corpo do LLM passa pelo Markdown; saudação e assinatura são fragmentos prontos.
+    """
+
+    def __init__(self, name, footer=None, links=None, extensions=()):
+        self.extensions = list(extensions)
+        self._local = threading.local()
+        sig_lines = ["---", f"**{name}**"]
+        if footer: sig_lines.append(footer)
+        if links: sig_lines.append(links)
+        self.signature_text = "\n".join(sig_lines) + "\n"
+        self.signature_html = self._convert(self.signature_text)
+
+    def _convert(self, text):
+        md = getattr(self._local, "md", None)
+        if md is None:
+            from markdown import Markdown  # import adiado: não pesa na subida
+            md = self._local.md = Markdown(extensions=self.extensions)
+        try:
+            return md.convert(text)
+        finally:
+            md.reset()
+
+    @staticmethod
+    def greeting(first_name):
+        return f"Olá{', ' + first_name if first_name else ''}!"
+
+    def render(self, first_name, body_markdown):
+        """(texto, html) da resposta completa: saudação, corpo e assinatura."""
+        hello, body = self.greeting(first_name), body_markdown.strip()
+        text = f"{hello}\n\n{body}\n\n{self.signature_text}"
+        body_html = self._convert(body)
+        parts = [f"<p>{html.escape(hello, quote=False)}</p>"]
+        if body_html:
+            parts.append(body_html)
+        parts.append(self.signature_html)
+        return text, "\n".join(parts)
+
+    def message(self, first_name, body_markdown):
+        """EmailMessage só com o corpo (text/plain + alternativa HTML); os cabeçalhos ficam com quem envia."""
+        text, body_html = self.render(first_name, body_markdown)
+        msg = EmailMessage()
+        msg.set_content(text)
+        msg.add_alternative(body_html, subtype="html")
+        return msg
@@ -0,0 +1,104 @@
+import re, json, time, hashlib
+
+from logutil import log
+from text_clean import SEQ_AREA_RE
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WS_RE.sub(" ", (text or "").casefold()).strip()
+
+
+def normalize_code(code: str) -> str:
+    """
+    Normaliza código COBOL para comparação:
+    - formato fixo (colunas 1–6 numéricas): descarta a área de sequência e a de identificação (73+);
+    - colunas 1–6 em branco: só descarta a indentação;
+    - espaços colapsados e caixa ignorada.
+    """
+    lines = []
+    for line in (code or "").splitlines():
+        if SEQ_AREA_RE.match(line):
+            line = line[6:72]
+        elif line[:6].isspace():
+            line = line[6:]
+        lines.append(line)
+    return normalize_text("\n".join(lines))
+
+
+def fingerprint(plain_text: str, code_block: str, salt: str = "") -> str:
+    h = hashlib.sha256()
+    for part in (salt, normalize_text(plain_text), normalize_code(code_block)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def code_fingerprint(code_block: str) -> str:
+    """Impressão digital curta só do código (mesmo programa com outra pergunta)."""
+    code = normalize_code(code_block)
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()[:16] if code else ""
+
+
+class ResponseCache:
+    """
+    Cache de veredictos do LLM endereçado pelo conteúdo da dúvida (texto + código normalizados).
+    Fica numa tabela do state.db (conexão do StateStore) com expiração por TTL
+    e descarte LRU acima de `max_entries`; o commit acontece no flush do ciclo.
+    """
+
+    def __init__(self, store, ttl_seconds=7 * 24 * 3600, max_entries=5000):
+        self.store = store
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        with store.lock:
+            store.con.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, verdict TEXT NOT NULL,"
+                " created_at REAL NOT NULL, last_hit REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            store.con.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_hit ON llm_cache(last_hit)")
+            store.con.commit()
+
+    def get(self, key):
+        now = time.time()
+        con = self.store.con
+        with self.store.lock:
+            row = con.execute(
+                "SELECT verdict, created_at FROM llm_cache WHERE key=?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    con.execute("DELETE FROM llm_cache WHERE key=?", (key,))
+                self.misses += 1
+                return None
+            con.execute("UPDATE llm_cache SET last_hit=?, hits=hits+1 WHERE key=?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, verdict):
+        now = time.time()
+        con = self.store.con
+        with self.store.lock:
+            con.execute(
+                "INSERT OR REPLACE INTO llm_cache(key, verdict, created_at, last_hit, hits) VALUES (?,?,?,?,0)",
+                (key, json.dumps(verdict, ensure_ascii=False), now, now),
+            )
+            excess = con.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                con.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_hit LIMIT ?)",
+                    (excess,),
+                )
+                log("debug", f"Cache LLM: {excess} entrada(s) antiga(s) descartada(s)")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
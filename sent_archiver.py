@@ -0,0 +1,78 @@
+import time, queue, imaplib, threading
+
+from logutil import log
+
+
+class SentArchiver:
+    """
+    Guarda cópia das respostas na pasta de Enviados (Roundcube) sem atrasar o watcher.
+    - APPENDs vão para uma fila e são gravados por uma thread em segundo plano.
+    - Usa uma única sessão IMAP persistente (ImapSession) e resolve a pasta de Enviados uma vez.
+    """
+
+    def __init__(self, session, sent_folder_name, max_attempts=3):
+        self.session = session
+        self.sent_folder_name = sent_folder_name
+        self.max_attempts = max_attempts
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sent-archiver", daemon=True)
+            self._thread.start()
+
+    def submit(self, msg):
+        self._queue.put((msg.as_bytes(), imaplib.Time2Internaldate(time.time()), 1))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """Espera a fila esvaziar (usado no desligamento). Retorna False se estourou o timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _resolve_folder(self):
+        """Nome real da pasta de Enviados: o já resolvido, o configurado, o marcado \\Sent ou os de costume."""
+        folder = self.session.resolved.get("Enviados")
+        if folder:
+            return folder
+        boxes = self.session.list_mailboxes()
+        candidates = []
+        if self.sent_folder_name:
+            candidates.append(self.sent_folder_name)
+        candidates += [n for n, b in boxes.items() if "\\SENT" in (b.get("flags") or "").upper()]
+        candidates += ["INBOX.Sent", "INBOX.Enviados", "Sent", "Enviados"]
+        candidates = list(dict.fromkeys(candidates))
+        # existentes primeiro (ordem estável), depois o mais curto
+        dest = sorted(candidates, key=lambda x: (x not in boxes, len(x)))[0]
+        if dest not in boxes:
+            try: self.session.ensure().create(dest)
+            except imaplib.IMAP4.abort: raise
+            except Exception: pass
+        self.session.remember_folder("Enviados", dest)
+        return dest
+
+    def _run(self):
+        while True:
+            raw, date, attempt = self._queue.get()
+            try:
+                dest = self._resolve_folder()
+                typ, resp = self.session.ensure().append(dest, "", date, raw)
+                if typ != "OK":
+                    raise imaplib.IMAP4.error(f"APPEND {typ} {resp}")
+                log("debug", f"Cópia enviada para pasta de enviados: {dest}")
+            except Exception as e:
+                self.session.reset()
+                if attempt < self.max_attempts:
+                    log("warn", f"Falha ao APPEND em Enviados (tentativa {attempt}):", e)
+                    self._queue.put((raw, date, attempt + 1))
+                else:
+                    log("warn", "Falha ao APPEND em Enviados; cópia descartada:", e)
+            finally:
+                self._queue.task_done()
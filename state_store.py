@@ -0,0 +1,212 @@
+import time, sqlite3, threading
+
+from logutil import log
+
+# uma linha por mensagem tratada: decisão do LLM e duração de cada etapa (ms)
+LEDGER_COLUMNS = (
+    "message_id", "uid", "from_addr", "subject", "action", "outcome", "confidence", "model",
+    "prompt_tokens", "completion_tokens", "prefill_ms", "cache_hit",
+    "fetch_ms", "parse_ms", "queue_ms", "llm_ms", "smtp_ms", "move_ms", "total_ms",
+    "error", "question", "code_fp", "reply", "route", "route_reason", "thread_id", "created_at",
+)
+
+
+class StateStore:
+    """
+    Estado persistente do watcher (state.db) numa conexão só, compartilhada entre threads.
+    - WAL + synchronous=NORMAL: leituras não bloqueiam a escrita e o commit não força fsync a cada linha.
+    - Todos os Message-IDs processados ficam num set em memória: "já vi?" nunca vai ao disco.
+    - mark_processed só acumula; flush() grava o lote numa transação, uma vez por ciclo.
+    - Ledger (tabela `ledger`): uma linha por mensagem com decisão, tokens e tempos por etapa.
+    - Falhas (tabela `failures`): tentativas de cada mensagem que deu erro, gravadas na hora
+      (sobrevivem a reinício) e apagadas quando a mensagem é processada.
+    - Consultas da API de admin (ledger_page, ledger_for, replay_candidates…) sempre por índice:
+      paginação por chave (created_at, id), nunca OFFSET nem varredura da tabela.
+    Outros componentes (cache…) usam `con` sempre segurando `lock`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("CREATE TABLE IF NOT EXISTS processed (message_id TEXT PRIMARY KEY)")
+        self._ensure_columns("processed", {"processed_at": "REAL"})
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS ledger ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, message_id TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._ensure_columns("ledger", {
+            "uid": "TEXT", "from_addr": "TEXT", "subject": "TEXT", "action": "TEXT", "outcome": "TEXT",
+            "confidence": "REAL", "model": "TEXT", "prompt_tokens": "INTEGER", "completion_tokens": "INTEGER",
+            "prefill_ms": "REAL",
+            "cache_hit": "INTEGER", "fetch_ms": "REAL", "parse_ms": "REAL", "queue_ms": "REAL",
+            "llm_ms": "REAL", "smtp_ms": "REAL", "move_ms": "REAL", "total_ms": "REAL", "error": "TEXT",
+            # texto da dúvida, impressão digital do código e resposta enviada (base do TicketIndex)
+            "question": "TEXT", "code_fp": "TEXT", "reply": "TEXT",
+            # decisão da triagem: llm | escalar | ignorar, e o motivo
+            "route": "TEXT", "route_reason": "TEXT", "thread_id": "TEXT",
+        })
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_ledger_message_id ON ledger(message_id)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_ledger_created_at ON ledger(created_at)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_ledger_code_fp ON ledger(code_fp)")
+        # listagem/replay da API de admin por desfecho e período (o rowid vai junto no índice)
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_ledger_outcome_created ON ledger(outcome, created_at)")
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS failures ("
+            " message_id TEXT PRIMARY KEY, attempts INTEGER NOT NULL, last_error TEXT, failed_at REAL NOT NULL)"
+        )
+        self.con.commit()
+        self._seen = {r[0] for r in self.con.execute("SELECT message_id FROM processed")}
+        self._failures = {r[0]: (r[1], r[2]) for r in
+                          self.con.execute("SELECT message_id, attempts, failed_at FROM failures")}
+        self._pending = []
+        self._ledger = []
+        log("debug", f"state.db aberto ({len(self._seen)} mensagens já processadas)")
+
+    def _ensure_columns(self, table, columns):
+        """Migração simples: adiciona colunas que faltam em bancos antigos."""
+        have = {r[1] for r in self.con.execute(f"PRAGMA table_info({table})")}
+        for name, decl in columns.items():
+            if name not in have:
+                self.con.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+    def already_processed(self, msgid: str) -> bool:
+        return msgid in self._seen
+
+    def mark_processed(self, msgid: str):
+        with self.lock:
+            if msgid not in self._seen:
+                self._seen.add(msgid)
+                self._pending.append((msgid, time.time()))
+
+    def failure(self, msgid):
+        """(tentativas, instante da última falha) ou None se a mensagem nunca falhou."""
+        return self._failures.get(msgid)
+
+    def record_failure(self, msgid, error) -> int:
+        """Conta mais uma falha da mensagem (commit imediato) e devolve o total de tentativas."""
+        now = time.time()
+        with self.lock:
+            attempts = (self._failures.get(msgid) or (0, 0))[0] + 1
+            self.con.execute(
+                "INSERT INTO failures(message_id, attempts, last_error, failed_at) VALUES (?,?,?,?) "
+                "ON CONFLICT(message_id) DO UPDATE SET attempts=excluded.attempts,"
+                " last_error=excluded.last_error, failed_at=excluded.failed_at",
+                (msgid, attempts, str(error)[:1000], now),
+            )
+            self.con.commit()
+            self._failures[msgid] = (attempts, now)
+        return attempts
+
+    def record(self, entry: dict):
+        """Acumula uma linha do ledger (chaves de LEDGER_COLUMNS); gravada no próximo flush."""
+        entry.setdefault("created_at", time.time())
+        with self.lock:
+            self._ledger.append(tuple(entry.get(c) for c in LEDGER_COLUMNS))
+
+    def flush(self):
+        """Grava o que foi acumulado no ciclo (e qualquer escrita pendente de quem usa `con`)."""
+        with self.lock:
+            if self._ledger:
+                self.con.executemany(
+                    f"INSERT INTO ledger({', '.join(LEDGER_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(LEDGER_COLUMNS))})",
+                    self._ledger,
+                )
+                self._ledger = []
+            if self._pending:
+                self.con.executemany(
+                    "INSERT INTO processed(message_id, processed_at) VALUES (?,?) "
+                    "ON CONFLICT(message_id) DO NOTHING",
+                    self._pending,
+                )
+                failed = [(m,) for m, _ in self._pending if self._failures.pop(m, None)]
+                if failed:
+                    self.con.executemany("DELETE FROM failures WHERE message_id=?", failed)
+                self._pending = []
+            self.con.commit()
+
+    # ---------- consultas (API de admin) ----------
+    def _rows(self, sql, params=()):
+        with self.lock:
+            cur = self.con.execute(sql, params)
+            cols = [d[0] for d in cur.description]
+            return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+    def ledger_page(self, outcome=None, since=None, until=None, cursor=None, limit=50, columns=LEDGER_COLUMNS):
+        """
+        Linhas do ledger da mais recente para a mais antiga, filtradas por desfecho/período.
+        `cursor` é o (created_at, id) da última linha da página anterior. Devolve (linhas, próximo_cursor|None).
+        """
+        where, params = [], []
+        if outcome:
+            where.append("outcome = ?"); params.append(outcome)
+        if since is not None:
+            where.append("created_at >= ?"); params.append(since)
+        if until is not None:
+            where.append("created_at < ?"); params.append(until)
+        if cursor:
+            where.append("(created_at, id) < (?, ?)"); params += list(cursor)
+        rows = self._rows(
+            f"SELECT id, {', '.join(columns)} FROM ledger"
+            f"{' WHERE ' + ' AND '.join(where) if where else ''}"
+            " ORDER BY created_at DESC, id DESC LIMIT ?", params + [limit + 1])
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return rows, ((rows[-1]["created_at"], rows[-1]["id"]) if more else None)
+
+    def ledger_for(self, msgid):
+        """Todas as passagens de uma mensagem pelo watcher (a primeira e os reprocessamentos), em ordem."""
+        return self._rows(f"SELECT id, {', '.join(LEDGER_COLUMNS)} FROM ledger WHERE message_id = ? ORDER BY id",
+                          (msgid,))
+
+    def ledger_after(self, last_id, columns=LEDGER_COLUMNS):
+        """Linhas gravadas depois de `last_id` (faixa da chave primária)."""
+        return self._rows(f"SELECT id, {', '.join(columns)} FROM ledger WHERE id > ? ORDER BY id", (last_id,))
+
+    def last_ledger_id(self):
+        with self.lock:
+            return self.con.execute("SELECT COALESCE(MAX(id), 0) FROM ledger").fetchone()[0]
+
+    def latest_outcomes(self, msgids):
+        """{message_id: desfecho da passagem mais recente} (só as que estão no ledger)."""
+        out = {}
+        for i in range(0, len(msgids), 500):
+            chunk = msgids[i:i + 500]
+            for r in self._rows(
+                    "SELECT message_id, outcome FROM ledger l WHERE message_id IN "
+                    f"({', '.join('?' * len(chunk))}) AND NOT EXISTS "
+                    "(SELECT 1 FROM ledger n WHERE n.message_id = l.message_id AND n.id > l.id)", chunk):
+                out[r["message_id"]] = r["outcome"]
+        return out
+
+    def replay_candidates(self, outcome, since=None, until=None, limit=200):
+        """Message-IDs cuja passagem mais recente teve `outcome` no período, da mais antiga para a mais nova."""
+        rows = self._rows(
+            "SELECT message_id FROM ledger l WHERE outcome = ? AND created_at >= ? AND created_at < ?"
+            " AND NOT EXISTS (SELECT 1 FROM ledger n WHERE n.message_id = l.message_id AND n.id > l.id)"
+            " ORDER BY created_at LIMIT ?",
+            (outcome, since or 0, until or time.time() + 1, limit))
+        return list(dict.fromkeys(r["message_id"] for r in rows))
+
+    def failures(self, limit=100):
+        return self._rows("SELECT message_id, attempts, last_error, failed_at FROM failures"
+                          " ORDER BY failed_at DESC LIMIT ?", (limit,))
+
+    def forget(self, msgids):
+        """Libera mensagens para serem processadas de novo (reprocessamento pela API de admin)."""
+        with self.lock:
+            self.flush()
+            self.con.executemany("DELETE FROM processed WHERE message_id=?", [(m,) for m in msgids])
+            self.con.executemany("DELETE FROM failures WHERE message_id=?", [(m,) for m in msgids])
+            self.con.commit()
+            for m in msgids:
+                self._seen.discard(m)
+                self._failures.pop(m, None)
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.con.close()
@@ -0,0 +1,86 @@
+"""
+Várias caixas de suporte num processo só.
+TENANTS_FILE aponta um JSON com a lista de caixas; cada chave omitida vem da variável de ambiente
+correspondente (IMAP_HOST -> imap_host…). Valores "$VAR" são expandidos do ambiente, para a senha
+não ficar no arquivo:
+
+    {"tenants": [
+      {"name": "cobol", "mail_user": "suporte@aprendacobol.com.br", "mail_pass": "$COBOL_MAIL_PASS",
+       "gmail_email": "cobol.suporte@gmail.com", "google_token_file": "token-cobol.json"},
+      {"name": "jcl", "imap_host": "mail.aprendajcl.com.br", "mail_user": "suporte@aprendajcl.com.br",
+       "mail_pass": "$JCL_MAIL_PASS", "gmail_email": "jcl.suporte@gmail.com",
+       "google_token_file": "token-jcl.json", "signature_name": "Equipe Aprenda JCL",
+       "confidence_threshold": 0.75, "llm_max_parallel": 1, "llm_quota_per_hour": 60}
+    ]}
+
+Sem TENANTS_FILE, uma caixa só ("default") com a configuração do ambiente, como sempre foi.
+"""
+import os, json, time, queue
+from collections import deque
+from pathlib import Path
+
+TENANT_KEYS = (
+    "imap_host", "imap_port", "imap_ssl", "mail_user", "mail_pass",
+    "gmail_email", "google_token_file", "sent_folder",
+    "folder_processed", "folder_escalate", "confidence_threshold",
+    "signature_name", "signature_footer", "signature_links",
+    "state_db", "llm_max_parallel", "llm_quota_per_hour",
+)
+
+
+class Tenant:
+    """
+    Uma caixa de suporte: configuração (TENANT_KEYS viram atributos) e, depois do start_runtime,
+    sessão IMAP, remetente Gmail, fila de Enviados, assinatura já renderizada, ritmo do
+    lote, state.db, cache e índice de tickets próprios. `replays` recebe os pedidos de reprocessamento
+    da API de admin, atendidos pelo watcher da caixa (dono da sessão IMAP).
+    """
+
+    def __init__(self, name, **cfg):
+        self.name = name
+        for key in TENANT_KEYS:
+            setattr(self, key, cfg.get(key))
+        self.session = self.sender = self.archiver = self.renderer = None
+        self.store = self.response_cache = self.ticket_index = self.pacer = None
+        self.replays = queue.Queue()
+        self.claimed = ()  # UIDs marcados \Seen no lote em andamento e ainda não tratados (ver drain)
+        self._llm_calls = deque()  # instantes das chamadas ao LLM na última hora
+
+    def take_llm_quota(self, now=None):
+        """Reserva uma chamada ao LLM na cota por hora; False se a caixa já gastou a dela."""
+        if not self.llm_quota_per_hour:
+            return True
+        now = time.time() if now is None else now
+        while self._llm_calls and self._llm_calls[0] <= now - 3600:
+            self._llm_calls.popleft()
+        if len(self._llm_calls) >= self.llm_quota_per_hour:
+            return False
+        self._llm_calls.append(now)
+        return True
+
+    def own_addresses(self):
+        return (self.mail_user, self.gmail_email)
+
+
+def load_tenants(path, defaults):
+    """Lê TENANTS_FILE e completa cada caixa com `defaults` (dict com TENANT_KEYS)."""
+    if not path:
+        return [Tenant("default", **defaults)]
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    entries = data.get("tenants") if isinstance(data, dict) else data
+    if not entries:
+        raise ValueError(f"{path}: nenhuma caixa em 'tenants'")
+    db = Path(defaults.get("state_db") or "state.db")
+    tenants = []
+    for i, entry in enumerate(entries):
+        unknown = set(entry) - set(TENANT_KEYS) - {"name"}
+        if unknown:
+            raise ValueError(f"{path}: chave(s) desconhecida(s) em tenants[{i}]: {', '.join(sorted(unknown))}")
+        name = entry.get("name") or f"tenant{i + 1}"
+        if any(t.name == name for t in tenants):
+            raise ValueError(f"{path}: nome repetido: {name}")
+        cfg = dict(defaults, state_db=str(db.with_name(f"{db.stem}-{name}{db.suffix}")))
+        cfg.update((k, os.path.expandvars(v) if isinstance(v, str) else v) for k, v in entry.items() if k != "name")
+        tenants.append(Tenant(name, **cfg))
+    return tenants
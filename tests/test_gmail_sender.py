@@ -0,0 +1,55 @@
+import json
+import os
+import sys
+from email.message import EmailMessage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import pytest  # noqa: E402
+
+from fake_servers import FakeSmtpServer  # noqa: E402
+from gmail_sender import GmailSender, SendUncertain  # noqa: E402
+
+
+def _sender(tmp_path, server):
+    token = tmp_path / "token.json"
+    token.write_text(json.dumps({"token": "t", "refresh_token": "r", "client_id": "c",
+                                 "client_secret": "s", "expiry": "2099-01-01T00:00:00Z"}))
+    return GmailSender("eu@x.com", str(token), host="127.0.0.1", port=server.port, starttls=False, timeout=5)
+
+
+def _msg(n):
+    msg = EmailMessage()
+    msg["From"], msg["To"], msg["Subject"] = "eu@x.com", "aluno@x.com", f"Re: {n}"
+    msg.set_content("corpo")
+    return msg
+
+
+@pytest.fixture
+def smtp_server(request):
+    server = FakeSmtpServer(**getattr(request, "param", {})).start()
+    yield server
+    server.stop()
+
+
+@pytest.mark.parametrize("smtp_server", [{"per_connection": 1}], indirect=True)
+def test_session_closed_while_idle_is_reopened_before_sending(tmp_path, smtp_server):
+    sender = _sender(tmp_path, smtp_server)
+    sender.send(_msg(1))
+    sender.send(_msg(2))
+    sender.close()
+    assert [m["Subject"] for m in smtp_server.messages] == ["Re: 1", "Re: 2"]
+    assert smtp_server.commands["AUTH"] == 2 and smtp_server.commands["DATA"] == 2
+
+
+@pytest.mark.parametrize("smtp_server", [{"lose_replies": 1}], indirect=True)
+def test_lost_reply_after_data_is_not_resent(tmp_path, smtp_server):
+    sender = _sender(tmp_path, smtp_server)
+    with pytest.raises(SendUncertain):
+        sender.send(_msg(1))
+    assert len(smtp_server.messages) == 1 and smtp_server.commands["DATA"] == 1
+    sender.send(_msg(2))  # a próxima mensagem abre outra sessão normalmente
+    sender.close()
+    assert len(smtp_server.messages) == 2
@@ -0,0 +1,78 @@
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import pytest  # noqa: E402
+
+from fake_servers import FakeImapServer  # noqa: E402
+from imap_session import ImapSession, SessionClosed  # noqa: E402
+
+RAW = b"Message-ID: <m@x>\r\nFrom: a@x.com\r\nSubject: oi\r\n\r\ncorpo\r\n"
+
+
+@pytest.fixture(params=[("IMAP4rev1", "IDLE", "MOVE", "UIDPLUS"), ("IMAP4rev1", "MOVE", "UIDPLUS")],
+                ids=["idle", "noop"])
+def session(request):
+    server = FakeImapServer(capabilities=request.param).start()
+    s = ImapSession("127.0.0.1", server.port, "u", "p", use_ssl=False, noop_interval=0.1)
+    s.ensure()
+    yield server, s
+    s.close()
+    server.stop()
+
+
+def _timed_wait(s, timeout):
+    t0 = time.monotonic()
+    return s.wait_for_mail(timeout), time.monotonic() - t0
+
+
+def test_exists_from_previous_cycle_returns_at_once(session):
+    _, s = session
+    s.imap.untagged_responses["EXISTS"] = [b"7"]  # veio junto com um STORE/MOVE do ciclo
+    changed, took = _timed_wait(s, 1.0)
+    assert changed and took < 0.5
+
+
+def test_begin_sync_drops_what_the_search_covers(session):
+    _, s = session
+    s.imap.untagged_responses["EXISTS"] = [b"7"]
+    s.begin_sync()
+    changed, took = _timed_wait(s, 0.3)
+    assert not changed and took >= 0.3
+
+
+def test_mail_arriving_during_wait_is_signalled(session):
+    server, s = session
+    s.begin_sync()
+    threading.Timer(0.2, server.deliver, args=(RAW,)).start()
+    changed, took = _timed_wait(s, 3.0)
+    assert changed and took < 2.0
+
+
+def test_stop_interrupts_reconnect_backoff():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()  # porta sem ninguém: toda conexão falha
+    s = ImapSession("127.0.0.1", port, "u", "p", use_ssl=False, backoff_max=300)
+    s._failures = 8  # já no backoff longo
+    out = {}
+
+    def run():
+        try:
+            s.ensure()
+        except SessionClosed as e:
+            out["error"] = e
+
+    th = threading.Thread(target=run)
+    th.start()
+    time.sleep(0.2)
+    s.stop()
+    th.join(2)
+    assert not th.is_alive() and isinstance(out.get("error"), SessionClosed)
@@ -0,0 +1,12 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+
+
+def test_label_values_are_escaped():
+    c = metrics.Counter("teste_escape_total", "teste", ("subject",))
+    c.inc(subject='Re: "PIC"\nC:\\temp')
+    assert c.samples() == ['teste_escape_total{subject="Re: \\"PIC\\"\\nC:\\\\temp"} 1']
@@ -0,0 +1,64 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ollama_client import OllamaClient  # noqa: E402
+
+
+class _Response:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self):
+        for c in self.chunks:
+            if self.closed:
+                return
+            yield json.dumps(c).encode()
+
+    def close(self):
+        self.closed = True
+
+
+class _Session:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def post(self, url, json=None, stream=False, timeout=None):
+        return _Response(self.chunks)
+
+
+def _client(chunks, tail_s=2.0):
+    client = OllamaClient("http://ollama", "m", stream=True, tail_s=tail_s)
+    client.session = _Session(chunks)
+    return client
+
+
+def _token(text):
+    return {"message": {"content": text}, "done": False}
+
+
+FINAL = {"message": {"content": ""}, "done": True, "eval_count": 5, "eval_duration": 10 ** 9,
+         "prompt_eval_count": 321, "prompt_eval_duration": 2 * 10 ** 8}
+
+
+def test_stream_reads_final_chunk_after_json_closes():
+    client = _client([_token('{"a"'), _token(": 1}"), _token("\n"), FINAL])
+    assert client.generate_json("sys", "user") == {"a": 1}
+    stats = client.last_stats
+    assert stats["prompt_tokens"] == 321
+    assert stats["prefill_s"] == 0.2
+    assert not stats["stopped_early"]
+
+
+def test_stream_without_final_chunk_leaves_prefill_empty():
+    client = _client([_token('{"a": 1}')] + [_token(" ")] * 50, tail_s=0)
+    assert client.generate_json("sys", "user") == {"a": 1}
+    stats = client.last_stats
+    assert stats["stopped_early"]
+    assert "prefill_s" not in stats and "prompt_tokens" not in stats
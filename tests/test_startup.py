@@ -0,0 +1,24 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from bench_startup import DEFERRED, import_profile, within  # noqa: E402
+
+
+def test_import_app_does_not_pull_heavy_modules():
+    names = {name for _, name, _, _ in within(import_profile("app"), "app")}
+    eager = [m for m in DEFERRED if any(n == m or n.startswith(m + ".") for n in names)]
+    assert eager == [], f"import pesado no topo do app.py: {eager}"
+
+
+def test_readiness_is_a_copy():
+    import app
+    app.set_stage("teste", "pending")
+    snap = app.readiness()
+    snap["teste"]["state"] = "ok"
+    app.set_stage("outra", "error", RuntimeError("x"))
+    assert app.READINESS["teste"]["state"] == "pending" and "outra" not in snap
+    assert not app.is_ready()
@@ -0,0 +1,55 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_clean import clean_body, strip_quoted  # noqa: E402
+
+
+# ---------- falsos positivos: texto do aluno que parece cabeçalho de citação ----------
+def test_keeps_escreveu_in_student_text():
+    text = ("Olá professor,\nEm anexo segue o programa. Quando compilo, o cobc escreveu:\n"
+            "prog.cbl:42: error: WS-TOTAL is not defined\nO que estou fazendo de errado?")
+    assert clean_body(text) == text
+
+
+def test_keeps_wrote_in_student_text():
+    text = "Hi,\nOn line 42 the compiler wrote:\nIGYPS2121-S WS-X was not defined\nThanks"
+    assert clean_body(text) == text
+
+
+def test_keeps_two_line_em_start_without_attribution():
+    text = "Em casa o programa roda, mas no servidor o JCL escreveu:\nIEF450I ABEND S0C7\nPor quê?"
+    assert clean_body(text) == text
+
+
+# ---------- cabeçalhos de verdade continuam cortando ----------
+def test_cuts_gmail_attribution_wrapped():
+    text = ("Obrigado, funcionou.\n\nEm seg., 3 de jun. de 2024 às 10:00, Suporte <s@x.com>\n"
+            "escreveu:\n> resposta anterior")
+    assert clean_body(text) == "Obrigado, funcionou."
+
+
+def test_cuts_on_wrote_with_date():
+    text = "Still failing.\n\nOn Mon, Jun 3, 2024 at 10:00 AM Support <s@x.com> wrote:\n> old"
+    assert clean_body(text) == "Still failing."
+
+
+def test_cuts_header_without_attribution_when_quote_follows():
+    text = "Valeu!\nEm segunda, o suporte escreveu:\n> tente o FILE STATUS"
+    assert strip_quoted(text) == "Valeu!"
+
+
+def test_cuts_outlook_original_message():
+    text = "Segue.\n-----Mensagem original-----\nDe: Suporte\nhistórico"
+    assert clean_body(text) == "Segue."
+
+
+def test_keeps_forwarded_content():
+    text = "olha\n---------- Forwarded message ---------\nDe: A <a@x.com>\nDate: x\n\ndúvida real"
+    assert "dúvida real" in clean_body(text)
+
+
+def test_keeps_compiler_directives():
+    text = ">>SOURCE FORMAT FREE\nIDENTIFICATION DIVISION.\n> citação"
+    assert strip_quoted(text) == ">>SOURCE FORMAT FREE\nIDENTIFICATION DIVISION."
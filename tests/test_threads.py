@@ -0,0 +1,36 @@
+import os
+import sys
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from threads import group_threads  # noqa: E402
+
+NOW = 1_000_000.0
+
+
+def _hdr(msgid, subject, sender="aluno@x.com", in_reply_to=None):
+    msg = EmailMessage()
+    msg["Message-ID"], msg["Subject"], msg["From"] = msgid, subject, sender
+    if in_reply_to:
+        msg["In-Reply-To"] = in_reply_to
+    return msg
+
+
+def test_lone_new_message_is_not_deferred():
+    ready, due = group_threads({b"1": (_hdr("<a@x>", "Dúvida PIC"), NOW - 1)}, 5, 300, NOW)
+    assert ready == [[b"1"]] and due is None
+
+
+def test_lone_reply_waits_for_debounce():
+    ready, due = group_threads({b"1": (_hdr("<b@x>", "Re: Dúvida PIC", in_reply_to="<a@x>"), NOW - 1)},
+                               5, 300, NOW)
+    assert ready == [] and due == 4
+
+
+def test_pending_siblings_wait_together():
+    headers = {b"1": (_hdr("<a@x>", "Dúvida PIC"), NOW - 3), b"2": (_hdr("<c@x>", "Dúvida PIC"), NOW - 1)}
+    ready, due = group_threads(headers, 5, 300, NOW)
+    assert ready == [] and due == 4
+    ready, due = group_threads(headers, 5, 300, NOW + 4)
+    assert ready == [[b"1", b"2"]] and due is None
@@ -0,0 +1,20 @@
+import os
+import sys
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from threads import merge_messages  # noqa: E402
+from triage import classify  # noqa: E402
+
+
+def test_de_line_in_student_text_is_not_a_quote_header():
+    # antes, qualquer linha "De: …" cortava o resto e a dúvida virava "vazio"/"fora do assunto"
+    text = "De: um colega recebi este programa.\nO PERFORM não volta do parágrafo, por quê?"
+    assert classify(EmailMessage(), "aluno@x.com", "", text, "") == ("llm", "texto")
+
+
+def test_merge_drops_quoted_history_like_text_clean():
+    text, _ = merge_messages([("Dúvida", "segue o erro", ""),
+                              ("Re: Dúvida", "esqueci o anexo\n\nOn Mon, Jun 3, 2024 at 10:00 A <a@x.com> wrote:\n> segue o erro", "")])
+    assert "wrote" not in text and "esqueci o anexo" in text
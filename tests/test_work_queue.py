@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from work_queue import SqliteWorkQueue  # noqa: E402
+
+
+@pytest.fixture
+def wq(tmp_path):
+    q = SqliteWorkQueue(str(tmp_path / "q.db"))
+    yield q
+    q.close()
+
+
+def test_put_is_idempotent_per_key(wq):
+    assert wq.put("a\0<m1>", "a", {"n": 1})
+    assert not wq.put("a\0<m1>", "a", {"n": 2})
+    assert wq.stats() == {"pending": 1}
+    task_id, tenant, payload, attempts, _ = wq.lease("w1", 30)
+    assert (tenant, payload, attempts) == ("a", {"n": 1}, 1)
+
+
+def test_expired_lease_is_redelivered_and_late_complete_is_refused(wq):
+    wq.put("a\0<m1>", "a", {})
+    task_id = wq.lease("w1", 0.05)[0]
+    assert wq.lease("w2", 30) is None  # lease ainda vale
+    time.sleep(0.1)
+    again = wq.lease("w2", 30)
+    assert again[0] == task_id and again[3] == 2
+    assert not wq.complete(task_id, "w1", {"r": 1})  # o primeiro worker perdeu o lease
+    assert wq.complete(task_id, "w2", {"r": 2})
+    assert wq.results("a") == [(task_id, {}, {"r": 2})]
+
+
+def test_release_returns_task_without_counting_attempt(wq):
+    wq.put("a\0<m1>", "a", {})
+    task_id = wq.lease("w1", 30)[0]
+    wq.release(task_id, "w1")
+    assert wq.lease("w2", 30)[3] == 1
+
+
+def test_apply_and_ack(wq):
+    wq.put("a\0<m1>", "a", {})
+    task_id = wq.lease("w1", 30)[0]
+    wq.complete(task_id, "w1", {})
+    assert wq.outstanding("a") == 1
+    assert wq.begin_apply(task_id, "f1")
+    assert not wq.begin_apply(task_id, "f2")  # já está sendo aplicado
+    assert wq.results("a") == []
+    wq.ack([task_id])
+    assert wq.state("a\0<m1>") == "acked" and wq.outstanding("a") == 0
+    assert not wq.put("a\0<m1>", "a", {})  # a chave confirmada continua valendo
+    wq.forget(["a\0<m1>"])
+    assert wq.put("a\0<m1>", "a", {})
+
+
+def test_unapply_allows_retry_and_unacked_apply_becomes_orphan(wq):
+    wq.put("a\0<m1>", "a", {"job": 1})
+    task_id = wq.lease("w1", 30)[0]
+    wq.complete(task_id, "w1", {})
+    wq.begin_apply(task_id, "f1")
+    wq.unapply(task_id, "f1")  # SMTP falhou antes de sair
+    assert [r[0] for r in wq.results("a")] == [task_id]
+    wq.begin_apply(task_id, "f1")  # e agora o fetcher cai antes do ack
+    assert wq.orphans("a") == [(task_id, {"job": 1})]
+    assert wq.results("a") == []  # o próximo fetcher não reenvia
+
+
+def test_fetcher_lock_ttl_and_steal(wq):
+    assert wq.acquire("fetcher:a", "n1", 0.1)
+    assert wq.acquire("fetcher:a", "n1", 0.1)  # renovar
+    assert not wq.acquire("fetcher:a", "n2", 0.1)
+    time.sleep(0.15)
+    assert wq.acquire("fetcher:a", "n2", 30)  # venceu: outro nó assume
+    assert not wq.acquire("fetcher:a", "n1", 30)
+    wq.release_lock("fetcher:a", "n1")  # não é dele: não solta
+    assert not wq.acquire("fetcher:a", "n1", 30)
+    wq.release_lock("fetcher:a", "n2")
+    assert wq.acquire("fetcher:a", "n1", 30)
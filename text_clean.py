@@ -0,0 +1,172 @@
+"""
+Normalização do texto que chega por e-mail, antes da triagem e do prompt.
+Padrões compilados uma vez e tudo em tempo linear no tamanho da mensagem:
+- html_to_text: HTMLParser em vez de regex de tag; ignora <script>/<style>/<head> e o histórico
+  citado (<blockquote>, div.gmail_quote), quebra linha nos blocos e decodifica entidades.
+  HTML cortado no meio (leitura parcial) não deixa pedaço de tag.
+- strip_quoted: corta o histórico ("Em … escreveu:", "On … wrote:", "-----Mensagem original-----",
+  cabeçalho De:/Enviado: do Outlook) e as linhas citadas com ">". Encaminhamentos são mantidos:
+  ali o conteúdo citado é a própria dúvida.
+- strip_signature: assinatura depois de "-- " e "Enviado do meu iPhone" e afins.
+- clean_body: as anteriores + caracteres de controle, espaço no fim da linha e linhas em branco repetidas.
+- cobol_source: linhas de um fonte com NBSP (recuo vindo de HTML) virando espaço, sem espaço no fim
+  (listagens de mainframe vêm completadas até a coluna 80) e, no formato fixo, sem a área de
+  identificação (colunas 73–80), que o compilador ignora.
+"""
+import re
+from html.parser import HTMLParser
+
+_CONTROL_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+_TRAILING_WS_RE = re.compile(r"[ \t\xa0]+$", re.M)
+_BLANK_RUN_RE = re.compile(r"\n{3,}")
+_HTML_WS_RE = re.compile(r"[ \t\r\n\f]+")
+_REPLY_HEADER_RE = re.compile(r"^\s*(em .+ escreveu\s*:|on .+ wrote\s*:)\s*$", re.I)
+_REPLY_HEAD_START_RE = re.compile(r"^\s*(em|on)\s+\S", re.I)  # atribuição quebrada em duas linhas
+_REPLY_HEAD_END_RE = re.compile(r"(escreveu|wrote)\s*:\s*$", re.I)
+# "Em … escreveu:" só é cabeçalho de citação com cara de atribuição: e-mail, <…>, ano ou hora
+_ATTRIBUTION_RE = re.compile(r"@|<[^>]+>|\b(19|20)\d{2}\b|\b\d{1,2}[:h]\d{2}\b")
+_ORIGINAL_MSG_RE = re.compile(r"^\s*-{2,}\s*(mensagem original|original message)\s*-{2,}\s*$", re.I)
+_OUTLOOK_FROM_RE = re.compile(r"^\s*\*?(de|from)\s*:\*?\s+\S", re.I)
+_OUTLOOK_NEXT_RE = re.compile(r"^\s*\*?(enviad[oa](\s+em)?|sent|data|date)\s*:", re.I)
+_FORWARD_RE = re.compile(r"^\s*-{2,}\s*(forwarded message|mensagem encaminhada)\s*-{2,}\s*$", re.I)
+_QUOTE_RE = re.compile(r"^\s*>")
+# diretivas de compilação começam com ">>" e não são citação
+_DIRECTIVE_RE = re.compile(
+    r"^\s*>>\s*(SOURCE|IF|ELSE|END-IF|DEFINE|SET|EVALUATE|WHEN|END-EVALUATE|TURN|PAGE|LISTING|CALL-CONVENTION|D)\b",
+    re.I)
+_SIG_DELIM_RE = re.compile(r"^--\s?$")
+_MOBILE_SIG_RE = re.compile(r"^\s*(enviado|sent)\s+(do|de|from)\s+(meu|my)\s+\S.*$", re.I)
+_FREE_FORMAT_RE = re.compile(r">>\s*SOURCE\s+(FORMAT\s+)?(IS\s+)?FREE", re.I)
+# colunas 1–6 (área de sequência) numéricas = COBOL em formato fixo; usado também no índice e no cache
+SEQ_AREA_RE = re.compile(r"^\d{6}")
+
+SIGNATURE_MAX_LINES = 12  # depois de "-- ", só corta se o resto tiver cara de assinatura
+
+
+class _HtmlText(HTMLParser):
+    _SKIP = frozenset(("script", "style", "head", "noscript", "template", "blockquote"))
+    _BLOCK = frozenset(("p", "div", "tr", "table", "ul", "ol", "h1", "h2", "h3", "h4", "h5", "h6",
+                        "hr", "section", "article", "header", "footer", "center", "dl", "dt", "dd"))
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.skip_tag, self.skip_depth = None, 0
+        self.pre = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self.skip_tag:
+            if tag == self.skip_tag:
+                self.skip_depth += 1
+            return
+        if tag in self._SKIP or (tag == "div" and "gmail_quote" in (dict(attrs).get("class") or "")):
+            self.skip_tag, self.skip_depth = tag, 1
+        elif tag == "br":
+            self.out.append("\n")
+        elif tag == "li":
+            self.out.append("\n- ")
+        elif tag == "pre":
+            self.pre += 1
+            self.out.append("\n")
+        elif tag in ("td", "th"):
+            self.out.append(" ")
+        elif tag in self._BLOCK:
+            self.out.append("\n")
+
+    def handle_endtag(self, tag):
+        if self.skip_tag:
+            if tag == self.skip_tag:
+                self.skip_depth -= 1
+                if not self.skip_depth:
+                    self.skip_tag = None
+            return
+        if tag == "pre":
+            self.pre = max(0, self.pre - 1)
+            self.out.append("\n")
+        elif tag in self._BLOCK:
+            self.out.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_tag:
+            self.out.append(data if self.pre else _HTML_WS_RE.sub(" ", data))
+
+
+def html_to_text(html: str) -> str:
+    # leitura parcial pode cortar no meio de uma tag: descarta o pedaço
+    cut = html.rfind("<")
+    if cut > html.rfind(">"):
+        html = html[:cut]
+    parser = _HtmlText()
+    parser.feed(html)
+    parser.close()
+    lines = []
+    for line in "".join(parser.out).replace("\xa0", " ").splitlines():
+        line = line.rstrip()
+        # espaço herdado da formatação do HTML (não é recuo de código, que vem de &nbsp;)
+        lines.append(line[1:] if line[:1] == " " and line[1:2] != " " else line)
+    return _BLANK_RUN_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def _quote_follows(lines, i):
+    """A próxima linha não vazia depois de `i` é citada com ">"."""
+    return next((l.lstrip().startswith(">") for l in lines[i + 1:] if l.strip()), False)
+
+
+def _reply_header(lines, i):
+    """A linha `i` abre o histórico citado? "Em … escreveu:" (inteira ou quebrada em duas linhas) só com
+    atribuição de verdade ou seguida de linhas ">"; "-----Mensagem original-----" e De:/Enviado: do Outlook sempre."""
+    line = lines[i]
+    nxt = lines[i + 1] if i + 1 < len(lines) else ""
+    if _ORIGINAL_MSG_RE.match(line) or (_OUTLOOK_FROM_RE.match(line) and _OUTLOOK_NEXT_RE.match(nxt)):
+        return True
+    if _REPLY_HEADER_RE.match(line):
+        head, end = line, i
+    elif _REPLY_HEAD_START_RE.match(line) and _REPLY_HEAD_END_RE.search(nxt):
+        head, end = f"{line} {nxt}", i + 1
+    else:
+        return False
+    return bool(_ATTRIBUTION_RE.search(head)) or _quote_follows(lines, end)
+
+
+def strip_quoted(text: str) -> str:
+    """Só o que o remetente escreveu: sem o histórico da conversa nem as linhas citadas com ">"."""
+    lines = text.splitlines()
+    out, forwarded = [], False
+    for i, line in enumerate(lines):
+        if _FORWARD_RE.match(line):
+            forwarded = True
+        elif not forwarded and _reply_header(lines, i):
+            break
+        if _QUOTE_RE.match(line) and not _DIRECTIVE_RE.match(line):
+            continue
+        out.append(line)
+    return "\n".join(out)
+
+
+def strip_signature(text: str) -> str:
+    lines = [l for l in text.splitlines() if not _MOBILE_SIG_RE.match(l)]
+    for i in range(len(lines) - 1, -1, -1):
+        if _SIG_DELIM_RE.match(lines[i]):
+            if len(lines) - i - 1 <= SIGNATURE_MAX_LINES:
+                lines = lines[:i]
+            break
+    return "\n".join(lines)
+
+
+def clean_body(text: str) -> str:
+    """Texto pronto para triagem e prompt; se só havia citação, devolve o texto inteiro limpo."""
+    text = _CONTROL_RE.sub("", (text or "").replace("\r\n", "\n").replace("\r", "\n"))
+    text = _TRAILING_WS_RE.sub("", text)
+    own = strip_signature(strip_quoted(text)).strip()
+    return _BLANK_RUN_RE.sub("\n\n", own or text.strip())
+
+
+def cobol_source(lines):
+    """Linhas de um fonte COBOL normalizadas (ver o cabeçalho do módulo)."""
+    lines = [l.replace("\xa0", " ").rstrip() for l in lines]
+    if any(_FREE_FORMAT_RE.search(l) for l in lines):
+        return lines
+    # formato fixo só com evidência (números de sequência ou comentário na coluna 7)
+    if not any(SEQ_AREA_RE.match(l) or l[6:7] == "*" for l in lines):
+        return lines
+    return [l[:72].rstrip() if len(l) > 72 and (l[:6].isdigit() or l[:6].isspace()) else l for l in lines]
@@ -0,0 +1,99 @@
+"""
+Agrupamento de mensagens por conversa antes do LLM.
+Três e-mails seguidos do mesmo aluno ("esqueci o anexo", "segue o erro") viram uma chamada ao
+modelo e uma resposta só. Mensagens se ligam por References/In-Reply-To ou por remetente +
+assunto normalizado; uma conversa espera `debounce` segundos sem novidade antes de ser tratada.
+Mensagem avulsa que não é resposta (sem In-Reply-To/References nem "Re:") não espera.
+"""
+import re, email.utils
+
+from text_clean import strip_quoted
+
+_REPLY_PREFIX_RE = re.compile(r"^\s*((re|res|fw|fwd|enc|tr|rv)\s*(\[\d+\])?\s*:\s*)+", re.I)
+_MSGID_RE = re.compile(r"<[^<>\s]+>")
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_subject(subject: str) -> str:
+    """'RE: Fwd:  Dúvida PIC' -> 'dúvida pic'."""
+    return _WS_RE.sub(" ", _REPLY_PREFIX_RE.sub("", subject or "")).strip().casefold()
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        self.parent.setdefault(x, x)
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[rb] = ra
+
+
+def group_threads(headers, debounce, max_wait, now):
+    """
+    headers: {uid: (cabeçalhos, chegada_epoch|None)} das mensagens novas.
+    Devolve (grupos prontos [[uid…] em ordem de chegada], segundos até o próximo grupo adiado ficar pronto | None).
+    Um grupo fica pronto quando a mensagem mais nova tem `debounce` segundos
+    ou a mais antiga já esperou `max_wait`; mensagem sozinha que não é resposta fica pronta na hora.
+    """
+    uf = _UnionFind()
+    replies = set()
+    for uid, (hdr, _) in headers.items():
+        node = ("uid", uid)
+        uf.find(node)
+        if hdr is None:
+            continue
+        msgid = (hdr.get("Message-ID") or "").strip()
+        if msgid:
+            uf.union(node, ("id", msgid))
+        refs = _MSGID_RE.findall(f"{hdr.get('In-Reply-To') or ''} {hdr.get('References') or ''}")
+        for ref in refs:
+            uf.union(node, ("id", ref))
+        if refs or _REPLY_PREFIX_RE.match(hdr.get("Subject") or ""):
+            replies.add(uid)
+        sender = email.utils.parseaddr(hdr.get("From") or "")[1].lower()
+        subject = normalize_subject(hdr.get("Subject") or "")
+        if sender and subject:
+            uf.union(node, ("subj", sender, subject))
+
+    groups = {}
+    for uid in headers:
+        groups.setdefault(uf.find(("uid", uid)), []).append(uid)
+
+    ready, due = [], None
+    for members in groups.values():
+        arrivals = [headers[u][1] for u in members if headers[u][1] is not None]
+        members.sort(key=lambda u: (headers[u][1] or 0, int(u)))
+        if not arrivals or debounce <= 0 or (len(members) == 1 and members[0] not in replies):
+            ready.append(members)
+            continue
+        wait = min(debounce - (now - max(arrivals)), max_wait - (now - min(arrivals)))
+        if wait <= 0:
+            ready.append(members)
+        else:
+            due = wait if due is None else min(due, wait)
+    ready.sort(key=lambda g: int(g[0]))
+    return ready, due
+
+
+def merge_messages(parts):
+    """
+    parts: [(assunto, texto, código)] em ordem de chegada.
+    Devolve (texto, código) de um prompt só; o histórico citado de cada resposta é descartado
+    porque a mensagem anterior já está no grupo.
+    """
+    if len(parts) == 1:
+        return parts[0][1], parts[0][2]
+    texts, codes = [], []
+    for n, (subject, text, code) in enumerate(parts, 1):
+        texts.append(f"[Mensagem {n} de {len(parts)} — {subject}]\n{strip_quoted(text or '').strip()}")
+        if code:
+            codes.append(code)
+    return "\n\n".join(texts), "\n".join(codes)
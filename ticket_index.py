@@ -0,0 +1,125 @@
+import re, time, sqlite3, unicodedata
+
+from logutil import log
+from response_cache import normalize_text
+
+# palavras que não ajudam a achar casos parecidos
+_STOPWORDS = set("""
+ola oi bom dia boa tarde noite obrigado obrigada abracos att atenciosamente por favor
+que para com uma umas uns por como mas nao sim meu minha seu sua isso esse essa este esta
+aqui ali quando onde qual quais porque pois tem ter estou esta estao fazer faz foi ser sao
+the and for with this that from have what
+""".split())
+_TERM_RE = re.compile(r"[\w-]+")
+
+
+class TicketIndex:
+    """
+    Índice dos tickets já respondidos (question/reply do ledger) para exemplos few-shot.
+    - FTS5 dentro do próprio state.db, ranqueado por BM25; o índice fica em disco.
+    - Incremental: um trigger no ledger indexa cada resposta na mesma transação do flush.
+    - Criado sob demanda na primeira busca; linhas antigas do ledger entram nessa hora, uma vez.
+    - Nomes COBOL com hífen (WS-SALDO-CLI) são um token só.
+    - A consulta usa só os termos mais raros (frequência por documento do fts5vocab, em memória
+      e recarregada de hora em hora): termos comuns casam com quase tudo e deixam o BM25 lento.
+    - Mesmo código (code_fp) conta como caso mais parecido, antes do BM25.
+    Se o SQLite não tiver FTS5, a busca simplesmente não devolve nada.
+    """
+
+    def __init__(self, store, top_k=2, max_terms=6, max_df_ratio=0.05, df_refresh_seconds=3600):
+        self.store = store
+        self.top_k = top_k
+        self.max_terms = max_terms
+        self.max_df_ratio = max_df_ratio
+        self.df_refresh = df_refresh_seconds
+        self._ready = None
+        self._df, self._docs, self._df_loaded = {}, 0, 0.0
+
+    def _ensure(self):
+        if self._ready is not None:
+            return self._ready
+        con = self.store.con
+        with self.store.lock:
+            if self._ready is not None:
+                return self._ready
+            try:
+                new = con.execute("SELECT 1 FROM sqlite_master WHERE name='tickets_fts'").fetchone() is None
+                con.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS tickets_fts USING fts5("
+                    " question, reply, tokenize=\"unicode61 remove_diacritics 2 tokenchars '-'\")"
+                )
+                con.execute("CREATE VIRTUAL TABLE IF NOT EXISTS tickets_vocab USING fts5vocab(tickets_fts, 'row')")
+                if new:  # pergunta pesa o dobro da resposta
+                    con.execute("INSERT INTO tickets_fts(tickets_fts, rank) VALUES('rank', 'bm25(2.0, 1.0)')")
+            except sqlite3.OperationalError as e:
+                log("warn", "FTS5 indisponível; exemplos de tickets antigos desligados:", e)
+                self._ready = False
+                return False
+            con.execute(
+                "CREATE TRIGGER IF NOT EXISTS ledger_tickets_ai AFTER INSERT ON ledger"
+                " WHEN new.outcome='respondido' AND new.reply IS NOT NULL AND COALESCE(new.cache_hit,0)=0"
+                " BEGIN INSERT INTO tickets_fts(rowid, question, reply) VALUES (new.id, new.question, new.reply); END"
+            )
+            added = con.execute(
+                "INSERT INTO tickets_fts(rowid, question, reply)"
+                " SELECT id, question, reply FROM ledger"
+                " WHERE outcome='respondido' AND reply IS NOT NULL AND COALESCE(cache_hit,0)=0"
+                " AND id > (SELECT COALESCE(MAX(rowid), 0) FROM tickets_fts)"
+            ).rowcount
+            con.commit()
+            log("debug", f"Índice de tickets pronto ({added} resposta(s) antiga(s) indexada(s)).")
+            self._ready = True
+            self._load_df()
+        return True
+
+    def _load_df(self):
+        with self.store.lock:
+            con = self.store.con
+            self._df = dict(con.execute("SELECT term, doc FROM tickets_vocab"))
+            self._docs = con.execute("SELECT COUNT(*) FROM tickets_fts").fetchone()[0]
+        self._df_loaded = time.monotonic()
+
+    def _match_query(self, question):
+        terms, seen = [], set()
+        plain = unicodedata.normalize("NFKD", normalize_text(question))
+        plain = "".join(c for c in plain if not unicodedata.combining(c))
+        too_common = max(20, self._docs * self.max_df_ratio)
+        for t in _TERM_RE.findall(plain):
+            t = t.strip("-")
+            if len(t) < 3 or t in _STOPWORDS or t in seen or t.isdigit():
+                continue
+            seen.add(t)
+            if self._df.get(t, 1) <= too_common:  # termo novo (fora do vocabulário carregado) conta como raro
+                terms.append(t)
+        terms = sorted(terms, key=lambda t: self._df.get(t, 1))[:self.max_terms]
+        return " OR ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+    def search(self, question, code_fp=None):
+        """Até top_k casos [(pergunta, resposta)], do mais parecido para o menos."""
+        if self.top_k <= 0 or not self._ensure():
+            return []
+        if time.monotonic() - self._df_loaded > self.df_refresh:
+            self._load_df()
+        con, out, seen = self.store.con, [], set()
+        query = self._match_query(question)
+        with self.store.lock:
+            if code_fp:
+                for row in con.execute(
+                    "SELECT id, question, reply FROM ledger WHERE code_fp=? AND outcome='respondido'"
+                    " AND reply IS NOT NULL ORDER BY id DESC LIMIT 1", (code_fp,)
+                ):
+                    seen.add(row[0])
+                    out.append((row[1], row[2]))
+            if query:
+                for row in con.execute(
+                    "SELECT rowid, question, reply FROM tickets_fts WHERE tickets_fts MATCH ?"
+                    " ORDER BY rank LIMIT ?", (query, self.top_k + len(seen))
+                ):
+                    if row[0] not in seen:
+                        seen.add(row[0])
+                        out.append((row[1], row[2]))
+        return out[:self.top_k]
+
+    def count(self):
+        """Tickets indexados na última carga do vocabulário."""
+        return self._docs
@@ -0,0 +1,63 @@
+"""
+Triagem barata antes do LLM: regras sobre cabeçalhos e sinais de texto.
+Rotas:
+- "ignorar": respostas automáticas, bounces, listas/newsletters, nossas próprias mensagens e
+  agradecimentos curtos — ficam lidas na INBOX, sem resposta;
+- "escalar": casos que o modelo escalaria de qualquer jeito (vazio, sem nada de COBOL fora de uma
+  conversa em andamento, cheio de links);
+- "llm": todo o resto. Havendo código COBOL, a mensagem sempre vai para o LLM (salvo as automáticas).
+"""
+import re, unicodedata
+
+from text_clean import strip_quoted
+
+# palavras que indicam assunto de COBOL/mainframe (radicais; comparação sem acento e em minúsculas)
+_COBOL_RE = re.compile(
+    r"\b(cobol|cbl|copybook|copy\b|pic\b|picture|division|section|perform|move\b|compute|"
+    r"working-storage|linkage|procedure|occurs|redefines|comp-3|comp\b|jcl|cics|db2|vsam|mainframe|"
+    r"compila|compilad|gnucobol|opencobol|cobc\b|abend|file status|sqlcode|display|accept|"
+    r"read|write|rewrite|evaluate|unstring|inspect|assign|paragrafo|variavel|programa)", re.I)
+_THANKS_RE = re.compile(r"\b(obrigad[oa]s?|valeu|agradeco|grat[oa]|thanks|thank you|muito bom|funcionou|deu certo)\b", re.I)
+_STILL_RE = re.compile(r"\b(mas|porem|ainda|nao|erro|problema|duvida|outra)\b", re.I)
+_URL_RE = re.compile(r"https?://", re.I)
+_BOUNCE_FROM_RE = re.compile(r"^(mailer-daemon|postmaster)@", re.I)
+
+
+def _fold(text):
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _header(msg, name):
+    return str(msg.get(name) or "").strip().lower()
+
+
+def classify(msg, from_addr, subject, plain_text, code_block, own_addresses=()):
+    """(rota, motivo) para a mensagem; `msg` só precisa dos cabeçalhos."""
+    sender = (from_addr or "").lower()
+    auto = _header(msg, "Auto-Submitted")
+    if auto and auto != "no":
+        return "ignorar", "auto-submitted"
+    if _header(msg, "X-Autoreply") or _header(msg, "X-Autorespond") or _header(msg, "X-Auto-Response-Suppress") == "all":
+        return "ignorar", "auto-reply"
+    if _BOUNCE_FROM_RE.match(sender) or msg.get_content_type() == "multipart/report":
+        return "ignorar", "bounce"
+    if sender and sender in {a.lower() for a in own_addresses if a}:
+        return "ignorar", "remetente próprio"
+    if _header(msg, "List-Id") or _header(msg, "List-Unsubscribe") or _header(msg, "Precedence") in ("bulk", "list", "junk"):
+        return "ignorar", "lista/newsletter"
+
+    if code_block:
+        return "llm", "código"
+    text = _fold(strip_quoted(plain_text or "").strip())
+    if not text and not subject:
+        return "escalar", "vazio"
+    if len(text) < 300 and "?" not in text and _THANKS_RE.search(text) and not _STILL_RE.search(text):
+        return "ignorar", "agradecimento"
+    if len(_URL_RE.findall(text)) > 5:
+        return "escalar", "muitos links"
+    # continuação de conversa já é do assunto, mesmo sem palavra-chave de COBOL
+    is_reply = bool(msg.get("In-Reply-To") or msg.get("References"))
+    if not is_reply and not _COBOL_RE.search(f"{_fold(subject or '')}\n{text}"):
+        return "escalar", "sem conteúdo COBOL"
+    return "llm", "texto"
@@ -0,0 +1,173 @@
+import json, time, sqlite3, threading
+
+from logutil import log
+
+
+class SqliteWorkQueue:
+    """
+    Fila durável entre o fetcher (quem lê o IMAP) e os workers (quem chama o LLM), para rodar vários nós.
+    - put(chave, …) é idempotente: a chave vem do Message-ID, então reenfileirar a mesma mensagem não duplica.
+    - lease() entrega a tarefa pendente mais antiga da caixa com menos tarefas em execução; o lease vence
+      depois de `visibility` segundos e a tarefa volta para a fila (worker que caiu no meio não perde a mensagem).
+    - complete() grava o resultado só se o lease ainda for do worker; release() devolve sem resultado.
+    - results()/begin_apply()/ack(): o fetcher pega os resultados, marca cada um como "aplicando" na fila
+      (compartilhada entre os nós) antes do SMTP e confirma depois do MOVE/ledger; tarefas confirmadas
+      ficam `retention` segundos para a chave continuar valendo e depois são apagadas. Uma tarefa que ficou
+      "aplicando" (fetcher caiu no meio) não é reenviada: orphans() a entrega ao próximo fetcher sem resultado.
+    - acquire(): trava com prazo, usada para eleger um único fetcher por caixa; renovar = chamar de novo.
+    Outro backend (Postgres, Redis…) só precisa oferecer os mesmos métodos.
+    Estados: pending -> leased -> done -> applying -> acked.
+    """
+
+    def __init__(self, path, retention=7 * 86400):
+        self.path = path
+        self.retention = retention
+        self.lock = threading.Lock()
+        # isolation_level=None: as transações são abertas à mão (BEGIN IMMEDIATE) para valer entre processos
+        self.con = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, tenant TEXT NOT NULL,"
+            " payload TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,"
+            " lease_owner TEXT, lease_until REAL, result TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_tasks_state ON tasks(state, tenant)")
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._purged = 0.0
+
+    def _tx(self, fn):
+        with self.lock:
+            self.con.execute("BEGIN IMMEDIATE")
+            try:
+                out = fn(self.con)
+            except BaseException:
+                self.con.execute("ROLLBACK")
+                raise
+            self.con.execute("COMMIT")
+            return out
+
+    # ---------- fetcher ----------
+    def put(self, key, tenant, payload):
+        """Enfileira; devolve False se a chave já existia (mensagem já enfileirada antes)."""
+        now = time.time()
+        return self._tx(lambda con: con.execute(
+            "INSERT INTO tasks(key, tenant, payload, created_at, updated_at) VALUES (?,?,?,?,?)"
+            " ON CONFLICT(key) DO NOTHING", (key, tenant, json.dumps(payload), now, now)
+        ).rowcount == 1)
+
+    def state(self, key):
+        """Estado da tarefa da chave (pending/leased/done/acked) ou None."""
+        with self.lock:
+            row = self.con.execute("SELECT state FROM tasks WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def forget(self, keys):
+        """Apaga tarefas já confirmadas dessas chaves, para a mensagem poder ser enfileirada de novo (reprocessamento)."""
+        if keys:
+            self._tx(lambda con: con.executemany("DELETE FROM tasks WHERE key=? AND state='acked'",
+                                                 [(k,) for k in keys]))
+
+    def results(self, tenant, limit=100):
+        """[(id, payload, result)] prontos para o fetcher aplicar."""
+        with self.lock:
+            rows = self.con.execute(
+                "SELECT id, payload, result FROM tasks WHERE tenant=? AND state='done' ORDER BY id LIMIT ?",
+                (tenant, limit)).fetchall()
+        return [(i, json.loads(p), json.loads(r)) for i, p, r in rows]
+
+    def begin_apply(self, task_id, holder):
+        """done -> applying antes do envio; False se outro fetcher já pegou (ou aplicou) o resultado."""
+        return self._tx(lambda con: con.execute(
+            "UPDATE tasks SET state='applying', lease_owner=?, updated_at=? WHERE id=? AND state='done'",
+            (holder, time.time(), task_id)).rowcount == 1)
+
+    def unapply(self, task_id, holder):
+        """applying -> done: o envio falhou antes de sair e o resultado pode ser aplicado de novo."""
+        self._tx(lambda con: con.execute(
+            "UPDATE tasks SET state='done', lease_owner=NULL, updated_at=? WHERE id=? AND state='applying'"
+            " AND lease_owner=?", (time.time(), task_id, holder)))
+
+    def orphans(self, tenant):
+        """
+        [(id, payload)] que ficaram "aplicando" sem confirmação (o fetcher caiu entre o envio e o ack).
+        Só faz sentido no começo do ciclo do único fetcher da caixa: o próprio ciclo confirma o que marca.
+        """
+        with self.lock:
+            rows = self.con.execute("SELECT id, payload FROM tasks WHERE tenant=? AND state='applying' ORDER BY id",
+                                    (tenant,)).fetchall()
+        return [(i, json.loads(p)) for i, p in rows]
+
+    def ack(self, ids):
+        if not ids:
+            return
+        now = time.time()
+        self._tx(lambda con: con.executemany(
+            "UPDATE tasks SET state='acked', payload='{}', result=NULL, updated_at=? WHERE id=?",
+            [(now, i) for i in ids]))
+        if now - self._purged > 3600:
+            self._purged = now
+            self._tx(lambda con: con.execute(
+                "DELETE FROM tasks WHERE state='acked' AND updated_at < ?", (now - self.retention,)))
+
+    def outstanding(self, tenant):
+        """Tarefas da caixa ainda sem resultado aplicado (pendentes, em execução ou prontas)."""
+        with self.lock:
+            return self.con.execute(
+                "SELECT COUNT(*) FROM tasks WHERE tenant=? AND state IN ('pending','leased','done','applying')",
+                (tenant,)).fetchone()[0]
+
+    # ---------- workers ----------
+    def lease(self, owner, visibility):
+        """Pega uma tarefa por `visibility` segundos: (id, caixa, payload, tentativas, enfileirada_em) ou None."""
+        now = time.time()
+        row = self._tx(lambda con: con.execute(
+            "UPDATE tasks SET state='leased', lease_owner=?, lease_until=?, attempts=attempts+1, updated_at=?"
+            " WHERE id = (SELECT t.id FROM tasks t"
+            "  WHERE t.state='pending' OR (t.state='leased' AND t.lease_until < ?)"
+            "  ORDER BY (SELECT COUNT(*) FROM tasks r WHERE r.tenant=t.tenant AND r.state='leased'"
+            "            AND r.lease_until >= ?), t.id LIMIT 1)"
+            " RETURNING id, tenant, payload, attempts, created_at",
+            (owner, now + visibility, now, now, now)).fetchone())
+        if row is None:
+            return None
+        if row[3] > 1:
+            log("warn", f"Tarefa {row[0]} ({row[1]}) retomada depois de lease vencido (tentativa {row[3]}).")
+        return row[0], row[1], json.loads(row[2]), row[3], row[4]
+
+    def complete(self, task_id, owner, result):
+        """Grava o resultado; False se o lease já tinha vencido e outro worker pegou a tarefa."""
+        return self._tx(lambda con: con.execute(
+            "UPDATE tasks SET state='done', result=?, lease_owner=NULL, lease_until=NULL, updated_at=?"
+            " WHERE id=? AND state='leased' AND lease_owner=?",
+            (json.dumps(result), time.time(), task_id, owner)).rowcount == 1)
+
+    def release(self, task_id, owner):
+        """Devolve a tarefa para a fila sem contar a tentativa (desligamento do worker)."""
+        self._tx(lambda con: con.execute(
+            "UPDATE tasks SET state='pending', attempts=attempts-1, lease_owner=NULL, lease_until=NULL, updated_at=?"
+            " WHERE id=? AND state='leased' AND lease_owner=?", (time.time(), task_id, owner)))
+
+    # ---------- líder ----------
+    def acquire(self, name, holder, ttl):
+        """Pega (ou renova) a trava `name` por `ttl` segundos; False se outro nó a detém."""
+        now = time.time()
+        return self._tx(lambda con: con.execute(
+            "INSERT INTO locks(name, holder, expires_at) VALUES (?,?,?)"
+            " ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at"
+            " WHERE locks.holder=excluded.holder OR locks.expires_at < ?",
+            (name, holder, now + ttl, now)).rowcount == 1)
+
+    def release_lock(self, name, holder):
+        self._tx(lambda con: con.execute("DELETE FROM locks WHERE name=? AND holder=?", (name, holder)))
+
+    def stats(self):
+        with self.lock:
+            return dict(self.con.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+    def close(self):
+        with self.lock:
+            self.con.close()